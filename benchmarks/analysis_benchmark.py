@@ -0,0 +1,233 @@
+import argparse
+
+parser = argparse.ArgumentParser(description='Time and memory benchmark of the analysis functions on synthetic corpora.')
+
+parser.add_argument('--sizes', '-s', action='store', type=int, nargs='+', default=[10000, 100000, 1000000], help='Numbers of synthetic tweets', required=False)
+parser.add_argument('--functions', '-f', action='store', type=str, nargs='+', help='Benchmarks to run (all by default, see --list)', required=False)
+parser.add_argument('--list', action='store_true', help='List the benchmarks and exit', required=False)
+parser.add_argument('--output', '-o', action='store', type=str, help='JSON file for the results (default: benchmarks/results/analysis-<date>.json)', required=False)
+parser.add_argument('--compare', action='store', type=str, help='JSON results of an earlier run to compare with, exits with 1 on a regression (a benchmark that passed before and now fails counts as one)', required=False)
+parser.add_argument('--threshold', action='store', type=float, default=1.25, help='Time or memory ratio to the earlier run counted as a regression', required=False)
+parser.add_argument('--no-memory', action='store_true', help='Time only, skip the tracemalloc run', required=False)
+parser.add_argument('--max-topics', action='store', type=int, default=20, help='max_topics for topic_extraction', required=False)
+parser.add_argument('--seed', action='store', type=int, default=2211, help='Seed of the synthetic corpus', required=False)
+
+args = parser.parse_args()
+
+## imports after argparse for performance saving
+
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+
+from helpers import feature_cache
+from tweet_statistics import extract_top_entities, get_char_count, number_by_sentiment, number_of
+from tweet_networks import (user_interaction, hashtag_interaction, hashtag_network_statistics,
+                            user_network_statistics, build_interaction_graph, get_network_information)
+from tweet_accumulator import accumulate
+from tweet_snapshot import export_snapshot, TweetSnapshot
+from text_analysis import topic_extraction, sentiment_analysis
+from benchmarks import synthetic_tweets
+from benchmarks.synthetic_tweets import make_tweets, TweetList
+
+"""
+Run from the repository root:
+python -m benchmarks.analysis_benchmark -s 10000 100000 1000000
+python -m benchmarks.analysis_benchmark -s 10000 100000 --compare benchmarks/results/analysis-<date>.json
+Each benchmark is run once timed (wall and CPU time) and once under tracemalloc
+(peak of the memory allocated by the function, the corpus itself is not counted).
+The feature cache is emptied before every run so each function pays for its own tokenizing.
+Results are written as JSON, one entry per benchmark and size, and can be compared with an earlier run.
+A failing benchmark is recorded with its error, its traceback printed, and the run exits with 1.
+"""
+
+RESULTS_VERSION = 1
+# smaller measures are too noisy to be compared
+MIN_SECONDS = 0.1
+MIN_BYTES = 2**20
+
+
+class Corpus:
+    """
+    Corpus holds the synthetic tweets of one size and the inputs of the benchmarks
+    that start from the output of another function (computed once, not timed)
+    """
+
+    def __init__(self, n):
+        self.tweets = TweetList(make_tweets(n, args.seed))
+        self.prepared = {}
+
+    def prepare(self, name, function):
+        if name not in self.prepared:
+            self.prepared[name] = function()
+        return self.prepared[name]
+
+    def user_network(self):
+        return self.prepare("user_network", lambda: user_interaction(self.tweets)[0])
+
+    def hashtag_network(self):
+        return self.prepare("hashtag_network", lambda: hashtag_interaction(self.tweets))
+
+    def snapshot(self):
+        def export():
+            self.snapshot_path = tempfile.mkdtemp(prefix="snapshot-")
+            export_snapshot(self.tweets, self.snapshot_path, verbose=False)
+            return TweetSnapshot(self.snapshot_path)
+        return self.prepare("snapshot", export)
+
+    def close(self):
+        if "snapshot" in self.prepared:
+            shutil.rmtree(self.snapshot_path, ignore_errors=True)
+
+
+def export_to_temporary(corpus):
+    path = tempfile.mkdtemp(prefix="snapshot-")
+    try:
+        return export_snapshot(corpus.tweets, path, verbose=False)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# name -> (setup(corpus) -> arguments, not timed; function(*arguments), timed)
+BENCHMARKS = {
+    "extract_top_entities": (lambda c: (c.tweets,), extract_top_entities),
+    "get_char_count": (lambda c: (c.tweets,), get_char_count),
+    "user_interaction": (lambda c: (c.tweets,), user_interaction),
+    "hashtag_interaction": (lambda c: (c.tweets,), hashtag_interaction),
+    "hashtag_network_statistics": (lambda c: (c.hashtag_network(),), hashtag_network_statistics),
+    "user_network_statistics": (lambda c: (c.user_network(),), user_network_statistics),
+    "user_network_statistics[sparse]": (lambda c: (c.user_network(),), lambda users: user_network_statistics(users, sparse=True)),
+    "build_interaction_graph[users]": (lambda c: (c.user_network(),), build_interaction_graph),
+    "build_interaction_graph[hashtags]": (lambda c: (c.hashtag_network(),), build_interaction_graph),
+    "get_network_information[compact]": (lambda c: (build_interaction_graph(c.user_network(), compact=True),), get_network_information),
+    "accumulate": (lambda c: (c.tweets,), accumulate),
+    "sentiment_analysis[lexicon]": (lambda c: (c.tweets,), lambda tweets: sentiment_analysis(tweets.find(), scorer="lexicon")),
+    "topic_extraction": (lambda c: (c.tweets,), lambda tweets: topic_extraction(tweets.find(), max_topics=args.max_topics)),
+    "export_snapshot": (lambda c: (c,), export_to_temporary),
+    "number_by_sentiment[snapshot]": (lambda c: (c.snapshot(),), number_by_sentiment),
+    "number_of[snapshot]": (lambda c: (c.snapshot(),), number_of),
+    "get_char_count[snapshot]": (lambda c: (c.snapshot(),), get_char_count),
+}
+
+
+def timed(function, arguments):
+    feature_cache.clear()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    function(*arguments)
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def traced(function, arguments):
+    feature_cache.clear()
+    tracemalloc.start()
+    try:
+        function(*arguments)
+        return tracemalloc.get_traced_memory()[1] # peak
+    finally:
+        tracemalloc.stop()
+
+
+def run(name, corpus, size):
+    setup, function = BENCHMARKS[name]
+    result = {"function": name, "size": size}
+    try:
+        arguments = setup(corpus)
+        result["seconds"], result["cpu_seconds"] = timed(function, arguments)
+        result["tweets_per_second"] = size / result["seconds"]
+        if not args.no_memory:
+            result["peak_memory_bytes"] = traced(function, arguments)
+    except Exception as e: # recorded and reported at the end, the other benchmarks still run
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+        traceback.print_exc()
+    return result
+
+
+def compare(results, path):
+    """
+    Prints the time and memory ratios to an earlier run
+    return number of regressions (slower, bigger, or failing where the earlier run passed)
+    """
+    with open(path) as f:
+        earlier = {(r["function"], r["size"]): r for r in json.load(f)["results"]}
+    print()
+    print("Compared with {} (regression: ratio above {:.2f})".format(path, args.threshold))
+    print("{:<36} {:>9} {:>10} {:>10}".format("benchmark", "size", "time", "memory"))
+    regressions = 0
+    for result in results:
+        before = earlier.get((result["function"], result["size"]))
+        if before is None or "error" in before:
+            continue
+        if "error" in result:
+            regressions += 1
+            print("{:<36} {:>9} {:>10} {:>10}  REGRESSION (failed: {})".format(result["function"], result["size"], "-", "-", result["error"]))
+            continue
+        ratios = [result["seconds"] / before["seconds"]]
+        if "peak_memory_bytes" in result and before.get("peak_memory_bytes"):
+            ratios.append(result["peak_memory_bytes"] / before["peak_memory_bytes"])
+        regressed = ratios[0] > args.threshold and result["seconds"] >= MIN_SECONDS
+        if len(ratios) > 1:
+            regressed |= ratios[1] > args.threshold and result["peak_memory_bytes"] >= MIN_BYTES
+        regressions += regressed
+        print("{:<36} {:>9} {:>9.2f}x {:>10}{}".format(result["function"], result["size"], ratios[0],
+              "{:.2f}x".format(ratios[1]) if len(ratios) > 1 else "-", "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+if args.list:
+    print("\n".join(BENCHMARKS))
+    sys.exit(0)
+
+names = args.functions or list(BENCHMARKS)
+unknown = [name for name in names if name not in BENCHMARKS]
+if unknown:
+    parser.error("unknown benchmarks: {} (see --list)".format(", ".join(unknown)))
+
+output = args.output or os.path.join("benchmarks", "results", "analysis-{:%Y%m%d-%H%M%S}.json".format(datetime.datetime.now()))
+report = {
+    "version": RESULTS_VERSION,
+    "created": datetime.datetime.now().isoformat(timespec="seconds"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "seed": args.seed,
+    "corpus": {name: getattr(synthetic_tweets, name) for name in dir(synthetic_tweets) if name.endswith(("_RATIO", "_EXPONENT"))},
+    "results": [],
+}
+
+print("{:<36} {:>9} {:>10} {:>10} {:>12} {:>12}".format("benchmark", "size", "wall (s)", "cpu (s)", "tweets/s", "peak (MB)"))
+for size in args.sizes:
+    start = time.perf_counter()
+    corpus = Corpus(size)
+    print("{} synthetic tweets generated in {:.1f}s".format(size, time.perf_counter() - start))
+    try:
+        for name in names:
+            result = run(name, corpus, size)
+            report["results"].append(result)
+            if "error" in result:
+                print("{:<36} {:>9} failed: {}".format(name, size, result["error"]))
+                continue
+            peak = "{:.1f}".format(result["peak_memory_bytes"] / 2**20) if "peak_memory_bytes" in result else "-"
+            print("{:<36} {:>9} {:>10.2f} {:>10.2f} {:>12.0f} {:>12}".format(
+                name, size, result["seconds"], result["cpu_seconds"], result["tweets_per_second"], peak))
+    finally:
+        corpus.close()
+    del corpus
+
+os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+with open(output, "w") as f:
+    json.dump(report, f, indent=1)
+print("Results written to {}".format(output))
+
+failed = [result for result in report["results"] if "error" in result]
+regressions = compare(report["results"], args.compare) if args.compare else 0
+if failed:
+    print("{} benchmark(s) failed: {}".format(len(failed), ", ".join("{} ({})".format(r["function"], r["size"]) for r in failed)))
+if failed or regressions:
+    sys.exit(1)
@@ -0,0 +1,66 @@
+import argparse
+
+parser = argparse.ArgumentParser(description='Scaling benchmark of tweet_networks.hashtag_network_statistics.')
+
+parser.add_argument('--sizes', '-s', action='store', type=int, nargs='+', default=[10000, 100000, 1000000], help='Numbers of hashtag lists to time', required=False)
+parser.add_argument('--check', action='store', type=int, default=2000, help='Compare with the reference implementation up to this many lists', required=False)
+
+args = parser.parse_args()
+
+## imports after argparse for performance saving
+
+import time
+import random
+import itertools
+
+from tweet_networks import hashtag_network_statistics
+
+"""
+Run from the repository root:
+python -m benchmarks.hashtag_statistics_benchmark -s 10000 100000 1000000
+"""
+
+
+def reference_hashtag_network_statistics(hashtags):
+    # hashtag_network_statistics() as it was before the inverted index: scans every visited list
+    ties = 0
+    visited = []
+    triads = 0
+    for tag_list in hashtags:
+        if len(tag_list) > 1:
+            if tag_list not in visited:
+                ties += sum(1 for ignore in itertools.combinations(tag_list, 2))
+                if len(tag_list) > 2:
+                    triads += sum(1 for ignore in itertools.combinations(tag_list, 3))
+                for h in tag_list:
+                    for other in tag_list:
+                        if h != other:
+                            for visited_list in visited:
+                                if other in visited_list:
+                                    triads += len(visited_list)-1
+                visited.append(tag_list)
+    return triads, ties
+
+
+def make_tag_lists(n, vocabulary=50000, seed=2211):
+    # Zipfian hashtag popularity, 1 to 6 hashtags per tweet
+    r = random.Random(seed)
+    tags = ["tag{}".format(i) for i in range(vocabulary)]
+    weights = list(itertools.accumulate(1/(i+1) for i in range(vocabulary)))
+    lengths = [1, 1, 1, 2, 2, 3, 4, 6]
+    return [sorted(r.choices(tags, cum_weights=weights, k=r.choice(lengths))) for _ in range(n)]
+
+
+small = make_tag_lists(args.check)
+assert hashtag_network_statistics(small) == reference_hashtag_network_statistics(small), "results differ from the reference"
+print("Same (triads, ties) as the reference on {} lists".format(args.check))
+
+previous = None
+for n in args.sizes:
+    tag_lists = make_tag_lists(n)
+    start = time.perf_counter()
+    triads, ties = hashtag_network_statistics(tag_lists)
+    elapsed = time.perf_counter() - start
+    growth = "" if previous is None else " x{:.1f} time for x{:.1f} lists".format(elapsed/previous[1], n/previous[0])
+    print("{:>9} lists {:>8.2f}s {:>12.0f} lists/s triads={} ties={}{}".format(n, elapsed, n/elapsed, triads, ties, growth))
+    previous = (n, elapsed)
@@ -0,0 +1,103 @@
+import argparse
+
+parser = argparse.ArgumentParser(description='Benchmark of the asyncio REST probes against a local stand-in for the Twitter API.')
+
+parser.add_argument('--time', '-t', action='store', type=float, default=10, help='Seconds to run each configuration for', required=False)
+parser.add_argument('--latency', '-l', action='store', type=float, default=0.2, help='Seconds the stand-in server takes to answer a request', required=False)
+parser.add_argument('--port', '-p', action='store', type=int, default=8765, help='Port of the stand-in server', required=False)
+
+args = parser.parse_args()
+
+## imports after argparse for performance saving
+
+import asyncio
+import itertools
+import random
+
+from aiohttp import web
+
+from crawl_frontier import CrawlFrontier
+from rest_probes import ProbeEngine, CONCURRENCY
+
+"""
+Run from the repository root:
+python -m benchmarks.probe_benchmark -t 10 -l 0.2
+Serves canned search, timeline and follower pages on localhost with a fixed latency,
+then runs the probes with one request in flight per probe (as the threaded crawler)
+and with the default concurrency, and compares the tweets collected per minute.
+"""
+
+PAGES = 5 # pages of results for every search or timeline
+ids = itertools.count(10**18, -1) # newer tweets first, as the API
+
+
+def canned_tweet(user):
+    tweet_id = next(ids)
+    return {"id": tweet_id, "id_str": str(tweet_id), "created_at": "Wed Mar 04 10:00:00 +0000 2020",
+            "full_text": "canned tweet about covid #covid", "truncated": False,
+            "user": {"id": user, "screen_name": "user{}".format(user), "followers_count": 100},
+            "entities": {"hashtags": [{"text": "covid"}], "user_mentions": []}}
+
+
+chains = {} # max_id of the next page of a search or timeline -> page number
+
+
+def page_of_tweets(request):
+    # 100 tweets per page, PAGES pages for every search or timeline
+    page = chains.pop(int(request.query["max_id"]), PAGES) if "max_id" in request.query else 0
+    if page >= PAGES:
+        return []
+    user = int(request.query.get("user_id", random.randrange(1000)))
+    tweets = [canned_tweet(user) for _ in range(100)]
+    chains[tweets[-1]["id"] - 1] = page + 1
+    return tweets
+
+
+def rate_headers():
+    return {"x-rate-limit-remaining": "100000", "x-rate-limit-limit": "100000", "x-rate-limit-reset": "9999999999"}
+
+
+async def search(request):
+    await asyncio.sleep(args.latency)
+    return web.json_response({"statuses": page_of_tweets(request), "search_metadata": {}}, headers=rate_headers())
+
+
+async def timeline(request):
+    await asyncio.sleep(args.latency)
+    return web.json_response(page_of_tweets(request), headers=rate_headers())
+
+
+async def user_ids(request):
+    await asyncio.sleep(args.latency)
+    return web.json_response({"ids": list(range(50))}, headers=rate_headers())
+
+
+async def run_probes(concurrency):
+    app = web.Application()
+    app.router.add_get('/search/tweets.json', search)
+    app.router.add_get('/statuses/user_timeline.json', timeline)
+    app.router.add_get('/followers/ids.json', user_ids)
+    app.router.add_get('/friends/ids.json', user_ids)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', args.port).start()
+
+    hashtags = CrawlFrontier()
+    users = CrawlFrontier()
+    for i in range(10000):
+        hashtags.put("hashtag{}".format(i))
+        users.put(i)
+    engine = ProbeEngine(lambda tweet: None, base_url="http://localhost:{}".format(args.port), concurrency=concurrency)
+    try:
+        return await engine.run(args.time, hashtags, users, locations=["51.5287352,-0.3817825,100km"])
+    finally:
+        await runner.cleanup()
+
+
+print("Stand-in server answering in {:.0f}ms, {:.0f}s per configuration".format(args.latency * 1000, args.time))
+for name, concurrency in [("one request per probe", {endpoint: 1 for endpoint in CONCURRENCY}),
+                          ("default concurrency", CONCURRENCY),
+                          ("4x default concurrency", {endpoint: 4 * n for endpoint, n in CONCURRENCY.items()})]:
+    requests, tweets, errors = asyncio.run(run_probes(concurrency))
+    print("{:<24} {:>7} requests {:>9} tweets {:>4} errors {:>10.0f} tweets/minute".format(
+        name, requests, tweets, errors, tweets / args.time * 60))
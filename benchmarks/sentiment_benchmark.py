@@ -0,0 +1,60 @@
+import argparse
+
+parser = argparse.ArgumentParser(description='Benchmark of the lexicon sentiment scorer against TextBlob.')
+
+parser.add_argument('--number', '-n', action='store', type=int, default=20000, help='Number of synthetic texts to score', required=False)
+parser.add_argument('--workers', '-w', action='store', type=int, default=4, help='Number of processes for the lexicon scorer', required=False)
+
+args = parser.parse_args()
+
+## imports after argparse for performance saving
+
+import time
+import random
+
+from helpers import find_sentiment_tb
+from sentiment_scorer import LexiconScorer, score_batch, agreement_report
+
+"""
+Run from the repository root:
+python -m benchmarks.sentiment_benchmark -n 20000 -w 4
+"""
+
+COMMON = ["covid", "virus", "people", "lockdown", "hospital", "home", "news", "mask", "health", "vaccine"]
+
+
+def make_texts(n, seed=2211):
+    # tokenized-looking texts: common words, lexicon words, some modifiers and negations
+    r = random.Random(seed)
+    scorer = LexiconScorer()
+    lexicon = sorted(scorer.index)
+    special = sorted(scorer.special)
+    texts = []
+    for _ in range(n):
+        words = [r.choice(COMMON) for _ in range(r.randint(2, 10))]
+        words += [r.choice(lexicon) for _ in range(r.randint(0, 4))]
+        if r.random() < 0.2:
+            words.append(r.choice(special))
+        r.shuffle(words)
+        texts.append(' '.join(words))
+    return texts
+
+
+texts = make_texts(args.number)
+print("Scoring {} texts".format(len(texts)))
+
+start = time.perf_counter()
+expected = [find_sentiment_tb(t) for t in texts]
+base = time.perf_counter() - start
+print("{:<28} {:>8.2f}s {:>10.0f} texts/s".format("TextBlob (per text)", base, len(texts)/base))
+
+for workers in sorted({1, args.workers}):
+    start = time.perf_counter()
+    scores = score_batch(texts, workers=workers)
+    elapsed = time.perf_counter() - start
+    print("{:<28} {:>8.2f}s {:>10.0f} texts/s ({:.1f}x)".format("lexicon ({} workers)".format(workers), elapsed, len(texts)/elapsed, base/elapsed))
+
+agreement, confusion = agreement_report(texts, scores)
+print("Agreement with TextBlob: {:.2%}".format(agreement))
+for (tb, lexicon), count in sorted(confusion.items()):
+    print("  TextBlob {:>2} / lexicon {:>2}: {}".format(tb, lexicon, count))
@@ -0,0 +1,190 @@
+import datetime
+import itertools
+
+import numpy as np
+
+"""
+Synthetic corpus of JSON Tweets for the analysis benchmarks, shaped like the crawled collections:
+retweets, quotes, replies and truncated (extended) tweets in fixed proportions,
+words, hashtags, mentions and tweeting users drawn from Zipf distributions
+(a few hashtags and accounts are everywhere, most are seen once or twice),
+and popular tweets retweeted many times (retweets share their retweeted_status dictionary).
+The same seed always gives the same corpus.
+"""
+
+# share of tweets in a crawled collection
+RETWEET_RATIO = 0.55
+QUOTE_RATIO = 0.10 # of the tweets that are not retweets
+REPLY_RATIO = 0.15 # of the tweets that are not retweets
+TRUNCATED_RATIO = 0.30 # of the tweets that are not retweets: text longer than 140 characters
+SENTIMENTS = {-1: 0.25, 0: 0.45, 1: 0.30}
+
+# Zipf exponents
+WORD_EXPONENT = 1.0
+HASHTAG_EXPONENT = 1.1
+MENTION_EXPONENT = 1.2
+TWEETER_EXPONENT = 0.9
+RETWEETED_EXPONENT = 1.1
+
+TOPIC_WORDS = ["covid", "virus", "lockdown", "stay", "home", "people", "health", "mask", "hospital",
+               "vaccine", "news", "cases", "government", "test", "spread", "school", "work", "family"]
+SYLLABLES = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"]
+EXTRAS = ["https://t.co/abc123", "&amp;", "😷", "😂", "..."]
+
+
+def zipf_weights(n, exponent):
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def make_words(n, rng):
+    # made-up words of 2 or 3 syllables (letters only so they survive tokenize), topic words ranked first
+    words = list(TOPIC_WORDS)
+    seen = set(words)
+    while len(words) < n:
+        word = "".join(rng.choice(SYLLABLES, rng.integers(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class TweetFactory:
+    """
+    TweetFactory draws the words, hashtags and users of n tweets in bulk (numpy) and builds the dictionaries.
+    Vocabulary, hashtags and users grow with n, as they do in a longer crawl.
+    """
+
+    def __init__(self, n, seed=2211):
+        self.rng = np.random.default_rng(seed)
+        self.words = make_words(max(2000, min(50000, n // 20)), self.rng)
+        self.hashtags = ["".join(self.rng.choice(SYLLABLES, self.rng.integers(2, 4))) + str(i) for i in range(max(200, n // 50))]
+        self.users = ["user{}".format(i) for i in range(max(1000, n // 5))]
+        self.ids = itertools.count(1240000000000000000)
+        self.created_at = datetime.datetime(2020, 3, 4)
+
+    def draw(self, population, exponent, counts):
+        # counts[i] items for tweet i, one Zipf draw for all of them
+        flat = self.rng.choice(len(population), int(counts.sum()), p=zipf_weights(len(population), exponent))
+        return np.split(flat, np.cumsum(counts)[:-1])
+
+    def statuses(self, n):
+        """
+        n tweets that are not retweets
+        """
+        rng = self.rng
+        words = self.draw(self.words, WORD_EXPONENT, rng.integers(5, 26, n))
+        hashtags = self.draw(self.hashtags, HASHTAG_EXPONENT, rng.choice([0, 0, 1, 1, 2, 3, 4], n))
+        mentions = self.draw(self.users, MENTION_EXPONENT, rng.choice([0, 0, 0, 1, 1, 2], n))
+        tweeters = self.draw(self.users, TWEETER_EXPONENT, np.ones(n, dtype=int))
+        repliers = self.draw(self.users, MENTION_EXPONENT, np.ones(n, dtype=int))
+        kinds = rng.random((n, 3)) # quote, reply, truncated
+        sentiments = rng.choice(list(SENTIMENTS), n, p=list(SENTIMENTS.values()))
+        capitalised = rng.random(n) < 0.2
+        extras = rng.random(n) < 0.3
+
+        tweets = []
+        for i in range(n):
+            tags = list(dict.fromkeys(self.hashtags[h] for h in hashtags[i])) # a hashtag or mention once per tweet
+            if capitalised[i]:
+                tags = [t.upper() for t in tags] # same hashtag once lowercased
+            names = list(dict.fromkeys(self.users[u] for u in mentions[i]))
+            text = " ".join([self.words[w] for w in words[i]] + ["#" + t for t in tags] + ["@" + u for u in names])
+            if extras[i]:
+                text += " " + EXTRAS[i % len(EXTRAS)]
+            entities = {"hashtags": [{"text": t} for t in tags], "user_mentions": [{"screen_name": u} for u in names]}
+            tweet = self.tweet(self.users[tweeters[i][0]], int(sentiments[i]))
+            if kinds[i, 2] < TRUNCATED_RATIO:
+                text = text + " " + " ".join(self.words[w] for w in words[i][::-1]) # long enough to be extended
+                tweet["truncated"] = True
+                tweet["text"] = text[:139] + "…"
+                tweet["entities"] = {"hashtags": [], "user_mentions": []}
+                tweet["extended_tweet"] = {"full_text": text, "entities": entities}
+            else:
+                tweet["full_text"] = text
+                tweet["entities"] = entities
+            if kinds[i, 0] < QUOTE_RATIO:
+                tweet["is_quote_status"] = True
+                tweet["quoted_status"] = {"id": next(self.ids), "user": {"screen_name": self.users[repliers[i][0]]}}
+            if kinds[i, 1] < REPLY_RATIO:
+                tweet["in_reply_to_screen_name"] = self.users[repliers[i][0]]
+                tweet["in_reply_to_status_id"] = next(self.ids)
+            tweets.append(tweet)
+        return tweets
+
+    def tweet(self, screen_name, sentiment):
+        tweet_id = next(self.ids)
+        self.created_at += datetime.timedelta(milliseconds=50)
+        return {"id": tweet_id, "id_str": str(tweet_id), "created_at": self.created_at,
+                "user": {"screen_name": screen_name, "followers_count": 100},
+                "truncated": False, "is_quote_status": False,
+                "in_reply_to_screen_name": None, "in_reply_to_status_id": None,
+                "sentiment": sentiment}
+
+    def retweets(self, n, originals):
+        """
+        n retweets of originals, popular originals retweeted more
+        """
+        picked = self.draw(originals, RETWEETED_EXPONENT, np.ones(n, dtype=int))
+        tweeters = self.draw(self.users, TWEETER_EXPONENT, np.ones(n, dtype=int))
+        tweets = []
+        for i in range(n):
+            original = originals[picked[i][0]]
+            original["retweet_count"] += 1
+            rt_user = original["user"]["screen_name"]
+            body = original["extended_tweet"] if original["truncated"] else original
+            tweet = self.tweet(self.users[tweeters[i][0]], original["sentiment"]) # same text, same sentiment
+            tweet["full_text"] = "RT @{}: {}".format(rt_user, original.get("full_text") or original["text"])
+            tweet["entities"] = {"hashtags": body["entities"]["hashtags"],
+                                 "user_mentions": [{"screen_name": rt_user}] + body["entities"]["user_mentions"]}
+            tweet["retweeted_status"] = original
+            tweets.append(tweet)
+        return tweets
+
+
+def make_tweets(n, seed=2211):
+    """
+    :n -> number of tweets
+    return list of JSON Tweets (with _id and sentiment, as in the collections analysed), in random order
+    """
+    factory = TweetFactory(n, seed)
+    n_retweets = int(n * RETWEET_RATIO)
+    tweets = factory.statuses(n - n_retweets)
+    # retweeted statuses are tweets of the crawl as well as tweets from before it
+    originals = factory.statuses(max(1, n // 20)) + tweets[:n // 10]
+    for original in originals:
+        original["retweet_count"] = int(factory.rng.integers(0, 50))
+    tweets += factory.retweets(n_retweets, originals)
+    order = factory.rng.permutation(len(tweets))
+    tweets = [tweets[i] for i in order]
+    for i, tweet in enumerate(tweets):
+        tweet["_id"] = i
+    return tweets
+
+
+class TweetList:
+    """
+    TweetList stands in for a MongoDB collection of tweets in memory:
+    find() understands the sentiment conditions of the analysis functions (value, $exists, $in)
+    and returns whole documents (projections are ignored).
+    """
+
+    def __init__(self, tweets):
+        self.tweets = tweets
+
+    def find(self, query={}, projection=None):
+        condition = query.get("sentiment", {"$exists": True}) if query else None
+        if query and set(query) != {"sentiment"}:
+            raise ValueError("TweetList only filters on sentiment: {}".format(query))
+        if condition is None:
+            return iter(self.tweets)
+        if not isinstance(condition, dict):
+            return (t for t in self.tweets if t.get("sentiment") == condition)
+        if "$in" in condition:
+            values = set(condition["$in"])
+            return (t for t in self.tweets if t.get("sentiment") in values)
+        exists = condition.get("$exists", True)
+        return (t for t in self.tweets if ("sentiment" in t) == exists)
+
+    def __len__(self):
+        return len(self.tweets)
@@ -0,0 +1,73 @@
+import argparse
+
+parser = argparse.ArgumentParser(description='Micro-benchmark of helpers.tokenize against helpers.tokenize_batch.')
+
+parser.add_argument('--number', '-n', action='store', type=int, default=50000, help='Number of synthetic texts to tokenize', required=False)
+parser.add_argument('--workers', '-w', action='store', type=int, default=4, help='Number of processes for tokenize_batch', required=False)
+
+args = parser.parse_args()
+
+## imports after argparse for performance saving
+
+import re
+import time
+import random
+
+import emoji
+from nltk.tokenize import word_tokenize
+
+from helpers import tokenize, tokenize_batch, stop_words
+
+"""
+Run from the repository root:
+python -m benchmarks.tokenize_benchmark -n 50000 -w 4
+"""
+
+WORDS = ["covid", "virus", "stay", "home", "the", "and", "is", "lockdown", "news", "facebook",
+         "hospital", "vaccine", "amp", "im", "wanna", "people", "health", "mask", "&amp;", "it's"]
+EXTRAS = ["http://t.co/abc123", "www.who.int", "@WHO", "@user_1", "#COVID19", "#StayHome", "😷", "😂", "café", "..."]
+
+
+def reference_tokenize(text):
+    # tokenize() as it was before the batch engine: uncompiled regexes, char-by-char ASCII filter, list lookup
+    text = text.lower()
+    text = re.sub('((www\.[^\s]+)|(https?://[^\s]+))', 'URL', text)
+    text = re.sub('face', '', emoji.demojize(text))
+    text = re.sub('[:_]+', ' ', text)
+    text = re.sub('@[^\s]+', 'AT_USER', text)
+    text = re.sub(r'#([^\s]+)', r'\1', text)
+    text = re.sub('[^a-zA-Z ]+', ' ', text)
+    text = "".join(i for i in text if ord(i)<128)
+    text = text.strip()
+    return ' '.join(t for t in word_tokenize(text) if t not in stop_words)
+
+
+def make_texts(n, seed=2211):
+    r = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        words = [r.choice(WORDS) for _ in range(r.randint(5, 25))]
+        words += [r.choice(EXTRAS) for _ in range(r.randint(0, 4))]
+        r.shuffle(words)
+        texts.append(' '.join(words))
+    return texts
+
+
+def timed(name, f, texts, baseline=None):
+    start = time.perf_counter()
+    tokens = f(texts)
+    elapsed = time.perf_counter() - start
+    speedup = "" if baseline is None else " ({:.1f}x)".format(baseline/elapsed)
+    print("{:<32} {:>8.2f}s {:>10.0f} texts/s{}".format(name, elapsed, len(texts)/elapsed, speedup))
+    return tokens, elapsed
+
+
+texts = make_texts(args.number)
+print("Tokenizing {} texts".format(len(texts)))
+
+expected, base = timed("reference tokenize (per text)", lambda ts: [reference_tokenize(t) for t in ts], texts)
+current, _ = timed("tokenize (per text)", lambda ts: [tokenize(t) for t in ts], texts, base)
+single, _ = timed("tokenize_batch (1 worker)", lambda ts: tokenize_batch(ts, workers=1), texts, base)
+multi, _ = timed("tokenize_batch ({} workers)".format(args.workers), lambda ts: tokenize_batch(ts, workers=args.workers), texts, base)
+
+assert expected == current == single == multi, "tokenize_batch does not match tokenize"
@@ -0,0 +1,161 @@
+import hashlib
+import heapq
+import math
+import os
+import pickle
+import threading
+
+# file for the crawl frontier of the hybrid crawler:
+# users and hashtags waiting to be crawled, highest priority first,
+# with a Bloom filter of everything already crawled so it is not crawled again,
+# saved to disk so the next run resumes where this one stopped
+
+
+class BloomFilter:
+    """
+    BloomFilter is a fixed-size set of hashes: no false negatives,
+    false positives (an item not added reported as seen) at about error_rate once capacity items are added.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2)) # number of bits
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.bits_set = 0
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(str(item).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)] # double hashing
+
+    def add(self, item):
+        """
+        return True if item was (probably) added before
+        """
+        seen = True
+        for p in self._positions(item):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                self.bits[p >> 3] |= 1 << (p & 7)
+                self.bits_set += 1
+                seen = False
+        if not seen:
+            self.count += 1
+        return seen
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def __len__(self):
+        return self.count # items added, not counting the ones reported as seen
+
+    def false_positive_rate(self):
+        """
+        Probability that an item never added is reported as seen, given the bits set so far
+        """
+        return (self.bits_set / self.size) ** self.hashes
+
+
+class CrawlFrontier:
+    """
+    CrawlFrontier is a thread-safe priority queue of users or hashtags to crawl.
+    put() adds weight to the priority of an item (seen again, more followers -> crawled sooner),
+    get() blocks until an item is available and returns the highest priority one, marking it as crawled.
+    At most maxsize items wait: the lowest priority ones are dropped beyond that.
+    With a path, the frontier is loaded from it and save() writes it back.
+    """
+
+    def __init__(self, maxsize=100000, capacity=1000000, error_rate=0.001, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.priorities = {} # waiting item -> priority
+        self.heap = [] # (-priority, order, item), entries with an old priority are skipped
+        self.order = 0
+        self.seen = BloomFilter(capacity, error_rate)
+        self.closed = False
+        self.condition = threading.Condition()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def put(self, item, weight=1):
+        """
+        :weight -> added to the priority of item, ignored if item was already crawled
+        return True if item is waiting to be crawled
+        """
+        with self.condition:
+            if item in self.seen:
+                return False
+            priority = self.priorities.get(item, 0) + weight
+            self.priorities[item] = priority
+            self._push(item, priority)
+            if len(self.priorities) > self.maxsize:
+                self._trim(int(self.maxsize * 0.9)) # not on every put
+            elif len(self.heap) > 2 * self.maxsize: # too many entries with an old priority
+                self._trim(self.maxsize)
+            self.condition.notify()
+            return True
+
+    def _push(self, item, priority):
+        heapq.heappush(self.heap, (-priority, self.order, item))
+        self.order += 1 # same priority: first added first
+
+    def _trim(self, size):
+        # keep the size highest priorities and rebuild the heap without old entries
+        keep = heapq.nlargest(size, self.priorities.items(), key=lambda entry: entry[1])
+        self.priorities = dict(keep)
+        self.heap = []
+        for item, priority in keep:
+            self._push(item, priority)
+
+    def get(self, block=True, timeout=None):
+        """
+        Highest priority item, marked as crawled
+        return item, or None if the frontier is closed (or empty and not blocking, or timed out)
+        """
+        with self.condition:
+            while not self.closed:
+                while self.heap:
+                    negative, _, item = heapq.heappop(self.heap)
+                    if self.priorities.get(item) == -negative: # latest priority of a waiting item
+                        del self.priorities[item]
+                        self.seen.add(item)
+                        return item
+                if not block or not self.condition.wait(timeout):
+                    return None
+            return None
+
+    def close(self):
+        """
+        Wakes every thread waiting in get(), which returns None from now on
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def qsize(self):
+        return len(self.priorities)
+
+    def empty(self):
+        return not self.priorities
+
+    def save(self, path=None):
+        path = path or self.path
+        with self.condition:
+            state = {"priorities": self.priorities, "seen": self.seen}
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(state, f)
+        os.replace(path + ".tmp", path) # a crash while saving keeps the previous file
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        with self.condition:
+            self.seen = state["seen"]
+            self.priorities = {}
+            self.heap = []
+            for item, priority in state["priorities"].items():
+                self.priorities[item] = priority
+                self._push(item, priority)
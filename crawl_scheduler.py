@@ -0,0 +1,117 @@
+import threading
+import time
+
+# file for sharing the Twitter REST rate limits between crawler threads
+# every endpoint has a token bucket holding the requests left in its 15 minute window:
+# threads block until a request is available instead of polling,
+# and the buckets are refilled from rate_limit_status()
+
+WINDOW = 15 * 60 # seconds in a rate limit window
+
+# endpoint -> (resource family, resource) in rate_limit_status()
+ENDPOINTS = {
+    'search': ('search', '/search/tweets'),
+    'user_timeline': ('statuses', '/statuses/user_timeline'),
+    'followers': ('followers', '/followers/ids'),
+    'friends': ('friends', '/friends/ids'),
+}
+
+
+class TokenBucket:
+    """
+    TokenBucket holds the requests left for one endpoint until its window resets.
+    acquire() takes one request, waiting for the reset (or an update) when there is none left.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.limit = 0
+        self.tokens = 0
+        self.reset = None # time the window resets, unknown until the first update
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def update(self, remaining, limit, reset):
+        """
+        :remaining, limit, reset -> requests left, requests per window, reset time (epoch seconds)
+        """
+        with self.condition:
+            self.tokens = remaining
+            self.limit = limit
+            self.reset = reset
+            self.condition.notify_all()
+
+    def acquire(self):
+        """
+        Blocks until a request is available
+        return True, or False if the bucket was closed while waiting
+        """
+        with self.condition:
+            while not self.closed:
+                now = time.time()
+                if self.reset is not None and now >= self.reset: # new window: full budget
+                    self.tokens = self.limit
+                    self.reset = now + self.window
+                if self.tokens > 0:
+                    self.tokens -= 1
+                    return True
+                self.condition.wait(None if self.reset is None else self.reset - now)
+            return False
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class RateLimitScheduler:
+    """
+    RateLimitScheduler keeps one TokenBucket per endpoint and refreshes them from the API.
+    Crawler threads call acquire(endpoint) before every request,
+    the main thread calls run(until) which refreshes the budgets until the crawl ends.
+    """
+
+    def __init__(self, api, endpoints=ENDPOINTS, refresh_interval=60, verbose=False):
+        self.api = api
+        self.endpoints = endpoints
+        self.buckets = {name: TokenBucket() for name in endpoints}
+        self.refresh_interval = refresh_interval # rate_limit_status has its own limit (180 per window)
+        self.verbose = verbose
+        self.stopped = threading.Event()
+
+    def refresh(self):
+        limits = self.api.rate_limit_status()
+        for name, (family, resource) in self.endpoints.items():
+            rate = limits['resources'][family][resource]
+            self.buckets[name].update(rate['remaining'], rate['limit'], rate['reset'])
+            if self.verbose:
+                print("{}: {} requests left".format(resource, rate['remaining']))
+        if self.verbose:
+            print()
+
+    def acquire(self, endpoint):
+        """
+        Blocks until a request to endpoint is available
+        return True, or False once the scheduler is stopped
+        """
+        return self.buckets[endpoint].acquire()
+
+    def run(self, until):
+        """
+        Refreshes the budgets every refresh_interval seconds until the datetime until (or stop())
+        """
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e: # budgets keep counting down from the last refresh
+                print("Could not refresh rate limits: {}".format(e))
+            left = (until - until.now(until.tzinfo)).total_seconds()
+            if left <= 0 or self.stopped.wait(min(self.refresh_interval, left)):
+                break
+        self.stop()
+
+    def stop(self):
+        self.stopped.set()
+        for bucket in self.buckets.values():
+            bucket.close()
+
@@ -0,0 +1,29 @@
+import argparse
+
+parser = argparse.ArgumentParser(description='Export a collection of twitter_db in MongoDB to a columnar snapshot.')
+
+parser.add_argument('--collection', '-c', action='store', type=str, help='Name of the collection in MongoDB.twitter_db to export', required=True)
+parser.add_argument('--output', '-o', action='store', type=str, help='Directory to write the snapshot to (default: snapshots/<collection>)', required=False)
+
+args = parser.parse_args()
+collection = args.collection
+output = args.output
+
+## imports after argparse for performance saving
+
+import os
+import time
+
+from tweet_snapshot import export_snapshot
+
+from pymongo import MongoClient
+
+client = MongoClient()
+db = client.twitter_db
+
+if not output:
+    output = os.path.join("snapshots", collection)
+
+start = time.time()
+count = export_snapshot(db[collection], output)
+print("Exported collection {} to {} in {:.1f}s ({} tweets)".format(collection, output, time.time() - start, count))
@@ -4,7 +4,14 @@ from textblob import TextBlob
 import emoji
 
 import re
+import os
+import math
+import time
 import queue
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 class SetQueue(queue.Queue):
     """
@@ -28,6 +35,7 @@ class SetQueue(queue.Queue):
 
 
 stop_words = stopwords.words('english') + ["AT_USER", "ATUSER", "URL", "AT", "USER"] + ["amp", "im"]
+stop_word_set = frozenset(stop_words) # hashed lookup for tokenize()
 
 
 def parse_tweet(tweet):
@@ -43,6 +51,12 @@ def parse_tweet(tweet):
     return text
 
 
+# fields parse_tweet() (and the feature cache key) need, to avoid pulling whole tweets from MongoDB
+TEXT_PROJECTION = ["id", "text", "full_text", "truncated", "extended_tweet.full_text",
+                   "retweeted_status.id", "retweeted_status.text", "retweeted_status.full_text",
+                   "retweeted_status.truncated", "retweeted_status.extended_tweet.full_text"]
+
+
 def get_body(tweet):
     if tweet.get("retweeted_status"):
         tweet = tweet["retweeted_status"]
@@ -53,21 +67,48 @@ def get_body(tweet):
     return text
 
 
-def _removeNonAscii(s):
-    return "".join(i for i in s if ord(i)<128)
+# substitution rules compiled once, applied in order by clean_text()
+_URL = re.compile(r'((www\.[^\s]+)|(https?://[^\s]+))')
+_FACE = re.compile('face')
+_EMOJI_SEPARATORS = re.compile('[:_]+')
+_USERNAME = re.compile(r'@[^\s]+')
+_HASHTAG = re.compile(r'#([^\s]+)')
+_NON_ALPHA = re.compile('[^a-zA-Z ]+')
+
+# ASCII characters other than letters and spaces become spaces
+_NON_ALPHA_TABLE = {i: ' ' for i in range(128) if not (chr(i).isalpha() or chr(i) == ' ')}
+
+
+# emoji sequences never contain whitespace, so only words with non-ASCII characters need demojize
+_NON_ASCII_WORD = re.compile(r'\S*[^\x00-\x7f]\S*')
+
+
+@lru_cache(maxsize=65536)
+def _demojize_cached(word):
+    return emoji.demojize(word)
+
+
+def _demojize_word(match):
+    return _demojize_cached(match.group())
 
 
 def clean_text(text):
     # some substitution rules taken from
     # https://towardsdatascience.com/creating-the-twitter-sentiment-analysis-program-in-python-with-naive-bayes-classification-672e5589a7ed
     text = text.lower()
-    text = re.sub('((www\.[^\s]+)|(https?://[^\s]+))', 'URL', text) # remove URLs
-    text = re.sub('face', '', emoji.demojize(text)) # turn emojis to text but remove "face"
-    text = re.sub('[:_]+', ' ', text) # remove _, : from emoji tokenization
-    text = re.sub('@[^\s]+', 'AT_USER', text) # remove usernames
-    text = re.sub(r'#([^\s]+)', r'\1', text) # remove the # in #hashtag
-    text = re.sub('[^a-zA-Z ]+', ' ', text) # keep only spaces and alphanumeric characters
-    text = _removeNonAscii(text)
+    text = _URL.sub('URL', text) # remove URLs
+    if not text.isascii(): # ASCII text has no emojis
+        text = _NON_ASCII_WORD.sub(_demojize_word, text)
+    text = _FACE.sub('', text) # turn emojis to text but remove "face"
+    text = _EMOJI_SEPARATORS.sub(' ', text) # remove _, : from emoji tokenization
+    text = _USERNAME.sub('AT_USER', text) # remove usernames
+    text = _HASHTAG.sub(r'\1', text) # remove the # in #hashtag
+    # keep only spaces and alphanumeric characters (this drops non-ASCII too),
+    # runs of spaces are left for word_tokenize
+    if text.isascii():
+        text = text.translate(_NON_ALPHA_TABLE)
+    else:
+        text = _NON_ALPHA.sub(' ', text)
     text = text.strip()
     return text
 
@@ -75,10 +116,36 @@ def clean_text(text):
 def tokenize(text):
     text = clean_text(text)
     tokens = word_tokenize(text)
-    tokens = [t for t in tokens if t not in stop_words]
+    tokens = [t for t in tokens if t not in stop_word_set]
     return ' '.join(tokens)
 
 
+def _tokenize_chunk(texts):
+    return [tokenize(text) for text in texts]
+
+
+def tokenize_batch(texts, workers=None, chunksize=None, executor=None):
+    """
+    Tokenize many texts at once, same output as [tokenize(t) for t in texts]
+    :texts -> list of texts
+    :workers -> number of processes to spread chunks over (default: number of CPUs, 1 runs in this process)
+    :chunksize -> number of texts sent to a process at a time (default: the texts split evenly over the workers)
+    :executor -> ProcessPoolExecutor of workers processes to reuse across calls, one is started per call otherwise
+    """
+    texts = list(texts)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(texts) < 2:
+        return _tokenize_chunk(texts)
+
+    chunksize = chunksize or math.ceil(len(texts) / workers)
+    chunks = [texts[i:i+chunksize] for i in range(0, len(texts), chunksize)]
+    if executor is not None:
+        return [tokens for chunk in executor.map(_tokenize_chunk, chunks) for tokens in chunk]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [tokens for chunk in executor.map(_tokenize_chunk, chunks) for tokens in chunk]
+
+
 def find_sentiment_tb(tweet):
     """
     Get the overall sentiment from a tweet (or text)
@@ -96,6 +163,163 @@ def find_sentiment_tb(tweet):
     return score
 
 
+class FeatureCache:
+    """
+    FeatureCache keeps the tokens and sentiment of tweets already analysed.
+    Retweets share the text of their original status so they are keyed by
+    the original status id (or by a hash of the text when there is no id).
+    Least recently used entries are evicted once maxsize is reached.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.tokenize_seconds = 0.0 # time spent tokenizing and scoring the misses
+        self.sentiment_seconds = 0.0
+
+    def key(self, tweet, text):
+        status = tweet.get("retweeted_status") or tweet
+        if status.get("id") is not None:
+            return status["id"]
+        return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+    def _entry(self, tweet):
+        text = parse_tweet(tweet)
+        k = self.key(tweet, text)
+        entry = self.entries.get(k)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(k)
+            return entry
+        self.misses += 1
+        start = time.perf_counter()
+        entry = [tokenize(text), None] # sentiment is only computed when asked for
+        self.tokenize_seconds += time.perf_counter() - start
+        self.entries[k] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def _entries(self, tweets, workers=1, executor=None):
+        # entries of many tweets, the misses tokenized together by tokenize_batch()
+        keys = []
+        found = {}
+        missing = OrderedDict() # key -> text, each new text tokenized once
+        for tweet in tweets:
+            text = parse_tweet(tweet)
+            k = self.key(tweet, text)
+            keys.append(k)
+            if k in found or k in missing:
+                self.hits += 1
+                continue
+            entry = self.entries.get(k)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(k)
+                found[k] = entry
+            else:
+                self.misses += 1
+                missing[k] = text
+        if missing:
+            start = time.perf_counter()
+            tokens = tokenize_batch(list(missing.values()), workers=workers, executor=executor)
+            self.tokenize_seconds += time.perf_counter() - start
+            for k, t in zip(missing, tokens):
+                found[k] = self.entries[k] = [t, None]
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return [found[k] for k in keys]
+
+    def tokens(self, tweet):
+        """
+        Same output as tokenize(parse_tweet(tweet))
+        """
+        return self._entry(tweet)[0]
+
+    def tokens_batch(self, tweets, workers=1, executor=None):
+        """
+        Same output as [self.tokens(t) for t in tweets], the misses tokenized with tokenize_batch()
+        :workers, executor -> processes tokenize_batch() spreads the misses over
+        """
+        return [entry[0] for entry in self._entries(tweets, workers, executor)]
+
+    def sentiment(self, tweet):
+        """
+        Same output as find_sentiment_tb(tokenize(parse_tweet(tweet)))
+        """
+        entry = self._entry(tweet)
+        if entry[1] is None:
+            start = time.perf_counter()
+            entry[1] = find_sentiment_tb(entry[0])
+            self.sentiment_seconds += time.perf_counter() - start
+        return entry[1]
+
+    def sentiment_batch(self, tweets, workers=1, executor=None):
+        """
+        Same output as [self.sentiment(t) for t in tweets], the misses tokenized with tokenize_batch()
+        """
+        entries = self._entries(tweets, workers, executor)
+        start = time.perf_counter()
+        for entry in entries:
+            if entry[1] is None:
+                entry[1] = find_sentiment_tb(entry[0])
+        self.sentiment_seconds += time.perf_counter() - start
+        return [entry[1] for entry in entries]
+
+    def put(self, tweet, tokens):
+        """
+        Keep tokens computed elsewhere (e.g. read back from a snapshot) so they are not tokenized again
+        :tokens -> same string as tokenize(parse_tweet(tweet))
+        """
+        k = self.key(tweet, parse_tweet(tweet))
+        if k not in self.entries:
+            self.entries[k] = [tokens, None]
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits/lookups if lookups else 0
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.tokenize_seconds = 0.0
+        self.sentiment_seconds = 0.0
+
+
+feature_cache = FeatureCache() # shared by the analysis modules
+
+
+# indexes the analysis queries rely on: per-sentiment reads and counts
+ANALYSIS_INDEXES = [
+    [("sentiment", 1)],
+    [("sentiment", 1), ("is_quote_status", 1), ("in_reply_to_status_id", 1)],
+]
+
+
+def ensure_indexes(collection, indexes=ANALYSIS_INDEXES, verbose=True):
+    """
+    Create the indexes the analysis relies on if they are missing
+    :collection -> MongoDB collection reference
+    :indexes -> list of index key lists
+    return names of the indexes that were created
+    """
+    existing = collection.index_information()
+    created = []
+    for keys in indexes:
+        name = "_".join("{}_{}".format(field, direction) for field, direction in keys)
+        if name not in existing:
+            created.append(collection.create_index(keys, name=name))
+    if verbose:
+        for name in collection.index_information():
+            print("Index {}{}".format(name, " (created)" if name in created else ""))
+    return created
+
+
 def get_top_n_items(s, n=10):
     """
     Function to return top n items from a paired structure
@@ -4,6 +4,8 @@ parser = argparse.ArgumentParser(description='Crawl tweets for one hour and stor
 
 parser.add_argument('--collection', '-c', action='store', type=str, help='Name of the collection to store the data in (in MongoDB.twitter_db)', required=True)
 parser.add_argument('--time', '-t', action="store", type=int, help="How long to run the crawler for in minutes", required=False)
+parser.add_argument('--frontier', action="store", type=str, default="frontier", help="Directory to keep the users and hashtags to crawl in between runs", required=False)
+parser.add_argument('--spill', action="store", type=str, help="File to keep tweets in when MongoDB cannot keep up (written at the end), dropped otherwise", required=False)
 parser.add_argument('--verbose', '-v', action="store_true", help="Print remaining requests left", required=False) # verbose prints number of requests left in time window
 
 args = parser.parse_args()
@@ -17,19 +19,24 @@ if not duration:
 
 from datetime import datetime, timedelta
 import threading
-import time
-import random
+import asyncio
+import os
 
 import tweepy
 from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
 
 from keys import consumer_key, consumer_secret, access_token, access_secret
-from helpers import SetQueue
+from crawl_frontier import CrawlFrontier
+from crawl_scheduler import RateLimitScheduler
+from rest_probes import ProbeEngine, OAuth1Signer
+from tweet_ingest import BufferedWriter, TweetDeduplicator, FrontierListener, ensure_unique_ids
 
 # set up MongoDB connection
 client = MongoClient()
 db = client.twitter_db
+ensure_unique_ids(db[collection]) # a tweet id is stored once, even across runs
+# tweets are written in batches by a background thread, tweets already written (or on their way) in this run are dropped first
+writer = BufferedWriter(db[collection], spill_path=args.spill, dedup=TweetDeduplicator())
 
 # set up Twitter API
 CONSUMER_KEY = consumer_key
@@ -40,10 +47,7 @@ ACCESS_SECRET = access_secret
 auth = tweepy.OAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
 auth.set_access_token(ACCESS_TOKEN, ACCESS_SECRET)
 api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
-
-# keep track of Tweet and number of duplicates
-count = 0
-duplicates = 0
+scheduler = RateLimitScheduler(api, verbose=args.verbose) # request budget of every endpoint, shared by the probes
 
 # location coordinates for geosearch REST probe
 LONDON = "51.5287352,-0.3817825,100km"
@@ -52,153 +56,56 @@ WASHINGTON_DC = "38.907192,-77.036873,100km"
 WUHAN = "30.592850,114.305542,100km"
 locations = [LONDON, GENEVA, WASHINGTON_DC, WUHAN]
 
-hashtag_queue = SetQueue()
-user_queue = SetQueue()
-
-def add_to_database(status):
-    global count
-    global duplicates
-    json_tweet = status._json
-    json_tweet['created_at'] = datetime.strptime(json_tweet['created_at'], '%a %b %d %H:%M:%S +0000 %Y')
-    try:
-        db[collection].insert(json_tweet)
-    except DuplicateKeyError as e:
-        duplicates += 1
-    count += 1
-
-def process_network(user):
-    # user needs to not have suspicious following
-    # if user has > 15k followers --> get friends and add to queue
-    # if user has > 15k followers --> get replies
-    global user_queue
-
-    seems_legit = False
-    exclude_replies = True
-
-    if available_requests['followers'] != 0:
-        followers = api.followers_ids(user)
-        friends = api.friends_ids(user)
-
-        if len(friends) > 10:
-            seems_legit = True
-        else:
-            seems_legit = False
-
-        # if user has > 15k followers --> get friends and add to queue
-        # assume some kind of big name
-        if len(followers) >= 15000:
-            for friend in friends:
-                user_queue.put(friend)
-            exclude_replies = False
-        else:
-            exclude_replies = True
-
-    return seems_legit, exclude_replies
-
-def parse_for_entities(status):
-    global hashtag_queue, user_queue
-    user = status.user.id
-    user_queue.put(user)
-    for hashtag in status.entities['hashtags']:
-        # add hashtag to list if not there
-        hashtag_queue.put(hashtag['text'].lower())
-
-def hashtag_thread():
-    print("Hashtag thread started.")
-    global hashtag_queue
-    while not stop:
-        if not hashtag_queue.empty():
-            if available_requests['search'] != 0:
-                for tweet in tweepy.Cursor(api.search, q=hashtag_queue.get(), lang="en", count=100, tweet_mode='extended').items():
-                    add_to_database(tweet)
-
-def location_thread():
-    print("Location thread started.")
-    location = random.choice(locations) # each time pick a random location to do search for
-    while not stop:
-        if available_requests['search'] != 0:
-            for tweet in tweepy.Cursor(api.search, q="covid", geocode=location, lang="en", count=100, tweet_mode='extended').items():
-                add_to_database(tweet)
-            location = random.choice(locations)
-
-def user_thread():
-    print("User thread started.")
-    global user_queue
-
-    while not stop:
-        if not user_queue.empty():
-            if available_requests['user_timeline'] != 0:
-                user = user_queue.get()
-                seems_legit, replies = process_network(user)
-                if seems_legit:
-                    for tweet in tweepy.Cursor(api.user_timeline, id=user, include_entities=True, exclude_replies=replies, count=100, tweet_mode='extended').items():
-                        add_to_database(tweet)
-
-class TwitterStream(tweepy.StreamListener):
-
-    def on_status(self, status):
-        add_to_database(status)
-        parse_for_entities(status)
-        return True
-
-    def on_error(self, status_code):
-        if status_code == 420:
-            #returning False in on_error disconnects the stream
-            return False
-
-listener = TwitterStream()
+# users and hashtags to crawl, most promising first, resumed from the last run
+os.makedirs(args.frontier, exist_ok=True)
+hashtag_queue = CrawlFrontier(path=os.path.join(args.frontier, "hashtags.pkl"))
+user_queue = CrawlFrontier(path=os.path.join(args.frontier, "users.pkl"))
+
+class TwitterStream(FrontierListener, tweepy.StreamListener):
+    # tweets written, then their user and hashtags added to the frontiers (see tweet_ingest.FrontierListener)
+
+    def __init__(self):
+        FrontierListener.__init__(self, writer, user_queue, hashtag_queue)
+        tweepy.StreamListener.__init__(self)
+
+listener = TwitterStream() # keeps track of Tweets (duplicates are counted by the writer)
 streamer = tweepy.Stream(auth=auth, listener=listener)
 
 start = datetime.now()
 time_limit = start + timedelta(minutes=duration)
-stop = False
 
 streamer.filter(track=["coronavirus", "covid-19", "covid19", "SARS-COV-2", "SARS-COV2", "2019-nCov", "covid", "cov19", "SARSCov2"],
                 languages=["en"], is_async=True) # change this for different (or no) keywords
 
-available_requests = {
-    'user_timeline': 0,
-    'search': 0,
-    'followers': 0
-}
-
-try:
-    ut = threading.Thread(target=user_thread, daemon=True)
-    lt = threading.Thread(target=location_thread, daemon=True)
-    ht = threading.Thread(target=hashtag_thread, daemon=True)
-    ut.start()
-    lt.start()
-    ht.start()
-    print("Probing tweets...\n")
-
-except Exception as e:
-    print("Error encountered when launching threads: {}".format(e))
+# REST probes (hashtags, locations, user timelines) run as asyncio tasks in their own thread
+engine = ProbeEngine(listener.add_to_database, scheduler, auth=OAuth1Signer(CONSUMER_KEY, CONSUMER_SECRET, ACCESS_TOKEN, ACCESS_SECRET))
+probes = threading.Thread(target=asyncio.run, args=(engine.run(duration * 60, hashtag_queue, user_queue, locations),), daemon=True)
+probes.start()
+print("Probing tweets...\n")
 
 print("Looking for tweets until {}\n".format(time_limit))
 
-while datetime.now() < time_limit:
-    if args.verbose:
-        limits = api.rate_limit_status()
-
-        rate = limits['resources']['application']['/application/rate_limit_status']
-        print("GET RATES: {} requests left".format(rate['remaining']))
-
-        tl_tweets = limits['resources']['statuses']['/statuses/user_timeline']
-        print("GET TIMELINE: {} requests left".format(tl_tweets['remaining']))
-        available_requests['user_timeline'] = tl_tweets['remaining']
-
-        followers = limits['resources']['followers']['/followers/ids']
-        print("GET FOLLOWERS: {} requests left".format(followers['remaining']))
-        available_requests['followers'] = followers['remaining']
-
-        search = limits['resources']['search']['/search/tweets']
-        print("SEARCH TWEETS: {} requests left\n".format(search['remaining']))
-        available_requests['search'] = search['remaining']
-
-    time.sleep(30) # don't run into limits for asking for number of requests left
+# refresh the request budgets (every minute) until the time limit, sleeping in between
+scheduler.run(time_limit)
 
-stop = True
+hashtag_queue.close() # the probes stop at the same time, cancelling the requests in flight
+user_queue.close()
+probes.join()
+print("REST probes: {} requests, {} tweets, {} errors".format(engine.requests, engine.tweets, engine.errors))
+hashtag_queue.save() # the next run starts from here
+user_queue.save()
+if args.verbose:
+    print("WRITER: {queue_depth} tweets queued, {written} written, {dropped} dropped\n".format(**writer.stats()))
 
 streamer.disconnect()
+stats = writer.close() # write what is still queued
+count = listener.count
 print("{} tweets were streamed from {} to {} in {}".format(count, start, time_limit, collection))
-print("{} duplicates were detected.".format(duplicates))
+duplicates = stats["filtered"] + stats["duplicates"]
+print("{} duplicates were detected ({:.1%}): {} dropped in memory, {} refused by the unique index.".format(
+    duplicates, duplicates/count if count else 0, stats["filtered"], stats["duplicates"]))
+print("Estimated false positive rate of the duplicate filter: {:.4%} (~{:.0f} new tweets dropped)".format(
+    stats["false_positive_rate"], stats["expected_false_positives"]))
+print("{} written, {} spilled to disk, {} dropped, {} not written, {} flushes ({} tried again, {:.3f}s mean, {:.3f}s max)".format(
+    stats["written"], stats["spilled"], stats["dropped"], stats["errors"], stats["flushes"], stats["retried"],
+    stats["mean_flush_latency"], stats["max_flush_latency"]))
@@ -2,15 +2,22 @@ import argparse
 
 parser = argparse.ArgumentParser(description='JSON file (obtained from bson) to a MongoDB.')
 
-parser.add_argument('--file', '-f', action='store', type=str, help='Name of the file to import', required=True)
+parser.add_argument('--file', '-f', action='store', type=str, help='Name of the file to import (JSON array or one tweet per line)', required=True)
 parser.add_argument('--collection', '-c', action='store', type=str, help='Collection in twitter_db to save to', required=False)
+parser.add_argument('--batch-size', '-b', action='store', type=int, default=1000, help='Number of tweets inserted at a time', required=False)
+parser.add_argument('--writers', '-w', action='store', type=int, default=4, help='Number of batches inserted concurrently', required=False)
 
 args = parser.parse_args()
 file = args.file
 collection = args.collection
 
+## imports after argparse for performance saving
+
+import time
+
+from tweet_ingest import iter_json, convert_created_at, BatchInserter
+
 from pymongo import MongoClient
-from bson.json_util import dumps, loads
 
 client = MongoClient()
 db = client.twitter_db
@@ -20,9 +27,14 @@ if not collection:
 
 sample_collection = db[collection]
 
+# tweets are parsed and inserted batch by batch: memory does not grow with the file
+inserter = BatchInserter(sample_collection, batch_size=args.batch_size, writers=args.writers)
 with open(file, 'r') as f:
-    sample_tweets = loads(f.read())
-
-sample_collection.insert_many(sample_tweets)
+    for tweet in iter_json(f):
+        inserter.add(convert_created_at(tweet))
+inserted, duplicates, errors = inserter.close()
 
+elapsed = time.time() - inserter.start
 print("Inserted {} into collection {} in twitter_db".format(file, collection))
+print("{} tweets read, {} inserted, {} duplicates, {} errors in {:.1f}s ({:.0f} tweets/s)".format(
+    inserter.read, inserted, duplicates, errors, elapsed, inserted/elapsed if elapsed else 0))
@@ -0,0 +1,232 @@
+import argparse
+
+parser = argparse.ArgumentParser(description='Replay recorded tweets through the crawler ingest pipeline and measure its throughput.')
+
+parser.add_argument('--file', '-f', action='store', type=str, help='Recorded tweets (one per line, or a JSON array)', required=True)
+parser.add_argument('--mode', '-m', action='store', type=str, default='fixed', choices=['fixed', 'bursty', 'max', 'ramp'], help='fixed rate, bursts on top of the rate, as fast as possible, or a rate going up step by step', required=False)
+parser.add_argument('--rate', '-r', action='store', type=float, default=1000, help='Tweets per second (starting rate with --mode ramp)', required=False)
+parser.add_argument('--burst-factor', action='store', type=float, default=10, help='With --mode bursty: rate multiplier during a burst', required=False)
+parser.add_argument('--burst-every', action='store', type=float, default=10, help='With --mode bursty: seconds between the start of two bursts', required=False)
+parser.add_argument('--burst-length', action='store', type=float, default=1, help='With --mode bursty: seconds a burst lasts', required=False)
+parser.add_argument('--step', action='store', type=float, default=1000, help='With --mode ramp: tweets per second added every --step-time seconds', required=False)
+parser.add_argument('--step-time', action='store', type=float, default=5, help='With --mode ramp: seconds at each rate', required=False)
+parser.add_argument('--time', '-t', action='store', type=float, default=60, help='Longest replay in seconds (the file is replayed again with new ids if it runs out)', required=False)
+parser.add_argument('--pipeline', action='store', type=str, default='stream', choices=['stream', 'hybrid'], help='streaming_crawler (write) or hybrid_crawler (write, fill the frontiers) listener, both deduplicate', required=False)
+parser.add_argument('--collection', '-c', action='store', type=str, help='Collection in twitter_db on the local mongod (dropped first!), an in-process stand-in is used otherwise', required=False)
+parser.add_argument('--stand-in-latency', action='store', type=float, default=0.005, help='Seconds the stand-in takes for an insert_many', required=False)
+parser.add_argument('--stand-in-rate', action='store', type=float, default=50000, help='Documents per second the stand-in writes', required=False)
+parser.add_argument('--batch-size', '-b', action='store', type=int, default=500, help='Batch size of the writer', required=False)
+parser.add_argument('--queue-size', action='store', type=int, default=20000, help='Tweets the writer queue holds', required=False)
+
+args = parser.parse_args()
+
+## imports after argparse for performance saving
+
+import math
+import threading
+import time
+
+import numpy as np
+
+from tweet_ingest import iter_json, BufferedWriter, TweetDeduplicator, TweetListener, FrontierListener
+from crawl_frontier import CrawlFrontier
+
+"""
+Measures the ingest pipeline of the crawlers without Twitter credentials:
+recorded tweets are passed to on_status() of the listener the crawler uses
+(tweet_ingest.TweetListener, or FrontierListener for the hybrid crawler: created_at conversion,
+BufferedWriter with deduplication, and for the hybrid crawler the crawl frontiers)
+at a chosen rate, into a local mongod or a stand-in with a fixed write cost.
+Reports, every second and overall: offered and written tweets per second, queue depth,
+latency from arrival to write (percentiles), and when the pipeline fell behind
+(listener putting less than 90% of the tweets offered, queue more than half full, or tweets dropped).
+"""
+
+
+class StandInCollection:
+    """
+    In-process stand-in for a MongoDB collection: insert_many takes latency + len(batch)/rate seconds
+    """
+
+    def __init__(self, latency, rate):
+        self.latency = latency
+        self.rate = rate
+        self.count = 0
+        self.name = "stand-in"
+
+    def insert_many(self, documents, ordered=True):
+        time.sleep(self.latency + len(documents)/self.rate)
+        self.count += len(documents)
+        return InsertResult(len(documents))
+
+    def create_index(self, *a, **kw):
+        pass
+
+
+class InsertResult:
+    def __init__(self, n):
+        self.inserted_ids = [None] * n
+
+
+class TimedCollection:
+    """
+    Wraps a collection to record the time from arrival to write of every document
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.arrivals = {} # id() of a document waiting to be written -> arrival time
+        self.latencies = [] # (arrival time, latency)
+        self.lock = threading.Lock()
+
+    def insert_many(self, documents, ordered=True):
+        try:
+            return self.collection.insert_many(documents, ordered=ordered)
+        finally:
+            written = time.perf_counter()
+            with self.lock:
+                for document in documents:
+                    arrival = self.arrivals.pop(id(document), None)
+                    if arrival is not None:
+                        self.latencies.append((arrival, written - arrival))
+
+
+def offered_rate(elapsed):
+    # tweets per second to replay at this point of the replay
+    if args.mode == 'bursty' and elapsed % args.burst_every < args.burst_length:
+        return args.rate * args.burst_factor
+    if args.mode == 'ramp':
+        return args.rate + args.step * math.floor(elapsed / args.step_time)
+    return args.rate
+
+
+def recorded_tweets():
+    # the recording again and again, ids shifted so repeats are not deduplicated
+    loop = 0
+    while True:
+        replayed = 0
+        with open(args.file) as f:
+            for tweet in iter_json(f):
+                if loop and tweet.get("id") is not None:
+                    tweet["id"] += loop * 10**15
+                tweet.pop("_id", None)
+                replayed += 1
+                yield tweet
+        if not replayed:
+            return
+        loop += 1
+
+
+if args.collection:
+    from pymongo import MongoClient
+    target = MongoClient().twitter_db[args.collection]
+    target.drop()
+else:
+    target = StandInCollection(args.stand_in_latency, args.stand_in_rate)
+collection = TimedCollection(target)
+
+# same writer and listener as the crawlers
+writer = BufferedWriter(collection, batch_size=args.batch_size, maxsize=args.queue_size, dedup=TweetDeduplicator())
+if args.pipeline == 'hybrid':
+    listener = FrontierListener(writer, CrawlFrontier(), CrawlFrontier())
+else:
+    listener = TweetListener(writer)
+
+
+class RecordedStatus:
+    # what tweepy passes to on_status: the tweet as JSON in _json
+    def __init__(self, json_tweet):
+        self._json = json_tweet
+
+
+class TimedWriter:
+    """
+    Wraps the writer given to the listener: tweets it drops (duplicates, queue full) have no latency
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def put(self, document):
+        if self.writer.put(document):
+            return True
+        collection.arrivals.pop(id(document), None)
+        return False
+
+
+listener.writer = TimedWriter(writer)
+
+
+print("Replaying {} ({} mode, {} pipeline) into {} for up to {:.0f}s".format(
+    args.file, args.mode, args.pipeline, args.collection or "the in-process stand-in", args.time))
+print("{:>6} {:>10} {:>10} {:>10} {:>8} {:>10} {:>10}".format("second", "offered/s", "put/s", "written/s", "queue", "p50 (ms)", "p99 (ms)"))
+
+tweets = recorded_tweets()
+start = time.perf_counter()
+put = 0
+due = 0.0
+last_tick = start
+window = {"put": 0, "due": 0, "written": writer.written, "latencies": 0}
+fell_behind = None
+seconds = 0
+while True:
+    now = time.perf_counter()
+    elapsed = now - start
+    if elapsed >= args.time:
+        break
+    # put every tweet due by now
+    if args.mode == 'max':
+        due = put + 1000
+    else:
+        due += offered_rate(elapsed) * (now - last_tick)
+    last_tick = now
+    finished = False
+    put_until = min(int(due), put + 1000) # back to the clock and the report every 1000 tweets
+    while put < put_until:
+        tweet = next(tweets, None)
+        if tweet is None:
+            finished = True
+            break
+        collection.arrivals[id(tweet)] = time.perf_counter()
+        listener.on_status(RecordedStatus(tweet))
+        put += 1
+    if finished:
+        break
+
+    # report every second
+    if elapsed >= seconds + 1:
+        seconds += 1
+        stats = writer.stats()
+        with collection.lock:
+            latencies = [l for _, l in collection.latencies[window["latencies"]:]]
+            window["latencies"] = len(collection.latencies)
+        p50, p99 = (np.percentile(latencies, [50, 99]) * 1000) if latencies else (0, 0)
+        offered = put - window["put"] if args.mode == 'max' else int(due) - window["due"] # as fast as possible: offered = put
+        print("{:>6} {:>10.0f} {:>10} {:>10} {:>8} {:>10.1f} {:>10.1f}".format(
+            seconds, offered, put - window["put"], stats["written"] - window["written"], stats["queue_depth"], p50, p99))
+        late = args.mode != 'max' and put - window["put"] < 0.9 * offered # the listener does not keep up with the stream
+        if fell_behind is None and (late or stats["queue_depth"] > args.queue_size // 2 or stats["dropped"]):
+            fell_behind = (seconds, offered, put - window["put"])
+        window["put"] = put
+        window["due"] = int(due)
+        window["written"] = stats["written"]
+    if args.mode != 'max':
+        time.sleep(0.001)
+
+replayed = time.perf_counter() - start
+stats = writer.close()
+elapsed = time.perf_counter() - start
+latencies = np.array([l for _, l in collection.latencies])
+
+print()
+print("{} tweets put in {:.1f}s ({:.0f} tweets/s), {} written in {:.1f}s ({:.0f} tweets/s sustained)".format(
+    put, replayed, put/replayed, stats["written"], elapsed, stats["written"]/elapsed))
+print("{} dropped, {} duplicates filtered, {} flushes ({:.1f}ms mean, {:.1f}ms max)".format(
+    stats["dropped"], stats.get("filtered", 0), stats["flushes"], stats["mean_flush_latency"] * 1000, stats["max_flush_latency"] * 1000))
+if len(latencies):
+    print("Latency from arrival to write: p50 {:.1f}ms, p90 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms".format(
+        *(np.percentile(latencies, [50, 90, 99, 100]) * 1000)))
+if fell_behind is None:
+    print("The pipeline kept up")
+else:
+    print("The pipeline fell behind after {}s, at {:.0f} tweets/s offered ({} put that second)".format(*fell_behind))
@@ -0,0 +1,208 @@
+import aiohttp
+from oauthlib.oauth1 import Client as OAuth1Client
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import asyncio
+import random
+import time
+
+# file for the REST probes of the hybrid crawler, run with asyncio:
+# every endpoint has a number of requests in flight at the same time over one pool of HTTP connections,
+# hashtags and users come from the crawl frontiers and every request is counted against the scheduler budgets
+# the base URL can point to a local server serving canned pages (see benchmarks/probe_benchmark.py)
+
+API_URL = "https://api.twitter.com/1.1"
+
+# endpoint -> path, same endpoint names as crawl_scheduler.ENDPOINTS
+PATHS = {
+    'search': '/search/tweets.json',
+    'user_timeline': '/statuses/user_timeline.json',
+    'followers': '/followers/ids.json',
+    'friends': '/friends/ids.json',
+}
+
+# endpoint -> requests in flight at the same time
+CONCURRENCY = {'search': 4, 'user_timeline': 4, 'followers': 2, 'friends': 2}
+
+
+class OAuth1Signer:
+    """
+    OAuth1Signer signs requests with the user keys (same authentication as tweepy.OAuthHandler)
+    """
+
+    def __init__(self, consumer_key, consumer_secret, access_token, access_secret):
+        self.client = OAuth1Client(consumer_key, client_secret=consumer_secret,
+                                   resource_owner_key=access_token, resource_owner_secret=access_secret)
+
+    def __call__(self, method, url):
+        _, headers, _ = self.client.sign(url, http_method=method)
+        return headers
+
+
+class ProbeEngine:
+    """
+    ProbeEngine runs the search, location and user timeline probes as asyncio tasks.
+    Every tweet found is given to on_tweet (JSON Tweet as a dictionary).
+    run() stops every probe when its duration is over, the requests in flight are cancelled.
+    """
+
+    def __init__(self, on_tweet, scheduler=None, auth=None, base_url=API_URL, concurrency=CONCURRENCY, max_pages=10, timeout=30):
+        self.on_tweet = on_tweet
+        self.scheduler = scheduler # crawl_scheduler.RateLimitScheduler, no budget if None
+        self.auth = auth # function (method, url) -> headers
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.max_pages = max_pages # pages of 100 tweets per search or timeline
+        self.timeout = timeout # seconds per request
+        self.stopped = False
+        # counters
+        self.requests = 0
+        self.tweets = 0
+        self.errors = 0
+
+    async def _blocking(self, function, *args):
+        # scheduler budgets and frontiers block a thread, not the event loop
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def _update_budget(self, endpoint, headers):
+        # every response tells how many requests are left in the window
+        if self.scheduler is not None and "x-rate-limit-remaining" in headers:
+            self.scheduler.buckets[endpoint].update(int(headers["x-rate-limit-remaining"]),
+                                                    int(headers["x-rate-limit-limit"]),
+                                                    int(headers["x-rate-limit-reset"]))
+
+    async def get(self, endpoint, params):
+        """
+        One GET request to endpoint, once the budget allows it
+        return decoded JSON, or None on error or once stopped
+        """
+        url = self.base_url + PATHS[endpoint] + "?" + urlencode(params)
+        async with self.semaphores[endpoint]:
+            while not self.stopped:
+                if self.scheduler is not None and not await self._blocking(self.scheduler.acquire, endpoint):
+                    return None
+                headers = self.auth("GET", url) if self.auth else {}
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        self._update_budget(endpoint, response.headers)
+                        if response.status == 429: # over the limit anyway: wait for the window to reset
+                            reset = int(response.headers.get("x-rate-limit-reset", time.time() + 60))
+                            await asyncio.sleep(max(1, reset - time.time()))
+                            continue
+                        if response.status != 200:
+                            self.errors += 1
+                            return None
+                        self.requests += 1
+                        return await response.json(content_type=None)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    self.errors += 1
+                    return None
+            return None
+
+    def _found(self, tweets):
+        for tweet in tweets:
+            self.on_tweet(tweet)
+        self.tweets += len(tweets)
+
+    async def search(self, q, **params):
+        """
+        Pages of search results for q, older tweets after each page (max_id)
+        return number of tweets found
+        """
+        found = 0
+        params = dict(q=q, lang="en", count=100, tweet_mode="extended", **params)
+        for _ in range(self.max_pages):
+            page = await self.get('search', params)
+            if not page or not page.get("statuses"):
+                break
+            self._found(page["statuses"])
+            found += len(page["statuses"])
+            params["max_id"] = min(tweet["id"] for tweet in page["statuses"]) - 1
+        return found
+
+    async def timeline(self, user, exclude_replies=True):
+        params = dict(user_id=user, count=100, include_entities="true", tweet_mode="extended",
+                      exclude_replies="true" if exclude_replies else "false")
+        for _ in range(self.max_pages):
+            page = await self.get('user_timeline', params)
+            if not page:
+                return
+            self._found(page)
+            params["max_id"] = min(tweet["id"] for tweet in page) - 1
+
+    async def process_network(self, user, users):
+        """
+        Same rules as the threaded crawler: a user following more than 10 accounts seems legit,
+        a user with 15k followers or more is some kind of big name: friends are queued and replies kept
+        return seems_legit, exclude_replies
+        """
+        followers, friends = await asyncio.gather(self.get('followers', {"user_id": user}),
+                                                  self.get('friends', {"user_id": user}))
+        if followers is None or friends is None:
+            return False, True
+        followers, friends = followers.get("ids", []), friends.get("ids", [])
+        seems_legit = len(friends) > 10
+        if len(followers) >= 15000:
+            for friend in friends:
+                users.put(friend)
+            return seems_legit, False
+        return seems_legit, True
+
+    async def hashtag_probe(self, hashtags):
+        while not self.stopped:
+            hashtag = await self._blocking(hashtags.get) # None once the frontier is closed
+            if hashtag is None:
+                return
+            await self.search(hashtag)
+
+    async def location_probe(self, query, locations):
+        while not self.stopped:
+            if not await self.search(query, geocode=random.choice(locations)): # each time a random location
+                await asyncio.sleep(1) # nothing found (or errors): do not hammer the API
+
+    async def user_probe(self, users):
+        while not self.stopped:
+            user = await self._blocking(users.get)
+            if user is None:
+                return
+            seems_legit, exclude_replies = await self.process_network(user, users)
+            if seems_legit:
+                await self.timeline(user, exclude_replies)
+
+    async def run(self, duration, hashtags=None, users=None, locations=(), query="covid"):
+        """
+        Runs the probes for duration seconds
+        :hashtags, users -> crawl_frontier.CrawlFrontier of hashtags and user ids to crawl (closed at the end)
+        :locations, query -> geocodes searched for query
+        return number of requests, tweets found, errors
+        """
+        self.stopped = False
+        self.semaphores = {endpoint: asyncio.Semaphore(n) for endpoint, n in self.concurrency.items()}
+        self.executor = ThreadPoolExecutor(max_workers=2 * sum(self.concurrency.values()) + 2)
+        search = self.concurrency['search']
+        connector = aiohttp.TCPConnector(limit=sum(self.concurrency.values())) # connections kept alive and reused
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)) as self.session:
+            probes = []
+            if hashtags is not None:
+                probes += [self.hashtag_probe(hashtags) for _ in range(max(1, search // 2))]
+            if locations:
+                probes += [self.location_probe(query, locations) for _ in range(max(1, search - search // 2))]
+            if users is not None:
+                probes += [self.user_probe(users) for _ in range(self.concurrency['user_timeline'])]
+            tasks = [asyncio.ensure_future(probe) for probe in probes]
+            if tasks:
+                await asyncio.wait(tasks, timeout=duration)
+
+            # time is up: wake up what waits on a frontier or a budget, cancel requests in flight
+            self.stopped = True
+            for frontier in (hashtags, users):
+                if frontier is not None:
+                    frontier.close()
+            if self.scheduler is not None:
+                self.scheduler.stop()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.executor.shutdown()
+        return self.requests, self.tweets, self.errors
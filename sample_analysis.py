@@ -2,22 +2,46 @@ import argparse
 
 parser = argparse.ArgumentParser(description='Analyse collection of Tweets from twitter_db in MongoDB.')
 
-parser.add_argument('--collection', '-c', action='store', type=str, help='Name of the collection in MongoDB.twitter_db to analyse', required=True)
+parser.add_argument('--collection', '-c', action='store', type=str, help='Name of the collection in MongoDB.twitter_db to analyse', required=False)
+parser.add_argument('--k-search', action='store', type=str, default='inertia', choices=['inertia', 'elbow', 'silhouette'], help='How to pick the number of topics for K-means', required=False)
+parser.add_argument('--workers', '-w', action='store', type=int, default=1, help='Number of processes for tokenizing, the K-means search and the lexicon sentiment scorer', required=False)
+parser.add_argument('--sentiment', action='store', type=str, default='textblob', choices=['textblob', 'lexicon'], help='Sentiment scorer (lexicon gives the same scores in batches)', required=False)
+parser.add_argument('--streaming', action='store_true', help='Extract topics in fixed-size batches (bounded memory)', required=False)
+parser.add_argument('--topic-model', action='store', type=str, help='With --streaming: file to save the topic model to (with --incremental, the saved model is trained on the new tweets)', required=False)
+parser.add_argument('--compact', action='store_true', help='Build networks with the compact graph backend instead of networkx (less memory)', required=False)
+parser.add_argument('--snapshot', action='store', type=str, help='Analyse a snapshot written by export_snapshot.py instead of MongoDB (sentiment must already be scored)', required=False)
+parser.add_argument('--sparse', action='store_true', help='Compute user network statistics with sparse matrices (faster on large networks)', required=False)
+parser.add_argument('--entities', action='store', type=str, default='python', choices=['python', 'mongo'], help='Count the top entities while reading the tweets once (python) or with MongoDB aggregations per bucket (mongo, less data sent over the wire)', required=False)
+parser.add_argument('--incremental', action='store_true', help='Only read the tweets added since the last run and add them to the saved state (MongoDB only, topics with the streaming model)', required=False)
+parser.add_argument('--state', action='store', type=str, help='With --incremental: file the analysis state is kept in (default: analysis_state/<collection>.pkl)', required=False)
+parser.add_argument('--metrics', action='store', type=str, default='sample_results/metrics.json', help='JSON file for the time, CPU, memory and documents of every stage', required=False)
+parser.add_argument('--profile', action='store', type=str, nargs='+', default=[], help='Stages to run under the sampling profiler ("all" for every stage), stacks written next to the metrics file', required=False)
+parser.add_argument('--profile-interval', action='store', type=float, default=0.005, help='Seconds between two samples of the profiler', required=False)
 
 args = parser.parse_args()
 collection = args.collection
+if not collection and not args.snapshot:
+    parser.error("one of --collection or --snapshot is required")
+if args.incremental and args.snapshot:
+    parser.error("--incremental reads the new tweets from MongoDB, it cannot be used with --snapshot")
+if args.entities == "mongo" and args.snapshot:
+    parser.error("--entities mongo counts in MongoDB, it cannot be used with --snapshot")
 
 ## imports after argparse for performance saving
 
+import os
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
-from helpers import parse_tweet, get_body, tokenize, find_sentiment_tb, get_top_n_items
-from text_analysis import sentiment_analysis, topic_extraction, add_sentiment_to_db
-from tweet_statistics import extract_top_entities, number_of, get_char_count
-from tweet_networks import user_interaction, hashtag_interaction, hashtag_network_statistics, user_network_statistics
+from helpers import get_top_n_items, feature_cache, ensure_indexes
+from text_analysis import topic_extraction, stream_sentiment_to_db, StreamingTopicModel
+from tweet_statistics import number_by_sentiment, extract_top_entities
+from tweet_networks import hashtag_network_statistics, user_network_statistics
 from tweet_networks import build_interaction_graph, get_network_information
+from tweet_accumulator import accumulate, AnalysisState
+from tweet_snapshot import TweetSnapshot, NO_SENTIMENT
+from stage_metrics import StageMetrics
 
 from pymongo import MongoClient
 
@@ -28,26 +52,93 @@ Functionality:
 - sentiment analysis
 - tweet statistics
 - network information
+Every stage is measured (see stage_metrics.py), metrics written to sample_results/metrics.json
+Stages: topic_extraction, sentiment, ensure_indexes, number_by_sentiment, accumulate,
+then for each sentiment bucket: top_entities, tweet_statistics, graphs, network_statistics
+With --incremental, only the tweets after the high-water mark of the saved state are read
+(for topics, sentiment and the buckets) and the reports are written from the updated state
 """
 
-# set up MongoDB connection
-client = MongoClient()
-db = client.twitter_db
-tweets_db = db[collection]
+metrics = StageMetrics(profile=args.profile, profile_interval=args.profile_interval)
+
+if args.snapshot: # same analysis on the columnar snapshot, MongoDB is not used
+    tweets_db = TweetSnapshot(args.snapshot)
+else:
+    # set up MongoDB connection
+    client = MongoClient()
+    db = client.twitter_db
+    tweets_db = db[collection]
+
+if args.incremental:
+    if not args.state:
+        args.state = os.path.join("analysis_state", collection + ".pkl")
+    if not args.topic_model: # topics are kept up to date by training the streaming model on new tweets
+        args.topic_model = os.path.splitext(args.state)[0] + ".topics.pkl"
+    args.streaming = True
+    os.makedirs(os.path.dirname(args.state) or ".", exist_ok=True)
+    state = AnalysisState(args.state)
+    new_tweets = state.window() # with the overlap before the mark, tweets already added are skipped
+    print("Incremental analysis: tweets after {} (state in {})".format(state.high_water_mark, args.state))
 
 ## TOPIC EXTRACTION -> write to results/topics.txt
 print("Running topic extraction -> sample_results/topics.txt")
-cluster_top_words = topic_extraction(tweets_db.find(), 100) # can change number for max_k
+with metrics.stage("topic_extraction") as record:
+    counted_db = metrics.collection(tweets_db, record) # documents read by the stage (twice when fitting the streaming model)
+    if args.streaming:
+        if args.incremental and os.path.exists(args.topic_model): # keep training the saved model on the new tweets, same vocabulary
+            tweets = (tweet for tweet in counted_db.find(new_tweets) if state.is_new(tweet))
+            model = StreamingTopicModel.load(args.topic_model).partial_fit(tweets)
+        else: # the whole collection is read: train from scratch instead of training the saved model on tweets it has seen
+            model = StreamingTopicModel(max_k=100).fit(counted_db)
+        if args.topic_model:
+            model.save(args.topic_model)
+        cluster_top_words = model.top_words()
+    else:
+        cluster_top_words = topic_extraction(counted_db.find(), 100, k_search=args.k_search, workers=args.workers) # can change number for max_k
 with open('sample_results/topics.txt', 'w') as file:
     for cluster in cluster_top_words:
         file.write(cluster + '\n')
 
 ## SENTIMENT ANALYSIS -> save plot to results/sentiment.png
 print("Running sentiment analysis -> sample_results/sentiment.png")
-scores, ids = sentiment_analysis(tweets_db.find())
+with metrics.stage("sentiment") as record:
+    if args.snapshot:
+        record["docs"] = int(np.count_nonzero(np.asarray(tweets_db.columns["sentiment"]) != NO_SENTIMENT)) # already scored
+    else:
+        stream_sentiment_to_db(metrics.collection(tweets_db, record), scorer=args.sentiment, workers=args.workers, # scored and added to MongoDB batch by batch
+                               query={"sentiment": {"$exists": False}} if args.incremental else {})
+
+# make it easier to iterate/save files
+conditions = [{"$exists": True}, -1, 0, 1]
+sentiment_values = ["all", -1, 0, 1]
+
+# indexes are built once sentiment is written, so the bulk updates do not have to maintain them
+if not args.snapshot:
+    with metrics.stage("ensure_indexes"):
+        ensure_indexes(tweets_db)
+tags = ["all", "negative", "neutral", "positive"]
+if args.incremental:
+    # add the new tweets to the saved buckets and counts
+    print("Reading new tweets for all sentiment buckets")
+    with metrics.stage("accumulate") as record:
+        state.update(metrics.collection(tweets_db, record))
+    with metrics.stage("save_state"):
+        state.save()
+    numbers = state.numbers
+    buckets = state.buckets
+else:
+    with metrics.stage("number_by_sentiment") as record:
+        numbers = number_by_sentiment(tweets_db) # counts for every bucket in one aggregation
+        record["docs"] = numbers["all"][0]
+
+    # read the collection once and fill every bucket at the same time
+    print("Reading tweets for all sentiment buckets")
+    with metrics.stage("accumulate") as record:
+        buckets = accumulate(metrics.collection(tweets_db, record))
+print("Feature cache: {} hits, {} misses ({:.1%} hit rate)".format(feature_cache.hits, feature_cache.misses, feature_cache.hit_rate()))
 
 # visualisation
-bars = plt.bar([-1, 0, 1], [len(scores[scores==-1]), len(scores[scores==0]), len(scores[scores==1])],
+bars = plt.bar([-1, 0, 1], [numbers.get(value, (0, 0, 0, 0))[0] for value in [-1, 0, 1]],
        color=["r", "b", "g"], tick_label=["Negative", "Neutral", "Positive"])
 plt.tick_params(axis='x', which='both', bottom=False)
 for bar in bars:
@@ -56,45 +147,52 @@ for bar in bars:
 plt.title("Number of tweets by sentiment")
 plt.savefig("sample_results/sentiment.png", dpi=300)
 
-add_sentiment_to_db(scores, ids, tweets_db) # add to MongoDB so it can be parsed later
-
-# make it easier to iterate/save files
-conditions = [{"$exists": True}, -1, 0, 1]
-tags = ["all", "negative", "neutral", "positive"]
-
 for idx, condition in enumerate(conditions):
     tag = tags[idx]
+    bucket = buckets[tag]
     print("Running Tweet analysis for {} tweets".format(tag))
 
     ## TOP ENTITIES: users, hashtags, mentions, concepts
     print("-> {}".format('sample_results/top_entities_' + tag + '.txt'))
-    m, r, h, c = extract_top_entities(tweets_db, condition)
-    entities = ["Top Mentions", "Top Retweets", "Top Hashtags", "Top concepts"]
-    with open('sample_results/top_entities_' + tag + '.txt', 'w') as file:
-        for name, entity in enumerate([m, r, h, c]):
-            file.write(entities[name] + '\n')
-            file.write(', '.join(get_top_n_items(entity, n=10)))
-            file.write('\n\n')
+    with metrics.stage("top_entities", tag) as record:
+        record["docs"] = bucket.count
+        if args.entities == "mongo": # whole collection counted by MongoDB, also with --incremental
+            m, r, h, c = extract_top_entities(tweets_db, condition, backend="mongo")
+        else:
+            m, r, h, c = bucket.top_entities()
+        entities = ["Top Mentions", "Top Retweets", "Top Hashtags", "Top concepts"]
+        with open('sample_results/top_entities_' + tag + '.txt', 'w') as file:
+            for name, entity in enumerate([m, r, h, c]):
+                file.write(entities[name] + '\n')
+                file.write(', '.join(get_top_n_items(entity, n=10)))
+                file.write('\n\n')
 
     ## NUMBER OF: tweets, retweets, quotes, replies
     print("-> {}".format('sample_results/tweet_statistics_' + tag + '.txt'))
-    n_tweets, n_retweets, n_quotes, n_replies = number_of(tweets_db, condition)
-    avg_chars = get_char_count(tweets_db, condition)
-    with open('sample_results/tweet_statistics_' + tag + '.txt', 'w') as file:
-        file.write("Collection: {}\n".format(tag))
-        file.write("Total tweets in collection: {}\n".format(n_tweets))
-        file.write("{} retweets\n".format(n_retweets))
-        file.write("{} quotes\n".format(n_quotes))
-        file.write("{} replies\n".format(n_replies))
-        file.write("Average character length is: {}".format(avg_chars))
+    with metrics.stage("tweet_statistics", tag) as record:
+        record["docs"] = bucket.count
+        n_tweets, n_retweets, n_quotes, n_replies = numbers.get(sentiment_values[idx], (0, 0, 0, 0))
+        avg_chars = bucket.char_count()
+        with open('sample_results/tweet_statistics_' + tag + '.txt', 'w') as file:
+            file.write("Collection: {}\n".format(tag))
+            file.write("Total tweets in collection: {}\n".format(n_tweets))
+            file.write("{} retweets\n".format(n_retweets))
+            file.write("{} quotes\n".format(n_quotes))
+            file.write("{} replies\n".format(n_replies))
+            file.write("Average character length is: {}".format(avg_chars))
 
     # Build network: get number of nodes, edges, groups
     print("-> {}".format('sample_results/network_information_' + tag + '.txt'))
-    networks = [n for n in user_interaction(tweets_db, condition)] + [hashtag_interaction(tweets_db, condition)]
-    graphs = [build_interaction_graph(network) for network in networks]
+    networks = [n for n in bucket.user_interaction()] + [bucket.hashtag_interaction()]
+    with metrics.stage("graphs", tag) as record:
+        record["docs"] = bucket.count
+        graphs = [build_interaction_graph(network, compact=args.compact) for network in networks]
+        information = [get_network_information(G) for G in graphs]
 
     # format: ties, links, transitive, triads
-    connections = [user_network_statistics(n) for n in networks[:3]] + [hashtag_network_statistics(networks[3])]
+    with metrics.stage("network_statistics", tag) as record:
+        record["docs"] = bucket.count
+        connections = [user_network_statistics(n, sparse=args.sparse) for n in networks[:3]] + [hashtag_network_statistics(networks[3])]
 
     ## NETWORK ANALYSIS:
     order = ["General network", "Retweet network", "Quote network", "Hashtag network"]
@@ -103,7 +201,7 @@ for idx, condition in enumerate(conditions):
         file.write("Collection: {}\n".format(tag))
         for i in range(len(order)):
             file.write(order[i] + '\n')
-            nodes, edges, subgraphs, size = get_network_information(graphs[i])
+            nodes, edges, subgraphs, size = information[i]
             file.write("Number of nodes: {}\n".format(nodes))
             file.write("Number of edges: {}\n".format(edges))
             file.write("Number of subgraphs: {}\n".format(subgraphs))
@@ -114,3 +212,7 @@ for idx, condition in enumerate(conditions):
             for j in range(len(stats)):
                 file.write("{}: {}\n".format(stats_order[j], stats[j]))
             file.write('\n')
+
+metrics.save(args.metrics, collection=collection, snapshot=args.snapshot, streaming=args.streaming, sentiment=args.sentiment,
+             workers=args.workers, compact=args.compact, sparse=args.sparse, entities=args.entities)
+print("Stage metrics -> {}".format(args.metrics))
@@ -0,0 +1,172 @@
+from textblob.en import sentiment as pattern_sentiment
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import math
+import re
+
+from helpers import find_sentiment_tb
+
+# file for batch sentiment scoring
+# same polarity as TextBlob (pattern lexicon, no part-of-speech tags) without building a TextBlob per tweet:
+# texts made only of known/unknown words are averaged with NumPy,
+# texts with modifiers ("very good") or negations ("never good") replay pattern's rules on the lexicon,
+# anything else (punctuation, emoticons) goes through TextBlob
+
+_WORDS_ONLY = re.compile('^[a-z ]*$')
+
+
+class LexiconScorer:
+    """
+    LexiconScorer holds the pattern sentiment lexicon compiled into lookup tables:
+    word -> row of the polarity/intensity arrays, plus the modifier and negation words.
+    """
+
+    def __init__(self):
+        pattern_sentiment.load()
+        self.index = {}
+        polarity = []
+        intensity = []
+        self.modifiers = set() # known words modifying the next known word
+        for word, tags in dict.items(pattern_sentiment):
+            p, s, i = tags[None] # scores averaged over part-of-speech tags, as TextBlob without tags
+            self.index[word] = len(polarity)
+            polarity.append(p)
+            intensity.append(i)
+            if any(tag in tags for tag in pattern_sentiment.modifiers):
+                self.modifiers.add(word)
+        self.polarity = np.array(polarity)
+        self.intensity = np.array(intensity)
+        self.negations = set(pattern_sentiment.negations)
+        self.special = self.modifiers | self.negations
+
+    def _assess(self, words):
+        """
+        pattern's Sentiment.assessments() for words without tags, polarity only
+        """
+        a = [] # [polarity, intensity, negated]
+        m = None # preceding modifier
+        n = None # preceding negation
+        for w in words:
+            row = self.index.get(w)
+            if row is not None:
+                p, i = self.polarity[row], self.intensity[row]
+                if m is None:
+                    a.append([p, i, 1])
+                else: # "really good"
+                    a[-1][0] = max(-1.0, min(p * a[-1][1], +1.0))
+                    a[-1][1] = i
+                if n is not None: # "not really good"
+                    a[-1][1] = 1.0 / a[-1][1]
+                    a[-1][2] = -1
+                m = w if w in self.modifiers else None
+                n = w if w in self.negations else None
+            else:
+                if w in self.negations:
+                    n = w
+                elif n and len(w.strip("'")) > 1: # retain negation across small words
+                    n = None
+                if n is not None and m is not None and pattern_sentiment.modifier(m): # "really not good"
+                    a[-1][2] = -1
+                    n = None
+                elif m and len(w) > 2: # retain modifier across small words
+                    m = None
+        s = 0
+        for p, i, negated in a:
+            s += p * -0.5 if negated < 0 else p # "not good" = slightly bad
+        return s / float(len(a) or 1)
+
+    def polarity_batch(self, texts):
+        """
+        :texts -> list of texts (e.g. tokenized with helpers.tokenize)
+        return array of TextBlob polarities
+        """
+        polarities = np.zeros(len(texts))
+        docs = []
+        rows = []
+        for d, text in enumerate(texts):
+            lowered = text.lower()
+            if not _WORDS_ONLY.match(lowered):
+                polarities[d] = pattern_sentiment(text)[0]
+                continue
+            words = lowered.split()
+            if self.special.isdisjoint(words):
+                # plain average of the known words, done below for the whole batch
+                for w in words:
+                    row = self.index.get(w)
+                    if row is not None:
+                        docs.append(d)
+                        rows.append(row)
+            else:
+                polarities[d] = self._assess(words)
+
+        # bincount adds in input order, so the sums are the same floats as pattern's running sum
+        docs = np.array(docs, dtype=np.int64)
+        simple = np.zeros(len(texts), dtype=bool)
+        simple[docs] = True
+        sums = np.bincount(docs, weights=self.polarity[np.array(rows, dtype=np.int64)], minlength=len(texts))
+        counts = np.bincount(docs, minlength=len(texts))
+        polarities[simple] = sums[simple] / counts[simple]
+        return polarities
+
+    def score_batch(self, texts):
+        """
+        Same output as [find_sentiment_tb(t) for t in texts]
+        """
+        return bucket_polarities(self.polarity_batch(texts))
+
+
+def bucket_polarities(polarities):
+    """
+    Vectorised thresholds of helpers.find_sentiment_tb(): [0, 0.2) -> 0, >= 0.2 -> 1, else -1
+    """
+    return np.where(polarities >= 0.2, 1, np.where(polarities >= 0, 0, -1))
+
+
+_scorer = None
+
+def _score_chunk(texts):
+    global _scorer
+    if _scorer is None: # one lexicon per process
+        _scorer = LexiconScorer()
+    return _scorer.score_batch(texts)
+
+
+def score_batch(texts, workers=1, chunksize=None, executor=None):
+    """
+    Score many texts with the lexicon scorer, same output as [find_sentiment_tb(t) for t in texts]
+    :texts -> list of texts
+    :workers -> number of processes to spread chunks over (1 runs in this process)
+    :chunksize -> number of texts sent to a process at a time (default: the texts split evenly over the workers)
+    :executor -> ProcessPoolExecutor of workers processes to reuse across calls, one is started per call otherwise
+    return array of -1/0/1 scores
+    """
+    texts = list(texts)
+    if workers <= 1 or len(texts) < 2:
+        return _score_chunk(texts)
+
+    chunksize = chunksize or math.ceil(len(texts) / workers)
+    chunks = [texts[i:i+chunksize] for i in range(0, len(texts), chunksize)]
+    if executor is not None:
+        return np.concatenate(list(executor.map(_score_chunk, chunks)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(_score_chunk, chunks)))
+
+
+def agreement_report(texts, scores=None):
+    """
+    Compare lexicon scores with the TextBlob path (helpers.find_sentiment_tb)
+    :texts -> list of texts
+    :scores -> lexicon scores of the texts, computed if None
+    return agreement rate, confusion dictionary of (TextBlob score, lexicon score) -> count
+    """
+    if scores is None:
+        scores = score_batch(texts)
+    confusion = {}
+    agree = 0
+    for text, score in zip(texts, scores):
+        expected = find_sentiment_tb(text)
+        key = (expected, int(score))
+        confusion[key] = confusion.get(key, 0) + 1
+        if expected == score:
+            agree += 1
+    return agree/len(texts) if len(texts) else 1.0, confusion
@@ -0,0 +1,222 @@
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError: # Unix only
+    # without it: no CPU time of child processes, no peak RSS where /proc is missing
+    resource = None
+
+from helpers import feature_cache
+
+# file for measuring the stages of an analysis run:
+# wall and CPU time, peak resident memory, documents processed per stage and sentiment bucket,
+# where the time went (reading documents, tokenizing, scoring sentiment),
+# and an optional sampling profiler writing the stacks of a stage in collapsed format
+# (one "outer;...;inner count" line per stack, read by flamegraph.pl or speedscope)
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def max_rss():
+    """
+    Peak resident memory of this process so far, in bytes
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # kilobytes on Linux
+
+
+def current_rss():
+    """
+    Resident memory of this process in bytes (peak so far where /proc is not available)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return max_rss()
+
+
+def children_cpu():
+    # CPU time of the child processes that have finished (e.g. ProcessPoolExecutor workers)
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples the resident memory every interval seconds while a stage runs,
+    and the stack of the thread running the stage when it is profiled
+    """
+
+    def __init__(self, interval, thread_id=None):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.thread_id = thread_id # thread to profile, memory only if None
+        self.peak = current_rss()
+        self.stacks = {} # collapsed stack -> number of samples
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        self.peak = max(self.peak, current_rss())
+        if self.thread_id is None:
+            return
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        if stack:
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                f.write("{} {}\n".format(stack, count))
+
+
+class CountedCollection:
+    """
+    CountedCollection wraps a collection (MongoDB or TweetSnapshot) for one stage:
+    documents returned by find() are counted, and the time spent waiting for them is measured.
+    Every other attribute is the one of the collection.
+    """
+
+    def __init__(self, collection, metrics, record):
+        self.collection = collection
+        self.metrics = metrics
+        self.record = record
+
+    def find(self, *args, **kwargs):
+        return self.metrics.counted(self.collection.find(*args, **kwargs), self.record)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+class StageMetrics:
+    """
+    StageMetrics records one entry per stage of a run:
+    with metrics.stage("accumulate") as record: ... measures the block,
+    record["docs"] can be set by the stage or counted by reading through counted() or collection().
+    Stages named in profile ("all" for every stage) are sampled every profile_interval seconds
+    and their stacks written next to the metrics file.
+    """
+
+    def __init__(self, profile=(), profile_interval=0.005, memory_interval=0.01, verbose=True):
+        self.profile = set(profile)
+        self.profile_interval = profile_interval
+        self.memory_interval = memory_interval
+        self.verbose = verbose
+        self.stages = []
+        self.profiles = {} # (stage, bucket) -> sampler of the profiled stages, saved with the metrics
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, bucket=None):
+        """
+        :name -> stage name
+        :bucket -> sentiment bucket of the stage ("all", "negative", ...), None when it covers every bucket
+        """
+        record = {"stage": name, "bucket": bucket, "docs": None, "read_seconds": 0.0}
+        profiled = name in self.profile or "all" in self.profile
+        sampler = _Sampler(self.profile_interval if profiled else self.memory_interval,
+                           threading.get_ident() if profiled else None)
+        cache = (feature_cache.tokenize_seconds, feature_cache.sentiment_seconds, feature_cache.hits, feature_cache.misses)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        children = children_cpu()
+        sampler.start()
+        try:
+            yield record
+        finally:
+            sampler.stop()
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu + children_cpu() - children
+            record["peak_rss_bytes"] = sampler.peak
+            record["tokenize_seconds"] = feature_cache.tokenize_seconds - cache[0]
+            record["sentiment_seconds"] = feature_cache.sentiment_seconds - cache[1]
+            record["cache_hits"] = feature_cache.hits - cache[2]
+            record["cache_misses"] = feature_cache.misses - cache[3]
+            record["docs_per_second"] = record["docs"] / record["wall_seconds"] if record["docs"] and record["wall_seconds"] else None
+            if profiled:
+                record["profile_samples"] = sampler.samples
+                self.profiles[(name, bucket)] = sampler
+            self.stages.append(record)
+            if self.verbose:
+                print("   {}: {:.2f}s wall ({:.2f}s reading, {:.2f}s tokenizing), {:.2f}s CPU, {:.0f}MB peak RSS{}".format(
+                    name if bucket is None else name + " " + bucket, record["wall_seconds"], record["read_seconds"], record["tokenize_seconds"],
+                    record["cpu_seconds"], record["peak_rss_bytes"] / 2**20,
+                    ", {} docs ({:.0f}/s)".format(record["docs"], record["docs_per_second"]) if record["docs_per_second"] else ""))
+
+    def counted(self, tweets, record):
+        """
+        Iterates over tweets (e.g. a MongoDB cursor), counting them in record["docs"]
+        and the time spent waiting for each one in record["read_seconds"]
+        """
+        iterator = iter(tweets)
+        record["docs"] = record["docs"] or 0
+        while True:
+            start = time.perf_counter()
+            try:
+                tweet = next(iterator)
+            except StopIteration:
+                record["read_seconds"] += time.perf_counter() - start
+                return
+            record["read_seconds"] += time.perf_counter() - start
+            record["docs"] += 1
+            yield tweet
+
+    def collection(self, collection, record):
+        """
+        return collection counting the documents read by the stage of record
+        """
+        return CountedCollection(collection, self, record)
+
+    def save(self, path, **run):
+        """
+        Writes the stages as JSON, and the stacks of the profiled stages next to it
+        :run -> extra information about the run (collection, options...)
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        directory = os.path.dirname(path)
+        for (name, bucket), sampler in self.profiles.items():
+            profile = os.path.join(directory, "profile_{}{}.txt".format(name, "_" + bucket if bucket else ""))
+            sampler.save(profile)
+            for record in self.stages:
+                if record["stage"] == name and record["bucket"] == bucket:
+                    record["profile"] = profile
+        metrics = {
+            "started": self.started.isoformat(timespec="seconds"),
+            "command": sys.argv,
+            "run": run,
+            "wall_seconds": time.perf_counter() - self.start,
+            "max_rss_bytes": max_rss(),
+            "stages": self.stages,
+        }
+        with open(path, "w") as f:
+            json.dump(metrics, f, indent=1)
+        return metrics
@@ -4,6 +4,7 @@ parser = argparse.ArgumentParser(description='Sample tweets for one hour and sto
 
 parser.add_argument('--collection', '-c', action='store', type=str, help='Name of the collection to store the data in (in MongoDB.twitter_db)', required=True)
 parser.add_argument('--time', '-t', action="store", type=int, help="How long to run the crawler for in minutes", required=False)
+parser.add_argument('--spill', action="store", type=str, help="File to keep tweets in when MongoDB cannot keep up (written at the end), dropped otherwise", required=False)
 
 args = parser.parse_args()
 collection = args.collection
@@ -14,13 +15,18 @@ if not duration:
 ## imports after argparse to save performance ##
 
 import tweepy
+import time
 from datetime import datetime, timedelta
 from pymongo import MongoClient
+from tweet_ingest import BufferedWriter, TweetDeduplicator, TweetListener, ensure_unique_ids
 from keys import consumer_key, consumer_secret, access_token, access_secret
 
 # set up pymongo
 client = MongoClient()
 db = client.twitter_db # change this for different Mongo database
+ensure_unique_ids(db[collection]) # a tweet id is stored once, even across runs
+# tweets are written in batches by a background thread, tweets already written (or on their way) in this run are dropped first
+writer = BufferedWriter(db[collection], spill_path=args.spill, dedup=TweetDeduplicator())
 
 # set up Twitter API
 CONSUMER_KEY = consumer_key
@@ -32,24 +38,14 @@ auth = tweepy.OAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
 auth.set_access_token(ACCESS_TOKEN, ACCESS_SECRET)
 api = tweepy.API(auth, parser=tweepy.parsers.JSONParser(), wait_on_rate_limit=True, wait_on_rate_limit_notify=True)
 
-count = 0 # tally up number of Tweets streamed
+class TwitterStream(TweetListener, tweepy.StreamListener):
+    # created_at converted for MongoDB, tweet queued in the writer (see tweet_ingest.TweetListener)
 
-class TwitterStream(tweepy.StreamListener):
+    def __init__(self):
+        TweetListener.__init__(self, writer)
+        tweepy.StreamListener.__init__(self)
 
-    def on_status(self, status):
-        global count
-        json_tweet = status._json
-        json_tweet['created_at'] = datetime.strptime(json_tweet['created_at'], '%a %b %d %H:%M:%S +0000 %Y') # convert datetime for MongoDB
-        db[collection].insert(json_tweet)
-        count += 1
-        return True
-
-    def on_error(self, status_code):
-        if status_code == 420:
-            #returning False in on_error disconnects the stream
-            return False
-
-listener = TwitterStream()
+listener = TwitterStream() # tallies up number of Tweets streamed
 streamer = tweepy.Stream(auth=auth, listener=listener)
 
 start = datetime.now()
@@ -62,8 +58,13 @@ streamer.sample(languages=["en"], is_async=True)
 #streamer.filter(track=["coronavirus", "covid-19", "covid19", "SARS-COV-2", "SARS-COV2", "2019-nCov", "covid", "cov19"],
 #                languages=["en"], is_async=True)
 
-while datetime.now() < one_hour:
-    continue
+time.sleep(max(0, (one_hour - datetime.now()).total_seconds())) # the stream runs in its own thread
 
 streamer.disconnect()
-print("{} tweets were streamed from {} to {}".format(count, start, one_hour, collection))
+stats = writer.close() # write what is still queued
+print("{} tweets were streamed from {} to {}".format(listener.count, start, one_hour, collection))
+print("{} duplicates were detected, estimated false positive rate of the duplicate filter: {:.4%}".format(
+    stats["filtered"] + stats["duplicates"], stats["false_positive_rate"]))
+print("{} written, {} spilled to disk, {} dropped, {} not written, {} flushes ({} tried again, {:.3f}s mean, {:.3f}s max)".format(
+    stats["written"], stats["spilled"], stats["dropped"], stats["errors"], stats["flushes"], stats["retried"],
+    stats["mean_flush_latency"], stats["max_flush_latency"]))
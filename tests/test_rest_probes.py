@@ -0,0 +1,140 @@
+import asyncio
+import datetime
+import itertools
+import time
+
+from aiohttp import web
+from pymongo.results import InsertManyResult
+
+from crawl_frontier import CrawlFrontier
+from crawl_scheduler import RateLimitScheduler
+from rest_probes import ProbeEngine
+from tweet_ingest import BufferedWriter, TweetListener
+
+
+class StandInAPI:
+    """
+    Local stand-in for the search endpoint (as benchmarks/probe_benchmark.py):
+    pages of canned tweets chained by max_id, a request budget counted down in the rate limit headers,
+    and the first too_many requests answered with 429 until the next second
+    """
+
+    def __init__(self, pages=3, per_page=10, remaining=1000, too_many=0):
+        self.pages = pages
+        self.per_page = per_page
+        self.remaining = remaining
+        self.too_many = too_many
+        self.ids = itertools.count(10**18, -1) # newer tweets first, as the API
+        self.chains = {} # max_id of the next page -> page number
+        self.hits = [] # (time, max_id or None, status) of every request
+
+    def page_of_tweets(self, request):
+        page = self.chains.pop(int(request.query["max_id"]), self.pages) if "max_id" in request.query else 0
+        if page >= self.pages:
+            return []
+        tweets = []
+        for _ in range(self.per_page):
+            tweet_id = next(self.ids)
+            tweets.append({"id": tweet_id, "id_str": str(tweet_id), "created_at": "Wed Mar 04 10:00:00 +0000 2020",
+                           "full_text": "canned tweet about covid #covid", "truncated": False,
+                           "user": {"id": 1, "screen_name": "user1", "followers_count": 100},
+                           "entities": {"hashtags": [{"text": "covid"}], "user_mentions": []}})
+        self.chains[tweets[-1]["id"] - 1] = page + 1
+        return tweets
+
+    async def search(self, request):
+        max_id = int(request.query["max_id"]) if "max_id" in request.query else None
+        if self.too_many:
+            self.too_many -= 1
+            self.hits.append((time.time(), max_id, 429))
+            return web.json_response({"errors": [{"code": 88}]}, status=429,
+                                     headers={"x-rate-limit-reset": str(int(time.time()) + 1)})
+        self.remaining -= 1
+        self.hits.append((time.time(), max_id, 200))
+        headers = {"x-rate-limit-remaining": str(self.remaining), "x-rate-limit-limit": "1000",
+                   "x-rate-limit-reset": str(int(time.time()) + 3600)}
+        return web.json_response({"statuses": self.page_of_tweets(request), "search_metadata": {}}, headers=headers)
+
+
+class StubScheduler(RateLimitScheduler):
+    """
+    RateLimitScheduler without the API: budgets only come from update() and the response headers
+    """
+
+    def __init__(self, budgets):
+        super().__init__(api=None)
+        for endpoint, remaining in budgets.items():
+            self.buckets[endpoint].update(remaining, 1000, time.time() + 3600)
+
+
+class ListCollection:
+    def __init__(self):
+        self.documents = []
+
+    def insert_many(self, documents, ordered=True):
+        self.documents.extend(documents)
+        return InsertManyResult([document["id"] for document in documents], acknowledged=True)
+
+
+def run_probes(api, hashtags=("covid",), duration=1.5, scheduler=None, on_tweet=None):
+    async def run():
+        app = web.Application()
+        app.router.add_get('/search/tweets.json', api.search)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, 'localhost', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        frontier = CrawlFrontier()
+        for hashtag in hashtags:
+            frontier.put(hashtag)
+        engine = ProbeEngine(on_tweet or (lambda tweet: None), scheduler, base_url="http://localhost:{}".format(port))
+        try:
+            return await engine.run(duration, hashtags=frontier)
+        finally:
+            await runner.cleanup()
+    return asyncio.run(run())
+
+
+def test_pages_follow_max_id_and_tweets_reach_the_writer():
+    api = StandInAPI(pages=3, per_page=10)
+    collection = ListCollection()
+    writer = BufferedWriter(collection, flush_interval=0.1)
+    listener = TweetListener(writer)
+    requests, tweets, errors = run_probes(api, on_tweet=listener.add_to_database)
+    writer.close()
+
+    # 3 pages, then an empty one ends the search
+    assert (requests, tweets, errors) == (4, 30, 0)
+    max_ids = [max_id for _, max_id, _ in api.hits]
+    assert max_ids[0] is None
+    for page, max_id in enumerate(max_ids[1:]):
+        assert max_id == 10**18 - 10 * (page + 1) # lowest id of the previous page - 1
+    assert listener.count == 30
+    assert len(collection.documents) == 30
+    assert len({tweet["id"] for tweet in collection.documents}) == 30
+    assert all(isinstance(tweet["created_at"], datetime.datetime) for tweet in collection.documents)
+
+
+def test_requests_stop_when_the_budget_is_spent():
+    api = StandInAPI(pages=10, per_page=10, remaining=2)
+    scheduler = StubScheduler({"search": 2})
+    start = time.time()
+    requests, tweets, errors = run_probes(api, scheduler=scheduler)
+
+    # the third request waits for a window that does not reset before the end of the run
+    assert (requests, tweets, errors) == (2, 20, 0)
+    assert len(api.hits) == 2
+    assert scheduler.buckets["search"].tokens == 0
+    assert scheduler.stopped.is_set()
+    assert time.time() - start < 5 # stopping the scheduler wakes up the probe waiting on the budget
+
+
+def test_429_waits_for_the_reset():
+    api = StandInAPI(pages=2, per_page=10, too_many=1)
+    requests, tweets, errors = run_probes(api, duration=3)
+
+    assert (requests, tweets, errors) == (3, 20, 0) # the 429 is neither a request nor an error
+    assert [status for _, _, status in api.hits] == [429, 200, 200, 200]
+    assert api.hits[1][1] is None # the same first page asked again
+    assert api.hits[1][0] - api.hits[0][0] >= 1 # after at least a second (reset time)
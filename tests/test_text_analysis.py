@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import random as sparse_random
+
+from text_analysis import summarise_clusters
+
+
+def test_summarise_clusters_same_words_as_the_dataframe_means():
+    rng = np.random.default_rng(2211)
+    text = sparse_random(500, 300, density=0.02, format="csr", random_state=2211)
+    clusters = rng.integers(0, 7, 500)
+    labels = ["word{}".format(i) for i in range(300)]
+
+    # the DataFrame version: dense means of each cluster, top words by np.argsort
+    means = pd.DataFrame(text.toarray()).groupby(clusters).mean()
+    expected = ["Cluster {}: {}".format(i, ', '.join([labels[t] for t in np.argsort(row.values)[-10:]]))
+                for i, row in means.iterrows()]
+
+    top = summarise_clusters(text, clusters, labels)
+    assert len(top) == 7
+    for line, reference, (_, row) in zip(top, expected, means.iterrows()):
+        if line != reference: # only words with equal means can come in another order
+            words = [int(w[len("word"):]) for w in line.split(": ")[1].split(", ")]
+            reference_words = [int(w[len("word"):]) for w in reference.split(": ")[1].split(", ")]
+            assert np.allclose(row.values[words], row.values[reference_words], rtol=0, atol=1e-15)
+
+
+def test_summarise_clusters_fewer_words_than_n():
+    text = sparse_random(20, 4, density=0.5, format="csr", random_state=2211)
+    clusters = np.arange(20) % 2
+    top = summarise_clusters(text, clusters, ["a", "b", "c", "d"])
+    assert [sorted(line.split(": ")[1].split(", ")) for line in top] == [["a", "b", "c", "d"]] * 2
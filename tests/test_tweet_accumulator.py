@@ -0,0 +1,101 @@
+import datetime
+
+from bson import ObjectId
+
+from helpers import feature_cache
+from tweet_accumulator import AnalysisState, accumulate
+
+
+class ListCollection:
+    """
+    In-memory stand-in for the collection queries of AnalysisState: _id $gte/$lt, sentiment $exists, sort by _id
+    """
+
+    def __init__(self):
+        self.documents = []
+
+    def insert(self, tweet):
+        self.documents.append(tweet)
+
+    def find(self, query={}, sort=None):
+        tweets = [t for t in self.documents if ("sentiment" in t) == query.get("sentiment", {}).get("$exists", "sentiment" in t)]
+        if "$gte" in query.get("_id", {}):
+            tweets = [t for t in tweets if t["_id"] >= query["_id"]["$gte"]]
+        if "$lt" in query.get("_id", {}):
+            tweets = [t for t in tweets if t["_id"] < query["_id"]["$lt"]]
+        return iter(sorted(tweets, key=lambda t: t["_id"]) if sort else tweets)
+
+    def count_documents(self, query):
+        return len(list(self.find(query)))
+
+
+def make_tweet(i, created, sentiment=0):
+    tweet = {"_id": ObjectId.from_datetime(created), "id": i, "full_text": "tweet {}".format(i), "truncated": False,
+             "user": {"screen_name": "user{}".format(i % 3)}, "is_quote_status": False, "in_reply_to_status_id": None,
+             "entities": {"hashtags": [{"text": "covid"}], "user_mentions": [{"screen_name": "user{}".format(i % 5)}]}}
+    if sentiment is not None:
+        tweet["sentiment"] = sentiment
+    feature_cache.put(tweet, "tweet") # no tokenizer needed
+    return tweet
+
+
+def test_tweet_with_older_id_inserted_after_the_mark_is_added(tmp_path):
+    start = datetime.datetime(2020, 3, 4, tzinfo=datetime.timezone.utc)
+    collection = ListCollection()
+    for i in range(5):
+        collection.insert(make_tweet(i, start + datetime.timedelta(seconds=10 * i)))
+    state = AnalysisState(str(tmp_path / "state.pkl"))
+    assert state.update(collection) == 5
+    state.save()
+
+    # _id made before the mark (client side), inserted after the update
+    late = make_tweet(5, start + datetime.timedelta(seconds=15))
+    collection.insert(late)
+    state = AnalysisState(str(tmp_path / "state.pkl"))
+    assert state.update(collection) == 1
+    assert state.update(collection) == 0 # not added twice
+    assert state.numbers == accumulate_numbers(collection)
+    assert state.buckets["all"].count == accumulate(collection)["all"].count == 6
+
+
+def test_tweet_without_sentiment_is_added_once_scored():
+    start = datetime.datetime(2020, 3, 4, tzinfo=datetime.timezone.utc)
+    collection = ListCollection()
+    unscored = make_tweet(0, start, sentiment=None)
+    collection.insert(unscored)
+    collection.insert(make_tweet(1, start + datetime.timedelta(seconds=1)))
+    state = AnalysisState()
+    assert state.update(collection) == 1
+    assert state.high_water_mark == collection.documents[1]["_id"]
+
+    unscored["sentiment"] = 1
+    assert state.update(collection) == 1
+    assert state.numbers[1][0] == 1
+
+
+def test_tweet_before_the_window_rebuilds_the_state():
+    start = datetime.datetime(2020, 3, 4, tzinfo=datetime.timezone.utc)
+    collection = ListCollection()
+    for i in range(5):
+        collection.insert(make_tweet(i, start + datetime.timedelta(hours=i)))
+    state = AnalysisState()
+    assert state.update(collection) == 5
+    assert state.missed(collection) == 0
+
+    # e.g. an archive reloaded with its old _id, long before the overlap
+    collection.insert(make_tweet(5, start - datetime.timedelta(days=1)))
+    assert state.missed(collection) == 1
+    assert state.update(collection) == 6 # every tweet read again
+    assert state.missed(collection) == 0
+    assert state.numbers == accumulate_numbers(collection)
+    assert state.buckets["all"].count == accumulate(collection)["all"].count == 6
+    assert state.buckets["all"].mentions_count == accumulate(collection)["all"].mentions_count
+
+
+def accumulate_numbers(collection):
+    numbers = {}
+    for tweet in collection.find({"sentiment": {"$exists": True}}):
+        for key in ("all", tweet["sentiment"]):
+            total = numbers.get(key, (0, 0, 0, 0))
+            numbers[key] = (total[0] + 1,) + total[1:]
+    return numbers
@@ -0,0 +1,56 @@
+import itertools
+import random
+
+from tweet_networks import HashtagCooccurrence, hashtag_network_statistics
+
+
+def reference_hashtag_network_statistics(hashtags):
+    # hashtag_network_statistics() as it was before the inverted index: scans every visited list
+    ties = 0
+    visited = []
+    triads = 0
+    for tag_list in hashtags:
+        if len(tag_list) > 1:
+            if tag_list not in visited:
+                ties += sum(1 for ignore in itertools.combinations(tag_list, 2))
+                if len(tag_list) > 2:
+                    triads += sum(1 for ignore in itertools.combinations(tag_list, 3))
+                for h in tag_list:
+                    for other in tag_list:
+                        if h != other:
+                            for visited_list in visited:
+                                if other in visited_list:
+                                    triads += len(visited_list)-1
+                visited.append(tag_list)
+    return triads, ties
+
+
+def make_tag_lists(n, vocabulary=40, seed=2211):
+    # few hashtags so that lists share many of them, repeated lists and hashtags repeated in a list
+    r = random.Random(seed)
+    tags = ["tag{}".format(i) for i in range(vocabulary)]
+    weights = list(itertools.accumulate(1/(i+1) for i in range(vocabulary)))
+    lengths = [0, 1, 1, 2, 2, 3, 4, 6]
+    tag_lists = [r.choices(tags, cum_weights=weights, k=r.choice(lengths)) for _ in range(n)]
+    return tag_lists + r.sample(tag_lists, n // 10)
+
+
+def test_same_statistics_as_the_pairwise_computation():
+    for seed in range(5):
+        tag_lists = make_tag_lists(300, seed=seed)
+        assert hashtag_network_statistics(tag_lists) == reference_hashtag_network_statistics(tag_lists)
+
+
+def test_same_statistics_from_a_cooccurrence_table():
+    tag_lists = [sorted(tags) for tags in make_tag_lists(300)]
+    hashtags = HashtagCooccurrence()
+    for tags in tag_lists:
+        hashtags.add(tags)
+    assert hashtag_network_statistics(hashtags) == reference_hashtag_network_statistics(tag_lists)
+
+
+def test_small_network():
+    # ties: 3 + 1, triads: 1 in [a, b, c], then [c, d] linked to it through c (d-c-a, d-c-b),
+    # the repeated list and the single hashtag add nothing
+    tag_lists = [["a", "b", "c"], ["c", "d"], ["a", "b", "c"], ["e"]]
+    assert hashtag_network_statistics(tag_lists) == reference_hashtag_network_statistics(tag_lists) == (3, 4)
@@ -1,41 +1,117 @@
 from sklearn.cluster import MiniBatchKMeans
-from sklearn.feature_extraction.text import TfidfVectorizer
-import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from sklearn.preprocessing import normalize
+from sklearn.metrics import silhouette_score
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import UpdateMany
+from scipy.sparse import csr_matrix
 import numpy as np
+import itertools
+import pickle
+import time
 
-from helpers import tokenize, parse_tweet, find_sentiment_tb
+from helpers import feature_cache, TEXT_PROJECTION
+from sentiment_scorer import score_batch
 
 # file for text analysis
 # either: topic extraction (https://www.kaggle.com/jbencina/clustering-documents-with-tfidf-and-kmeans)
 # or sentiment analysis
 
-def find_optimal_size(data, max_k):
+SEARCH_SAMPLE_SIZE = 20000 # rows K-means is fitted on when searching with elbow/silhouette
+SILHOUETTE_SAMPLE_SIZE = 5000 # silhouette is quadratic in the number of rows
+
+
+def _fit_kmeans(data, k, method):
+    km = MiniBatchKMeans(n_clusters=k, init_size=1024, batch_size=2048, random_state=2211).fit(data)
+    if method == "silhouette":
+        return k, silhouette_score(data, km.labels_, sample_size=min(data.shape[0], SILHOUETTE_SAMPLE_SIZE), random_state=2211)
+    return k, km.inertia_
+
+def _select_k(ks, scores, method, tol, patience):
+    """
+    Pick K from the scores computed so far (in increasing K)
+    return chosen K, whether the search can stop
+    """
+    if method == "elbow":
+        # the curve is flat once adding clusters reduces inertia by less than tol (relative)
+        flat = 0
+        for i in range(1, len(ks)):
+            gain = (scores[i-1] - scores[i]) / scores[i-1] if scores[i-1] > 0 else 0 # inertia 0: nothing left to gain
+            if gain < tol:
+                flat += 1
+                if flat == patience:
+                    return ks[i-patience], True
+            else:
+                flat = 0
+        return ks[-1], False
+
+    if method == "silhouette":
+        # highest silhouette, stop once it has not improved for a while
+        best = int(np.argmax(scores))
+        return ks[best], len(ks) - 1 - best >= patience
+
+    # inertia: minimum within-cluster sum of squares, every K has to be tried
+    return ks[int(np.argmin(scores))], False
+
+def find_optimal_size(data, max_k, method="inertia", workers=1, sample_size=None, tol=0.01, patience=2):
     """
-    Find optimal size for K-means (2 step increment)
+    Find optimal size for K-means (2 step increment), 1 when there are fewer than 3 rows
     :max_k -> max number of clusters to consider
+    :method -> "inertia" (minimum inertia, tries every K on all of the data),
+               "elbow" or "silhouette" (fitted on a sample, stops once the curve flattens)
+    :workers -> number of processes fitting candidate K values at the same time
+    :sample_size -> number of rows to search on (default: all for inertia, SEARCH_SAMPLE_SIZE otherwise)
+    :tol, patience -> elbow: relative inertia gain under which a step is flat, number of flat steps to stop
+                      silhouette: number of K values without improvement to stop
     """
-    iters = range(2, max_k+1, 2)
+    start = time.perf_counter()
+    iters = list(range(2, max_k+1, 2))
 
-    min_sse = float('inf')
+    if sample_size is None and method != "inertia":
+        sample_size = SEARCH_SAMPLE_SIZE
+    if sample_size is not None and sample_size < data.shape[0]:
+        rows = np.random.RandomState(2211).choice(data.shape[0], sample_size, replace=False)
+        data = data[rows]
+    iters = [k for k in iters if k < data.shape[0]]
+    if not iters: # fewer than 3 rows: no K to search, one cluster (none without rows)
+        optimal_k = min(data.shape[0], 1)
+        print("Found optimal K: {} ({} rows, no search)".format(optimal_k, data.shape[0]))
+        return optimal_k
+
+    results = {}
     optimal_k = 0
-    for k in iters:
-        sse = MiniBatchKMeans(n_clusters=k, init_size=1024, batch_size=2048, random_state=2211).fit(data).inertia_
-        if sse < min_sse:
-            min_sse = sse
-            optimal_k = k
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # fit K values in waves of one per worker, so the search can stop between waves
+        for i in range(0, len(iters), workers):
+            wave = iters[i:i+workers]
+            if executor is None:
+                scores = [_fit_kmeans(data, k, method) for k in wave]
+            else:
+                scores = executor.map(_fit_kmeans, [data]*len(wave), wave, [method]*len(wave))
+            results.update(scores)
+            ks = sorted(results)
+            optimal_k, done = _select_k(ks, [results[k] for k in ks], method, tol, patience)
+            if done:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-    print("Found optimal K: {}".format(optimal_k))
+    print("Found optimal K: {} ({} search over {} values of K, {:.1f}s)".format(optimal_k, method, len(results), time.perf_counter() - start))
     return optimal_k
 
-def topic_extraction(collection, max_topics=100):
+def topic_extraction(collection, max_topics=100, k_search="inertia", workers=1):
     """
     :collection -> MongoDB collection obtained with find() or list of documents
     :max_topics -> max number of topics to analyse K-means performance for
+    :k_search -> method used by find_optimal_size()
+    :workers -> number of processes for tokenizing and find_optimal_size()
     """
 
     corpus = []
-    for tweet in collection:
-        corpus.append(tokenize(parse_tweet(tweet)))
+    for batch in _batches(collection, 5000):
+        corpus += feature_cache.tokens_batch(batch, workers) # retweets reuse the tokens of their original
 
     tfidf = TfidfVectorizer( # parameters can be changed
         min_df = 5,
@@ -45,32 +121,179 @@ def topic_extraction(collection, max_topics=100):
 
     tfidf.fit(corpus)
     text = tfidf.transform(corpus)
-    labels = tfidf.get_feature_names()
+    labels = tfidf.get_feature_names_out()
 
-    K = find_optimal_size(text, max_topics)
+    K = find_optimal_size(text, max_topics, method=k_search, workers=workers)
 
     clusters = MiniBatchKMeans(n_clusters=K, init_size=1024, batch_size=2048, random_state=2211).fit_predict(text)
 
-    df = pd.DataFrame(text.todense()).groupby(clusters).mean()
+    return summarise_clusters(text, clusters, labels)
+
+def _top_columns(values, n):
+    # indices of the n largest values, lowest to highest as np.argsort(values)[-n:],
+    # partitioned first so only those n are sorted (equal values by column)
+    if n >= len(values):
+        return np.argsort(values, kind="stable")
+    top = np.sort(np.argpartition(-values, n)[:n])
+    return top[np.argsort(values[top], kind="stable")]
+
+def summarise_clusters(text, clusters, labels, n=10):
+    """
+    Top n words of each cluster by mean TF-IDF, computed from the non-zero entries of text
+    (text is never made dense, only the clusters x words means are)
+    Words are in the same order as the DataFrame version gave (np.argsort of the means of each cluster),
+    except for words with equal means, which can come in another order
+    :text -> sparse TF-IDF matrix
+    :clusters -> cluster of each row of text
+    :labels -> word of each column of text
+    return list of "Cluster i: word, ..., top word"
+    """
+    ids, rows = np.unique(clusters, return_inverse=True)
+    # sums of the rows of each cluster as one sparse product: (clusters x tweets) indicator @ (tweets x words)
+    membership = csr_matrix((np.ones(len(rows)), (rows, np.arange(len(rows)))), shape=(len(ids), text.shape[0]))
+    means = (membership @ text).toarray() / np.bincount(rows)[:, None]
 
     top = []
-    for i, r in df.iterrows():
-        top_words = ', '.join([labels[t] for t in np.argsort(r)[-10:]])
+    for row, i in enumerate(ids):
+        top_words = ', '.join([labels[t] for t in _top_columns(means[row], n)])
         top.append("Cluster {}: {}".format(i, top_words))
     return top
 
-def sentiment_analysis(collection):
+def _batches(collection, size):
+    collection = iter(collection)
+    batch = list(itertools.islice(collection, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(collection, size))
+
+class StreamingTopicModel:
     """
-    :collection -> MongoDB collection obtained with find() or list of documents
+    StreamingTopicModel clusters tweets into topics reading them in fixed-size batches,
+    so memory does not grow with the size of the collection.
+    A first pass picks a bounded vocabulary by document frequency, a second pass
+    vectorises each batch with TF-IDF on that vocabulary and trains K-means with partial_fit.
+    The model can be saved, loaded and trained further or used to assign new tweets to topics.
     """
 
-    scores = []
-    ids = []
+    def __init__(self, batch_size=10000, max_features=8000, min_df=5, max_df=0.95, max_vocabulary=500000, n_clusters=None, max_k=100):
+        """
+        :batch_size -> number of tweets held in memory at a time
+        :max_features, min_df, max_df -> same meaning as for TfidfVectorizer (features are kept by document frequency)
+        :max_vocabulary -> number of words counted in the first pass before rare words are dropped
+        :n_clusters -> number of topics, found with an elbow search on the first batch if None
+        :max_k -> max number of topics for that search
+        """
+        self.batch_size = batch_size
+        self.max_features = max_features
+        self.min_df = min_df
+        self.max_df = max_df
+        self.max_vocabulary = max_vocabulary
+        self.n_clusters = n_clusters
+        self.max_k = max_k
+        self.labels = None
+        self.idf = None
+        self.kmeans = None
+        self._vectorizer = None
+
+    def fit(self, collection):
+        """
+        :collection -> MongoDB collection reference (it is read twice)
+        """
+        self.fit_vocabulary(collection.find())
+        self.partial_fit(collection.find())
+        return self
+
+    def fit_vocabulary(self, tweets):
+        """
+        First pass: document frequency of each word, keeping at most max_vocabulary words
+        :tweets -> MongoDB cursor or iterable of tweets
+        """
+        analyzer = CountVectorizer().build_analyzer() # same words as TfidfVectorizer
+        df = {}
+        n = 0
+        for batch in _batches(tweets, self.batch_size):
+            for tokens in feature_cache.tokens_batch(batch):
+                for word in set(analyzer(tokens)):
+                    df[word] = df.get(word, 0) + 1
+            n += len(batch)
+            if len(df) > self.max_vocabulary: # drop the rarest words to stay bounded
+                cutoff = sorted(df.values(), reverse=True)[self.max_vocabulary//2]
+                df = {word: count for word, count in df.items() if count > cutoff}
+
+        kept = [(count, word) for word, count in df.items() if count >= self.min_df and count <= self.max_df * n]
+        kept = sorted(kept, reverse=True)[:self.max_features]
+        self.labels = sorted(word for count, word in kept)
+        counts = np.array([df[word] for word in self.labels])
+        self.idf = np.log((1 + n) / (1 + counts)) + 1 # smoothed idf, as TfidfVectorizer
+        self._vectorizer = None
+        return self
+
+    def transform(self, tweets):
+        """
+        :tweets -> list of tweets
+        return sparse TF-IDF matrix of the tweets over the model vocabulary
+        """
+        if self._vectorizer is None:
+            self._vectorizer = CountVectorizer(vocabulary=self.labels)
+        counts = self._vectorizer.transform(feature_cache.tokens_batch(tweets))
+        return normalize(counts.multiply(self.idf).tocsr())
+
+    def partial_fit(self, tweets):
+        """
+        Second pass, or further training on new tweets once the model is fitted
+        :tweets -> MongoDB cursor or iterable of tweets
+        """
+        for batch in _batches(tweets, self.batch_size):
+            text = self.transform(batch)
+            if self.kmeans is None:
+                if self.n_clusters is None:
+                    self.n_clusters = find_optimal_size(text, self.max_k, method="elbow")
+                self.kmeans = MiniBatchKMeans(n_clusters=self.n_clusters, init_size=1024, batch_size=2048, random_state=2211)
+            self.kmeans.partial_fit(text)
+        return self
 
-    for tweet in collection:
-        text = parse_tweet(tweet)
-        scores.append(find_sentiment_tb(tokenize(text)))
-        ids.append(tweet['_id'])
+    def predict(self, tweets):
+        """
+        Assign tweets to the fitted topics without refitting
+        :tweets -> MongoDB cursor or iterable of tweets
+        return array of cluster numbers
+        """
+        clusters = [self.kmeans.predict(self.transform(batch)) for batch in _batches(tweets, self.batch_size)]
+        return np.concatenate(clusters) if clusters else np.array([], dtype=int)
+
+    def top_words(self, n=10):
+        """
+        Top n words of each topic from the K-means centroids (mean TF-IDF of each cluster)
+        return list of "Cluster i: word, ..., top word"
+        """
+        return ["Cluster {}: {}".format(i, ', '.join([self.labels[t] for t in _top_columns(centroid, n)]))
+                for i, centroid in enumerate(self.kmeans.cluster_centers_)]
+
+    def save(self, path):
+        self._vectorizer = None
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+def _score_tweets(tweets, scorer, workers, executor=None):
+    if scorer == "lexicon":
+        return score_batch(feature_cache.tokens_batch(tweets, workers, executor), workers=workers, executor=executor)
+    return np.array(feature_cache.sentiment_batch(tweets, workers, executor))
+
+def sentiment_analysis(collection, scorer="textblob", workers=1):
+    """
+    :collection -> MongoDB collection obtained with find() or list of documents
+    :scorer -> "textblob" (one TextBlob per tweet) or "lexicon" (sentiment_scorer.score_batch, same scores)
+    :workers -> number of processes for tokenizing and the lexicon scorer
+    """
+
+    tweets = list(collection)
+    scores = _score_tweets(tweets, scorer, workers)
+    ids = [tweet['_id'] for tweet in tweets]
     assert len(scores) == len(ids)
 
     scores = np.array(scores)
@@ -78,14 +301,88 @@ def sentiment_analysis(collection):
 
     return scores, ids
 
-def add_sentiment_to_db(scores, ids, collection):
+class SentimentWriter:
+    """
+    SentimentWriter buffers (id, score) pairs and writes them to MongoDB in batches:
+    one unordered bulk_write of update_many({"_id": {"$in": ids}}) per score value
+    instead of one update_one round trip per tweet.
+    """
+
+    def __init__(self, collection, batch_size=5000, report_every=100000):
+        """
+        :collection -> MongoDB collection reference
+        :batch_size -> number of tweets per bulk write
+        :report_every -> print progress every this many tweets (0 for no progress)
+        """
+        self.collection = collection
+        self.batch_size = batch_size
+        self.report_every = report_every
+        self.pending = {}
+        self.n_pending = 0
+        self.written = 0
+        self.matched = 0
+        self.start = time.perf_counter()
+
+    def add(self, tid, score):
+        self.pending.setdefault(int(score), []).append(tid)
+        self.n_pending += 1
+        if self.n_pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.n_pending:
+            return
+        requests = [UpdateMany({"_id": {"$in": ids}}, {"$set": {"sentiment": score}}) for score, ids in self.pending.items()]
+        result = self.collection.bulk_write(requests, ordered=False)
+        self.matched += result.matched_count
+        previous = self.written
+        self.written += self.n_pending
+        self.pending = {}
+        self.n_pending = 0
+        if self.report_every and self.written // self.report_every > previous // self.report_every:
+            elapsed = time.perf_counter() - self.start
+            print("Sentiment written for {} tweets ({:.0f} tweets/s)".format(self.written, self.written/elapsed))
+
+    def close(self):
+        """
+        Write what is left and check every tweet was found (no extra query needed)
+        raise RuntimeError if some tweets were not in the collection (e.g. deleted while scoring)
+        """
+        self.flush()
+        if self.matched != self.written:
+            raise RuntimeError("Sentiment written for {} tweets but {} were found in the collection".format(self.written, self.matched))
+
+def add_sentiment_to_db(scores, ids, collection, batch_size=5000):
     """
     :collection -> MongoDB collection reference
     :scores -> sentiment scores obtained with sentiment_analysis()
     :ids -> document ids obtained with sentiment_analysis()
+    :batch_size -> number of tweets per bulk write
     """
 
+    writer = SentimentWriter(collection, batch_size)
     for tid, score in zip(ids, scores):
-        u = collection.update_one({"_id" : tid}, {"$set": {"sentiment": int(score)}})
-        
-    assert collection.count({"sentiment": {"$exists": True}}) == len(ids)
+        writer.add(tid, score)
+    writer.close()
+
+def stream_sentiment_to_db(collection, scorer="textblob", workers=1, batch_size=5000, query={}):
+    """
+    Score tweets batch by batch and write each batch back as soon as it is scored,
+    without keeping the ids of the whole collection
+    :collection -> MongoDB collection reference
+    :scorer, workers -> same as sentiment_analysis()
+    :batch_size -> number of tweets scored and written at a time
+    :query -> tweets to score (e.g. {"sentiment": {"$exists": False}} for the new ones only)
+    """
+    writer = SentimentWriter(collection, batch_size)
+    # one pool of workers for the whole stream, each batch is split evenly over it
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for batch in _batches(collection.find(query, TEXT_PROJECTION), batch_size):
+            batch_scores = _score_tweets(batch, scorer, workers, executor)
+            for tweet, score in zip(batch, batch_scores):
+                writer.add(tweet['_id'], score)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    writer.close()
@@ -0,0 +1,215 @@
+from nltk.probability import FreqDist
+from pymongo import ASCENDING
+from bson import ObjectId
+import datetime
+import os
+import pickle
+
+from helpers import parse_tweet, feature_cache
+from tweet_statistics import tally_entities, tally_numbers
+from tweet_networks import tally_user_interaction, tally_hashtags, HashtagCooccurrence
+
+# file for single-pass analysis
+# every tweet is read once from MongoDB and added to the "all" bucket
+# and to the bucket of its sentiment at the same time
+# AnalysisState keeps the buckets between runs so only new tweets are read
+
+SENTIMENT_TAGS = {-1: "negative", 0: "neutral", 1: "positive"}
+STATE_VERSION = 2 # of the files saved by AnalysisState
+OVERLAP = datetime.timedelta(minutes=10) # longest time between making the _id of a tweet and inserting it
+
+
+class TweetAccumulator:
+    """
+    TweetAccumulator keeps the running state of all the per-tweet analyses
+    (entities, concepts, character count, user and hashtag networks)
+    for one bucket of tweets.
+    """
+
+    def __init__(self):
+        self.mentions_count = {}
+        self.retweets_count = {}
+        self.hashtags_count = {}
+        self.fdist = FreqDist()
+        self.total_chars = 0
+        self.count = 0
+        self.nm = {} # normal mentions
+        self.rm = {} # retweet mentions
+        self.qm = {} # quote and reply mentions
+        self.hashtags = HashtagCooccurrence()
+
+    def add(self, tweet, text=None, tokens=None):
+        """
+        :tweet -> JSON Tweet
+        :text, tokens -> parsed text and tokens of the tweet if already computed
+        """
+        if text is None:
+            text = parse_tweet(tweet)
+        if tokens is None:
+            tokens = feature_cache.tokens(tweet).split(" ")
+        tally_entities(tweet, self.mentions_count, self.retweets_count, self.hashtags_count, self.fdist, tokens)
+        self.total_chars += len(text)
+        self.count += 1
+        tally_user_interaction(tweet, self.nm, self.rm, self.qm)
+        tally_hashtags(tweet, self.hashtags)
+
+    def top_entities(self):
+        """
+        Same output as tweet_statistics.extract_top_entities()
+        """
+        return self.mentions_count, self.retweets_count, self.hashtags_count, self.fdist.most_common(50)
+
+    def char_count(self):
+        """
+        Same output as tweet_statistics.get_char_count()
+        """
+        return self.total_chars//self.count
+
+    def user_interaction(self):
+        """
+        Same output as tweet_networks.user_interaction()
+        """
+        return self.nm, self.rm, self.qm
+
+    def hashtag_interaction(self):
+        """
+        Same output as tweet_networks.hashtag_interaction()
+        """
+        return self.hashtags
+
+
+def _buckets():
+    buckets = {"all": TweetAccumulator()}
+    for tag in SENTIMENT_TAGS.values():
+        buckets[tag] = TweetAccumulator()
+    return buckets
+
+def _add(buckets, tweet):
+    # parse and tokenize once for both buckets
+    text = parse_tweet(tweet)
+    tokens = feature_cache.tokens(tweet).split(" ")
+    buckets["all"].add(tweet, text, tokens)
+    tag = SENTIMENT_TAGS.get(tweet["sentiment"])
+    if tag is not None:
+        buckets[tag].add(tweet, text, tokens)
+
+def accumulate(collection):
+    """
+    Reads every tweet with a sentiment once and fills one accumulator per bucket
+    :collection -> MongoDB collection reference
+    return dictionary of tag ("all", "negative", "neutral", "positive") -> TweetAccumulator
+    """
+    buckets = _buckets()
+
+    for tweet in collection.find({"sentiment": {"$exists": True}}):
+        _add(buckets, tweet)
+
+    return buckets
+
+
+class AnalysisState:
+    """
+    AnalysisState keeps the accumulators of every bucket and the numbers of tweets by sentiment between runs,
+    with the high-water mark (largest _id) of the tweets already added.
+    update() reads only the tweets after the mark and adds them to the saved state,
+    so a collection the crawlers append to is analysed in time proportional to the new tweets.
+    ObjectIds are made by the clients (BatchInserter, BufferedWriter, several crawlers at once),
+    so a tweet can be inserted after tweets with a larger _id: every update reads again the tweets
+    made up to overlap before the mark and skips the ones already added (kept in recent).
+    Tweets with a sentiment older than that (a dump reloaded with json_to_mongo.py, a crawler clock
+    more than overlap off, a tweet scored long after it was stored) cannot be found that way:
+    update() counts the tweets before the window and rebuilds the state from scratch when the count
+    is not the number added before it (tweets removed are caught the same way).
+    Counts that depend on the order tweets are read in (retweet_count of the first retweet of a user)
+    follow _id order, so they can differ from a full accumulate() when insertion order is not _id order.
+    With a path, the state is loaded from it and save() writes it back.
+    """
+
+    def __init__(self, path=None, overlap=OVERLAP):
+        self.path = path
+        self.overlap = overlap
+        self.buckets = _buckets()
+        self.numbers = {"all": (0, 0, 0, 0)} # same output as tweet_statistics.number_by_sentiment()
+        self.high_water_mark = None # largest _id added
+        self.recent = set() # _id of the tweets added since the start of the overlap
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def _start(self):
+        # smallest _id that may not have been added yet
+        if isinstance(self.high_water_mark, ObjectId):
+            return ObjectId.from_datetime(self.high_water_mark.generation_time - self.overlap)
+        return self.high_water_mark # ids made in insertion order: no overlap needed
+
+    def window(self):
+        """
+        Query of the tweets that may not have been added yet (some of them already added, see recent)
+        """
+        if self.high_water_mark is None:
+            return {}
+        return {"_id": {"$gte": self._start()}}
+
+    def is_new(self, tweet):
+        return tweet["_id"] not in self.recent
+
+    def missed(self, collection):
+        """
+        return number of tweets with a sentiment before the window that were not added
+        (negative if tweets added were removed since), 0 when the state is up to date
+        """
+        if self.high_water_mark is None:
+            return 0
+        before = collection.count_documents({"_id": {"$lt": self._start()}, "sentiment": {"$exists": True}})
+        return before - (self.numbers["all"][0] - len(self.recent)) # recent: the tweets added in the window
+
+    def reset(self):
+        self.buckets = _buckets()
+        self.numbers = {"all": (0, 0, 0, 0)}
+        self.high_water_mark = None
+        self.recent = set()
+
+    def update(self, collection):
+        """
+        Adds the tweets with a sentiment not added yet, in _id order.
+        Tweets without a sentiment are left for a later update, the mark only moves over the tweets added.
+        Starts again from an empty state if tweets before the window were missed (see missed())
+        :collection -> MongoDB collection reference
+        return number of tweets added
+        """
+        missed = self.missed(collection)
+        if missed:
+            print("{} tweets before {} are not in the saved state, rebuilding it from every tweet".format(missed, self._start()))
+            self.reset()
+        query = dict(self.window(), sentiment={"$exists": True})
+        added = 0
+        for tweet in collection.find(query, sort=[("_id", ASCENDING)]):
+            if not self.is_new(tweet):
+                continue
+            _add(self.buckets, tweet)
+            tally_numbers(tweet, self.numbers)
+            self.recent.add(tweet["_id"])
+            if self.high_water_mark is None or tweet["_id"] > self.high_water_mark:
+                self.high_water_mark = tweet["_id"]
+            added += 1
+        if self.high_water_mark is not None: # tweets before the overlap are not read again
+            start = self._start()
+            self.recent = {i for i in self.recent if i >= start}
+        return added
+
+    def save(self, path=None):
+        path = path or self.path
+        state = {"version": STATE_VERSION, "buckets": self.buckets, "numbers": self.numbers,
+                 "high_water_mark": self.high_water_mark, "recent": self.recent}
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(state, f)
+        os.replace(path + ".tmp", path) # a crash while saving keeps the previous state
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        if state.get("version") != STATE_VERSION:
+            raise ValueError("{} was saved by another version of AnalysisState, delete it to start again".format(path))
+        self.buckets = state["buckets"]
+        self.numbers = state["numbers"]
+        self.high_water_mark = state["high_water_mark"]
+        self.recent = state["recent"]
@@ -0,0 +1,518 @@
+from bson import json_util
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import threading
+import queue
+import math
+import json
+import time
+import shutil
+import os
+
+from crawl_frontier import BloomFilter
+
+# file for loading tweets into MongoDB
+# - from files: documents are parsed one at a time and inserted in unordered batches,
+#   so memory depends on the batch size and not on the size of the file
+# - from the crawlers: tweets are queued and written by a background thread,
+#   so MongoDB latency does not hold up the stream
+#   (the crawler listeners are here too, so replay_stream.py can drive them without Twitter)
+
+_STOP = object() # tells the writer thread to finish
+
+DUPLICATE_KEY = 11000 # MongoDB error code of a duplicate key (e.g. the same _id loaded twice)
+
+_WHITESPACE = " \t\r\n"
+
+
+def iter_json(file, chunk_size=1 << 20, max_document=16 << 20):
+    """
+    Parses JSON documents from a file incrementally, with the extended JSON of bson.json_util ($oid, $date, ...)
+    Reads a JSON array of documents or one document per line (JSON lines)
+    :file -> file object opened in text mode
+    :chunk_size -> number of characters read at a time
+    :max_document -> longest document in characters (MongoDB documents are at most 16MB), ValueError is raised
+                     with the byte offset of a document still not parsed after that many characters,
+                     so a malformed or endless document does not fill memory until the end of the file
+    """
+    decoder = json.JSONDecoder(object_hook=json_util.object_hook)
+    buffer = ""
+    position = 0
+    offset = 0 # bytes of the file before buffer (JSON is UTF-8)
+    eof = False
+    while True:
+        # skip what separates documents: whitespace, the array brackets and commas
+        while position < len(buffer) and (buffer[position] in _WHITESPACE or buffer[position] in "[],"):
+            position += 1
+        if position == len(buffer):
+            if eof:
+                return
+            offset += len(buffer.encode("utf-8"))
+            buffer = file.read(chunk_size)
+            position = 0
+            eof = not buffer
+            continue
+        try:
+            document, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            start = offset + len(buffer[:position].encode("utf-8"))
+            if eof:
+                raise ValueError("Invalid JSON document at byte {}: {}".format(start, e.msg)) from e
+            if len(buffer) - position > max_document:
+                raise ValueError("No JSON document parsed in {} characters from byte {}: {}".format(
+                    len(buffer) - position, start, e.msg)) from e
+            # document cut at the end of the buffer: read more
+            more = file.read(chunk_size)
+            eof = not more
+            buffer = buffer[position:] + more
+            offset = start
+            position = 0
+            continue
+        yield document
+        position = end
+
+
+def convert_created_at(tweet):
+    """
+    Same conversion as the crawlers: Twitter's date string to a datetime for MongoDB
+    (dates already loaded as datetimes, e.g. from a bson dump, are kept)
+    """
+    if isinstance(tweet.get('created_at'), str):
+        tweet['created_at'] = datetime.strptime(tweet['created_at'], '%a %b %d %H:%M:%S +0000 %Y')
+    return tweet
+
+
+def ensure_unique_ids(collection, verbose=True):
+    """
+    Creates a unique index on the tweet id, so the same tweet cannot be stored twice
+    (documents without an id, e.g. not tweets, are not indexed)
+    :collection -> MongoDB collection reference
+    return True if the index exists, False if the collection already has duplicate tweet ids
+    """
+    try:
+        collection.create_index([("id", 1)], name="id_unique", unique=True,
+                                partialFilterExpression={"id": {"$exists": True}})
+        return True
+    except OperationFailure as e:
+        if e.code != DUPLICATE_KEY:
+            raise
+        if verbose:
+            print("Collection {} already has duplicate tweet ids, no unique index on id".format(collection.name))
+        return False
+
+
+class TweetDeduplicator:
+    """
+    TweetDeduplicator drops tweets already seen in this process before they are sent to MongoDB.
+    Ids of written tweets are kept in a Bloom filter (memory fixed by capacity), so a new tweet is dropped
+    with probability false_positive_rate(); repeats from other runs are caught by the unique index.
+    Tweets on their way to MongoDB (queued, being written or spilled) are kept in an exact set
+    until written() or failed(), so a tweet that could not be written is not dropped when it comes again.
+    """
+
+    def __init__(self, capacity=10000000, error_rate=0.0001):
+        self.filter = BloomFilter(capacity, error_rate)
+        self.pending = set() # ids of tweets checked but not written yet
+        self.lock = threading.Lock()
+        self.checked = 0
+        self.dropped = 0
+
+    def is_duplicate(self, tweet):
+        tweet_id = tweet.get("id")
+        if tweet_id is None:
+            return False
+        with self.lock:
+            self.checked += 1
+            if tweet_id in self.pending or tweet_id in self.filter:
+                self.dropped += 1
+                return True
+            self.pending.add(tweet_id)
+            return False
+
+    def written(self, tweets):
+        """
+        Marks tweets as seen once MongoDB has them (inserted or refused as duplicates)
+        """
+        with self.lock:
+            for tweet in tweets:
+                tweet_id = tweet.get("id")
+                if tweet_id is not None:
+                    self.pending.discard(tweet_id)
+                    self.filter.add(tweet_id)
+
+    def failed(self, tweets):
+        """
+        Forgets tweets that could not be written, so they are accepted again
+        """
+        with self.lock:
+            for tweet in tweets:
+                self.pending.discard(tweet.get("id"))
+
+    def stats(self):
+        """
+        return dictionary of tweets checked, dropped as duplicates, and the estimated
+        false positive rate and number of new tweets wrongly dropped
+        """
+        with self.lock:
+            rate = self.filter.false_positive_rate()
+            return {"checked": self.checked, "dropped": self.dropped, "false_positive_rate": rate,
+                    "expected_false_positives": rate * (self.checked - self.dropped)}
+
+
+def _insert_batch(collection, batch):
+    # unordered insert, return number of documents inserted, duplicates, other errors,
+    # and the positions in batch of the documents refused for other errors
+    try:
+        result = collection.insert_many(batch, ordered=False)
+        return len(result.inserted_ids), 0, 0, []
+    except BulkWriteError as e:
+        # unordered: every document without an error is still inserted
+        failed = [error["index"] for error in e.details["writeErrors"] if error["code"] != DUPLICATE_KEY]
+        duplicates = len(e.details["writeErrors"]) - len(failed)
+        return e.details["nInserted"], duplicates, len(failed), failed
+
+
+class BatchInserter:
+    """
+    BatchInserter inserts documents in unordered batches with a few writer threads.
+    At most 2 batches per writer are waiting at any time, adding blocks until one is written.
+    Duplicate keys are counted instead of stopping the load.
+    """
+
+    def __init__(self, collection, batch_size=1000, writers=4, report_every=100000, verbose=True):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.report_every = report_every
+        self.verbose = verbose
+        self.executor = ThreadPoolExecutor(max_workers=writers)
+        self.slots = threading.BoundedSemaphore(2 * writers) # bounded number of batches in memory
+        self.lock = threading.Lock()
+        self.futures = []
+        self.batch = []
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.start = time.time()
+
+    def add(self, document):
+        self.batch.append(document)
+        self.read += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        if self.verbose and self.read % self.report_every == 0:
+            print("Read {} documents, {} inserted, {} duplicates ({:.0f} documents/s)".format(
+                self.read, self.inserted, self.duplicates, self.throughput()))
+
+    def flush(self):
+        if not self.batch:
+            return
+        self.slots.acquire()
+        batch, self.batch = self.batch, []
+        future = self.executor.submit(self._insert, batch)
+        future.add_done_callback(lambda f: self.slots.release())
+        pending = [future]
+        for f in self.futures:
+            if f.done():
+                f.result() # raise errors other than write errors (e.g. lost connection)
+            else:
+                pending.append(f)
+        self.futures = pending
+
+    def _insert(self, batch):
+        inserted, duplicates, errors, _ = _insert_batch(self.collection, batch)
+        with self.lock:
+            self.inserted += inserted
+            self.duplicates += duplicates
+            self.errors += errors
+
+    def throughput(self):
+        elapsed = time.time() - self.start
+        return self.inserted/elapsed if elapsed else 0
+
+    def close(self):
+        """
+        Writes the last batch and waits for every writer
+        return number of documents inserted, duplicates, other errors
+        """
+        self.flush()
+        for future in self.futures:
+            future.result()
+        self.executor.shutdown()
+        return self.inserted, self.duplicates, self.errors
+
+
+class BufferedWriter:
+    """
+    BufferedWriter is the write stage of the crawlers: put() only queues the tweet and returns,
+    a background thread writes the queue with unordered insert_many once batch_size tweets
+    are waiting or flush_interval seconds after the first one.
+    When the queue is full put() waits up to block_timeout seconds (backpressure),
+    then appends the tweet to spill_path or drops it if there is no spill file.
+    A batch that cannot be written (e.g. lost connection) is tried again retries times, waiting
+    retry_delay seconds and twice as long each time, then spilled the same way.
+    Spilled tweets are written back after the next batch that could be written, at close(),
+    and when the writer starts (tweets left in spill_path by a run that was stopped):
+    the spill file is moved to spill_path + ".replay" and read from there, tweets that fail again
+    go to a new spill file. A replay file left by a run stopped while reading it is read again
+    (the tweets it had already written are refused by the unique index, see ensure_unique_ids()).
+    With dedup, tweets already put are dropped before they are queued,
+    they are marked as seen once written (a tweet that was dropped or not written is accepted again).
+    put() after close() raises ValueError.
+    """
+
+    def __init__(self, collection, batch_size=500, flush_interval=1.0, maxsize=20000, block_timeout=0.1, spill_path=None, dedup=None,
+                 retries=3, retry_delay=0.5):
+        self.collection = collection
+        self.dedup = dedup # TweetDeduplicator dropping repeated tweets before they are queued, told what was written
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.spill_file = None
+        self.spill_waiting = spill_path is not None and (os.path.exists(spill_path) or os.path.exists(spill_path + ".replay"))
+        self.closed = False
+        # counters
+        self.written = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.retried = 0 # failed writes tried again
+        self.flushes = 0
+        self.flush_time = 0 # total seconds spent in insert_many
+        self.max_flush_time = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, document):
+        if self.closed:
+            raise ValueError("put() on a closed BufferedWriter")
+        if self.dedup is not None and self.dedup.is_duplicate(document):
+            return False
+        try:
+            self.queue.put(document, timeout=self.block_timeout)
+            return True
+        except queue.Full:
+            pass
+        return self._spill([document], put=True)
+
+    def _spill(self, documents, put=False):
+        # append to the spill file (written back later), or count as dropped without one
+        with self.lock:
+            if put and self.closed: # close() may have read the spill file already
+                raise ValueError("put() on a closed BufferedWriter")
+            if self.spill_path is None:
+                self.dropped += len(documents)
+                if self.dedup is not None:
+                    self.dedup.failed(documents)
+                return False
+            if self.spill_file is None:
+                self.spill_file = open(self.spill_path, "a")
+            for document in documents:
+                self.spill_file.write(json_util.dumps(document) + "\n")
+            self.spill_file.flush() # on disk if the crawler is stopped
+            self.spilled += len(documents)
+            self.spill_waiting = True
+        return True
+
+    def _write_spilled(self):
+        """
+        Writes back the tweets spilled so far (those that fail again are spilled to a new file)
+        """
+        replay = self.spill_path + ".replay"
+        with self.lock:
+            self.spill_waiting = False
+            if self.spill_file is not None:
+                self.spill_file.close()
+                self.spill_file = None
+            if os.path.exists(self.spill_path):
+                if os.path.exists(replay): # left by a stopped run: read both
+                    with open(replay, "a") as out, open(self.spill_path) as f:
+                        shutil.copyfileobj(f, out)
+                    os.remove(self.spill_path)
+                else:
+                    os.replace(self.spill_path, replay)
+        if not os.path.exists(replay):
+            return
+        with open(replay) as f:
+            batch = []
+            for document in iter_json(f):
+                batch.append(document)
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+            if batch:
+                self._flush(batch)
+        os.remove(replay)
+
+    def _run(self):
+        if self.spill_waiting: # tweets left on disk by an earlier run
+            self._write_spilled()
+        stop = False
+        while not stop:
+            batch = [self.queue.get()] # wait for the first tweet of the batch
+            if batch[0] is _STOP:
+                break
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    document = self.queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if document is _STOP:
+                    stop = True
+                    break
+                batch.append(document)
+            if self._flush(batch) and self.spill_waiting: # MongoDB is back: try the spilled tweets again
+                self._write_spilled()
+
+    def _flush(self, batch):
+        """
+        Writes a batch, trying again on errors (e.g. lost connection), spilled if it still cannot be written
+        return True if the batch was written
+        """
+        start = time.time()
+        for attempt in range(self.retries + 1):
+            try:
+                inserted, duplicates, errors, failed = _insert_batch(self.collection, batch)
+                break
+            except Exception as e: # the writer keeps going with the next batches
+                for document in batch:
+                    document.pop("_id", None) # set by insert_many, a new one is made when written
+                if attempt == self.retries:
+                    print("Could not write {} tweets: {}".format(len(batch), e))
+                    inserted, duplicates, errors = None, 0, 0
+                else:
+                    with self.lock:
+                        self.retried += 1
+                    time.sleep(self.retry_delay * 2**attempt)
+        elapsed = time.time() - start
+        with self.lock:
+            self.flushes += 1
+            self.flush_time += elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+        if inserted is None:
+            self._spill(batch) # counted as dropped without a spill file
+            return False
+        with self.lock:
+            self.written += inserted
+            self.duplicates += duplicates
+            self.errors += errors
+        if self.dedup is not None: # refused documents (not duplicates) are not stored: accepted again
+            failed = set(failed)
+            self.dedup.written([document for i, document in enumerate(batch) if i not in failed])
+            self.dedup.failed([batch[i] for i in failed])
+        return True
+
+    def stats(self):
+        """
+        return dictionary of counters: queue depth, tweets written, duplicates, errors, dropped, spilled,
+        writes tried again, number of flushes and their mean/max latency in seconds
+        (and the deduplication counters with dedup)
+        """
+        with self.lock:
+            stats = {"queue_depth": self.queue.qsize(), "written": self.written, "duplicates": self.duplicates,
+                     "errors": self.errors, "dropped": self.dropped, "spilled": self.spilled, "retried": self.retried,
+                     "flushes": self.flushes,
+                     "mean_flush_latency": self.flush_time/self.flushes if self.flushes else 0,
+                     "max_flush_latency": self.max_flush_time}
+        if self.dedup is not None:
+            dedup = self.dedup.stats()
+            stats["filtered"] = dedup["dropped"] # duplicates dropped in memory, "duplicates" are the ones MongoDB refused
+            stats["false_positive_rate"] = dedup["false_positive_rate"]
+            stats["expected_false_positives"] = dedup["expected_false_positives"]
+        return stats
+
+    def close(self):
+        """
+        Writes everything still queued, then the tweets spilled to disk
+        (those that still cannot be written stay in the spill file, written by the next run)
+        return counters, as stats()
+        """
+        with self.lock:
+            self.closed = True
+        self.queue.put(_STOP) # after every queued tweet
+        self.thread.join()
+        late = [] # put() calls that passed the closed check as close() started
+        while not self.queue.empty():
+            late.append(self.queue.get_nowait())
+        if late:
+            self._spill(late)
+        if self.spill_waiting:
+            self._write_spilled()
+        with self.lock:
+            if self.spill_file is not None:
+                self.spill_file.close()
+                self.spill_file = None
+        return self.stats()
+
+
+class TweetListener:
+    """
+    TweetListener is what the crawlers do with every tweet the stream delivers:
+    created_at converted and the tweet put in the writer.
+    The crawlers mix it with tweepy.StreamListener, replay_stream.py calls on_status() directly.
+    """
+
+    def __init__(self, writer):
+        """
+        :writer -> BufferedWriter (or anything with put(tweet))
+        """
+        self.writer = writer
+        self.count = 0 # tweets received, duplicates included
+        self.lock = threading.Lock() # the stream and the REST probes add tweets from different threads
+
+    def add_to_database(self, json_tweet):
+        """
+        return True if the tweet was queued (or spilled), False if it was dropped
+        """
+        convert_created_at(json_tweet)
+        with self.lock:
+            self.count += 1
+        return self.writer.put(json_tweet) # queued, does not wait for MongoDB
+
+    def on_tweet(self, json_tweet):
+        return self.add_to_database(json_tweet)
+
+    def on_status(self, status):
+        self.on_tweet(status._json)
+        return True
+
+    def on_error(self, status_code):
+        if status_code == 420:
+            #returning False in on_error disconnects the stream
+            return False
+
+
+class FrontierListener(TweetListener):
+    """
+    FrontierListener is the listener of the hybrid crawler: tweets are written as by TweetListener,
+    and their user and hashtags are added to the crawl frontiers
+    """
+
+    def __init__(self, writer, users, hashtags):
+        """
+        :users, hashtags -> CrawlFrontier of the users and hashtags to crawl
+        """
+        super().__init__(writer)
+        self.users = users
+        self.hashtags = hashtags
+
+    def on_tweet(self, json_tweet):
+        queued = self.add_to_database(json_tweet)
+        self.parse_for_entities(json_tweet)
+        return queued
+
+    def parse_for_entities(self, json_tweet):
+        user = json_tweet['user']['id']
+        self.users.put(user, 1 + math.log10(1 + json_tweet['user']['followers_count'])) # seen often, many followers -> crawled first
+        for hashtag in json_tweet['entities']['hashtags']:
+            # add hashtag to list if not crawled yet, used more often -> crawled first
+            self.hashtags.put(hashtag['text'].lower())
@@ -1,8 +1,65 @@
 import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from array import array
 import itertools
 
 from helpers import get_body
 
+def tally_user_interaction(tweet, nm, rm, qm):
+    """
+    Function to tally up user interactions for a single tweet
+    :tweet -> JSON Tweet
+    :nm, rm, qm -> normal, retweet, quote/reply mention dictionaries updated in place
+    """
+    tweeter = tweet["user"]["screen_name"]
+
+    # RETWEETS
+    if tweet.get("retweeted_status"):
+        rt_user = tweet["retweeted_status"]["user"]["screen_name"]
+        if not rm.get(tweeter): # we haven't seen this user yet, add this mention as his first
+            rm[tweeter] = {rt_user: 1}
+        else: # we have seen this user
+            if not rm[tweeter].get(rt_user): # but not the user he has retweeted
+                rm[tweeter][rt_user] = 1
+            else: # this user has already retweeted from this person, increment tally
+                rm[tweeter][rt_user] += 1
+
+    # QUOTES
+    if tweet.get("quoted_status"):
+        q_user = tweet["quoted_status"]["user"]["screen_name"]
+        if not qm.get(tweeter): # we haven't seen this user yet, add this mention as his first
+            qm[tweeter] = {q_user: 1}
+        else: # we have seen this user
+            if not qm[tweeter].get(q_user):  # but not the user he has quoted
+                qm[tweeter][q_user] = 1
+            else: # this user has already quoted this person, increment tally
+                qm[tweeter][q_user] += 1
+
+    # REPLIES: same thinking as quotes
+    r_user = tweet.get("in_reply_to_screen_name", None)
+    if r_user is not None:
+        if not qm.get(tweeter):
+            qm[tweeter] = {r_user: 1}
+        else:
+            if not qm[tweeter].get(r_user):
+                qm[tweeter][r_user] = 1
+            else:
+                qm[tweeter][r_user] += 1
+
+    # NORMAL: same thinking as above, but go through all the users mentioned in the tweets
+    body = get_body(tweet)
+    if body['entities'].get("user_mentions"):
+        if not nm.get(tweeter):
+            nm[tweeter] = {}
+        for friend in body["entities"]["user_mentions"]:
+            friend = friend["screen_name"]
+            if not nm[tweeter].get(friend):
+                nm[tweeter][friend] = 1
+            else:
+                nm[tweeter][friend] += 1
+
 def user_interaction(collection, condition={"$exists": True}):
     """
     Function to tally up user interactions in general tweets, retweets, and quote/replies
@@ -13,83 +70,157 @@ def user_interaction(collection, condition={"$exists": True}):
     qm = {} # quote and reply mentions
 
     for tweet in collection.find({"sentiment": condition}):
-        tweeter = tweet["user"]["screen_name"]
-
-        # RETWEETS
-        if tweet.get("retweeted_status"):
-            rt_user = tweet["retweeted_status"]["user"]["screen_name"]
-            if not rm.get(tweeter): # we haven't seen this user yet, add this mention as his first
-                rm[tweeter] = {rt_user: 1}
-            else: # we have seen this user
-                if not rm[tweeter].get(rt_user): # but not the user he has retweeted
-                    rm[tweeter][rt_user] = 1
-                else: # this user has already retweeted from this person, increment tally
-                    rm[tweeter][rt_user] += 1
-
-        # QUOTES
-        if tweet.get("quoted_status"):
-            q_user = tweet["quoted_status"]["user"]["screen_name"]
-            if not qm.get(tweeter): # we haven't seen this user yet, add this mention as his first
-                qm[tweeter] = {q_user: 1}
-            else: # we have seen this user
-                if not qm[tweeter].get(q_user):  # but not the user he has quoted
-                    qm[tweeter][q_user] = 1
-                else: # this user has already quoted this person, increment tally
-                    qm[tweeter][q_user] += 1
-
-        # REPLIES: same thinking as quotes
-        r_user = tweet.get("in_reply_to_screen_name", None)
-        if r_user is not None:
-            if not qm.get(tweeter):
-                qm[tweeter] = {r_user: 1}
-            else:
-                if not qm[tweeter].get(r_user):
-                    qm[tweeter][r_user] = 1
-                else:
-                    qm[tweeter][r_user] += 1
-
-        # NORMAL: same thinking as above, but go through all the users mentioned in the tweets
-        body = get_body(tweet)
-        if body['entities'].get("user_mentions"):
-            if not nm.get(tweeter):
-                nm[tweeter] = {}
-            for friend in body["entities"]["user_mentions"]:
-                friend = friend["screen_name"]
-                if not nm[tweeter].get(friend):
-                    nm[tweeter][friend] = 1
-                else:
-                    nm[tweeter][friend] += 1
+        tally_user_interaction(tweet, nm, rm, qm)
 
     return nm, rm, qm
 
 
+class HashtagCooccurrence:
+    """
+    HashtagCooccurrence tallies up how often each combination of hashtags is used together.
+    Combinations are keyed by their sorted tuple of (lowercase) hashtags, so adding is a hash lookup.
+    Iterating gives each combination once as a sorted list, in order of first use.
+    """
+
+    def __init__(self):
+        self.sets = {} # sorted hashtag tuple -> number of tweets using exactly this combination
+
+    def add(self, tags, count=1):
+        key = tuple(sorted(tags)) # order of hashtags does not matter
+        self.sets[key] = self.sets.get(key, 0) + count
+
+    def pairs(self):
+        """
+        Number of tweets in which each pair of (different) hashtags co-occurs
+        return dictionary of (h1, h2) -> count with h1 < h2
+        """
+        pair_counts = {}
+        for tags, count in self.sets.items():
+            for pair in itertools.combinations(sorted(set(tags)), 2):
+                pair_counts[pair] = pair_counts.get(pair, 0) + count
+        return pair_counts
+
+    def __iter__(self):
+        for tags in self.sets:
+            yield list(tags)
+
+    def __len__(self):
+        return len(self.sets)
+
+
+def tally_hashtags(tweet, hashtags):
+    """
+    Function to add the hashtag combination of a single tweet to the co-occurence tally
+    :tweet -> JSON Tweet
+    :hashtags -> HashtagCooccurrence updated in place
+    """
+    tweet = get_body(tweet)
+    if tweet["entities"].get("hashtags"):
+        hashtags.add(h["text"].lower() for h in tweet["entities"]["hashtags"]) # capitalisation of hashtags does not matter
+
 def hashtag_interaction(collection, condition={"$exists": True}):
     """
     Function to tally up hashtag co-occurence information ("interaction")
     :collection -> MongoDB collection
+    return HashtagCooccurrence
     """
-    hashtags = []
+    hashtags = HashtagCooccurrence()
 
     for tweet in collection.find({"sentiment": condition}):
-        tweet = get_body(tweet)
-        if tweet["entities"].get("hashtags"):
-            current = []
-            for h in tweet["entities"]["hashtags"]:
-                current.append(h["text"].lower()) # capitalisation of hashtags does not matter
-            current = sorted(current) # order of hashtags does not matter
-            if current not in hashtags: # we don't need repetition of hashtags (this could be changed for tallying up which hashtags are used together)
-                hashtags.append(current)
+        tally_hashtags(tweet, hashtags)
 
     return hashtags
 
-def build_interaction_graph(s):
+class CompactGraph:
+    """
+    CompactGraph is a lighter alternative to networkx graphs for large networks.
+    Nodes are interned to integer ids, edges are kept in arrays and turned into
+    a CSR adjacency matrix when needed. to_networkx() builds the networkx graph
+    (e.g. for nx.write_gexf) the first time it is asked for.
+    """
+
+    def __init__(self, directed=False):
+        self.directed = directed
+        self.ids = {} # node -> integer id
+        self.nodes = [] # integer id -> node
+        self.src = array('q')
+        self.dst = array('q')
+        self.weights = array('q')
+        self._csr = None
+        self._nx = None
+
+    def node_id(self, node):
+        i = self.ids.get(node)
+        if i is None:
+            i = len(self.nodes)
+            self.ids[node] = i
+            self.nodes.append(node)
+        return i
+
+    def add_edge(self, u, v, weight=1):
+        """
+        Edges are expected to be unique (and unordered pairs only added once if undirected)
+        """
+        self.src.append(self.node_id(u))
+        self.dst.append(self.node_id(v))
+        self.weights.append(weight)
+        self._csr = None
+        self._nx = None
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.src)
+
+    def adjacency(self):
+        """
+        Weighted adjacency matrix in CSR format (one entry per edge, row -> column)
+        """
+        if self._csr is None:
+            n = len(self.nodes)
+            self._csr = csr_matrix((np.frombuffer(self.weights, dtype=np.int64),
+                                    (np.frombuffer(self.src, dtype=np.int64), np.frombuffer(self.dst, dtype=np.int64))),
+                                   shape=(n, n))
+        return self._csr
+
+    def number_connected_components(self):
+        # direction is ignored, like nx.number_connected_components(G.to_undirected())
+        ncc, labels = connected_components(self.adjacency(), directed=self.directed, connection='weak')
+        return ncc
+
+    def to_networkx(self):
+        if self._nx is None:
+            G = nx.DiGraph() if self.directed else nx.Graph()
+            G.add_nodes_from(self.nodes)
+            G.add_weighted_edges_from((self.nodes[u], self.nodes[v], w) for u, v, w in zip(self.src, self.dst, self.weights))
+            self._nx = G
+        return self._nx
+
+
+def build_interaction_graph(s, compact=False):
+    """
+    Function to build a networkx graph
+    :s -> user dictionary from user_interaction(), HashtagCooccurrence from hashtag_interaction() or lists of hashtags
+    :compact -> build a CompactGraph instead of a networkx graph
+    """
+    if compact:
+        return _build_compact_graph(s)
+
     if type(s) is dict: # user network, we have direction information
         G = nx.DiGraph()
         for user, friends in s.items():
             for f, m in friends.items():
                 G.add_edge(user, f, weight=m)
 
-    else: # hashtag network
+    elif isinstance(s, HashtagCooccurrence): # hashtag network, weighted by number of co-occurences
+        G = nx.Graph()
+        for ht_list in s:
+            G.add_nodes_from(ht_list)
+        for (h1, h2), count in s.pairs().items():
+            G.add_edge(h1, h2, weight=count)
+
+    else: # hashtag network from lists of hashtags
         G = nx.Graph()
         for ht_list in s:
             for h1 in ht_list:
@@ -100,54 +231,120 @@ def build_interaction_graph(s):
 
     return G
 
+def _build_compact_graph(s):
+    if type(s) is dict: # user network, we have direction information
+        G = CompactGraph(directed=True)
+        for user, friends in s.items():
+            for f, m in friends.items():
+                G.add_edge(user, f, m)
+
+    else: # hashtag network, each pair of hashtags used together is one edge
+        if not isinstance(s, HashtagCooccurrence):
+            cooccurrence = HashtagCooccurrence()
+            for ht_list in s:
+                cooccurrence.add(ht_list)
+            s = cooccurrence
+        G = CompactGraph()
+        for ht_list in s:
+            for h in ht_list:
+                G.node_id(h)
+        for (h1, h2), count in s.pairs().items():
+            G.add_edge(h1, h2, count)
+
+    return G
+
 def get_network_information(G):
     """
     Function to get basic network information
-    :G -> graph built with networkx
+    :G -> graph built with networkx or CompactGraph
     return nodes, edges, subgraph #, number of nodes per subgraph
     """
 
     nodes = G.number_of_nodes()
     edges = G.number_of_edges()
-    Gu = G.to_undirected()
-    ncc = nx.number_connected_components(Gu) # number of subgraphs
+    if isinstance(G, CompactGraph):
+        ncc = G.number_connected_components() # no undirected copy needed
+    else:
+        Gu = G.to_undirected()
+        ncc = nx.number_connected_components(Gu) # number of subgraphs
     return nodes, edges, ncc, nodes//ncc
 
 def hashtag_network_statistics(hashtags):
     """
     Function to get ties/triads information from a hashtag network
-    :hashtag -> nested lists of hashtags obtained with hashtag_interaction()
+    :hashtag -> HashtagCooccurrence obtained with hashtag_interaction() or nested lists of hashtags
     """
     ties = 0
-    visited = []
+    visited = set()
     triads = 0
+    # inverted index: hashtag -> sum of (size - 1) over the visited lists containing it
+    # so linking a new list to the lists seen before is a lookup per hashtag
+    index = {}
     for tag_list in hashtags:
         # single used hashtags aren't used in conjuction with others
         if len(tag_list) > 1:
+            key = tuple(tag_list)
             # we don't want to count duplicates ties or triads
-            if tag_list not in visited:
-                if len(tag_list) > 1:
-                    if len(tag_list) >= 2:
-                        # get all (non-ordered, non-repetitive) combinations of 2 (a tie) from the list
-                        ties += sum(1 for ignore in itertools.combinations(tag_list, 2))
-                    if len(tag_list) > 2:
-                        # get all (non-ordered, non-repetitive) combinations of 3 (a triad) from the list
-                        triads += sum(1 for ignore in itertools.combinations(tag_list, 3))
-                for h in tag_list: # compare each hashtag to other hashtags in its list
-                    for other in tag_list:
-                        if h != other:
-                            for visited_list in visited: # if the other hashtag has been mentioned in another list
-                                if other in visited_list:
-                                    triads += len(visited_list)-1 # create the appropriate number of triads (A-B-X for X in B's hashtag list)
-                visited.append(tag_list)
+            if key not in visited:
+                n = len(tag_list)
+                # all (non-ordered, non-repetitive) combinations of 2 (a tie) and 3 (a triad) from the list
+                ties += n*(n-1)//2
+                triads += n*(n-1)*(n-2)//6
+                multiplicity = {}
+                for h in tag_list:
+                    multiplicity[h] = multiplicity.get(h, 0) + 1
+                for other, m in multiplicity.items(): # compare each hashtag to other hashtags in its list
+                    # if the other hashtag has been mentioned in another list create the appropriate
+                    # number of triads (A-B-X for X in B's hashtag list), once per different hashtag A
+                    triads += m * (n-m) * index.get(other, 0)
+                for h in multiplicity:
+                    index[h] = index.get(h, 0) + n-1
+                visited.add(key)
 
     return triads, ties
 
-def user_network_statistics(users):
+def _user_network_statistics_sparse(users):
+    """
+    Same output as user_network_statistics() computed on a sparse adjacency matrix
+    :users -> dictionary of user connections obtained with user_interaction()
+    """
+    # users with connections get the first ids, in dictionary order, so that
+    # "the pair was seen first from user A" becomes "A has the smaller id"
+    ids = {user: i for i, user in enumerate(users)}
+    rows = []
+    cols = []
+    for user, friends in users.items():
+        for friend in friends:
+            if friend not in ids:
+                ids[friend] = len(ids)
+            rows.append(ids[user])
+            cols.append(ids[friend])
+
+    n = len(ids)
+    A = csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(n, n))
+    out_degree = np.asarray(A.sum(axis=1)).ravel()
+
+    links = A.nnz # a link for all the users each user has mentioned
+    triads = int((out_degree * (out_degree-1) // 2).sum()) # user A: B, C -> one triad per combination of 2 friends
+
+    # both users have mentioned each other: A∘Aᵀ, each pair counted once from the user seen first
+    reciprocal = A.multiply(A.T).tocoo()
+    first = reciprocal.row <= reciprocal.col
+    loops = int(first.sum())
+    transitive = int(out_degree[reciprocal.col[first]].sum()) # B is the transitive link for A with his mentions
+    triads += transitive # A-B-X for X in B's mentions
+
+    return triads, loops, links, transitive
+
+def user_network_statistics(users, sparse=False):
     """
     Function to get ties/loops/triads/transitive information from a directed user network
     :users -> dictionary of user connections obtained with user_interaction()
+    :sparse -> compute on a sparse adjacency matrix (much faster on large networks)
     """
+    if sparse:
+        return _user_network_statistics_sparse(users)
+
 
     loops = 0
     triads = 0
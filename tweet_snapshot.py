@@ -0,0 +1,345 @@
+import numpy as np
+
+from array import array
+from datetime import datetime, timezone
+from functools import lru_cache
+import json
+import os
+
+from helpers import parse_tweet, get_body, feature_cache
+
+# file for columnar snapshots of a tweet collection
+# a snapshot is a directory of .npy arrays, memory-mapped when read back:
+# - one value per tweet for ids, timestamps, sentiment, flags and users
+# - interned string tables (one UTF-8 blob + offsets) for users, hashtags, tokens and texts
+# - offset arrays for the variable-length lists (mentions, hashtags, tokens) of every tweet
+# TweetSnapshot.find() rebuilds the fields the analysis functions read,
+# so a snapshot can be passed wherever a MongoDB collection is expected
+
+SNAPSHOT_VERSION = 1
+
+NO_SENTIMENT = -128 # sentiment of tweets not scored yet
+MISSING = -1 # missing id, timestamp or string
+
+# flags
+HAS_RETWEETED_STATUS = 1 # "retweeted_status" exists (number_of)
+RETWEET = 2 # "retweeted_status" is set (entities, networks)
+QUOTED = 4 # "quoted_status" is set
+QUOTE_STATUS = 8 # is_quote_status is True
+NOT_QUOTE_STATUS = 16 # is_quote_status is False
+REPLY = 32 # in_reply_to_status_id is not None
+
+# per-tweet columns: name -> dtype
+COLUMNS = {
+    "id": np.int64,
+    "created_at": np.int64, # seconds since epoch (UTC)
+    "sentiment": np.int8,
+    "flags": np.uint8,
+    "user": np.int32, # row of the users table
+    "rt_user": np.int32, # retweeted user
+    "rt_id": np.int64, # id of the retweeted status
+    "rt_count": np.int64, # retweet_count of the retweeted status
+    "quoted_user": np.int32,
+    "reply_user": np.int32, # in_reply_to_screen_name
+    "text": np.int32, # row of the texts table (text given by helpers.parse_tweet)
+    "chars": np.int32, # length of the text
+}
+
+# per-tweet lists: name -> string table of the values
+LISTS = {
+    "mentions": "users", # mentions tally_entities() reads: (extended) tweet
+    "body_mentions": "users", # mentions of helpers.get_body(), used by the user networks
+    "hashtags": "hashtags", # hashtags tally_entities() reads
+    "body_hashtags": "hashtags", # hashtags of helpers.get_body(), used by the hashtag network
+    "tokens": "tokens", # helpers.tokenize(text).split(" ")
+}
+
+TABLES = ["users", "hashtags", "tokens", "texts"]
+
+
+class StringTable:
+    """
+    StringTable interns strings: every distinct string is stored once and referred to by its row.
+    Saved as the UTF-8 bytes of all strings one after the other and the offset of each string.
+    """
+
+    def __init__(self):
+        self.rows = {}
+
+    def intern(self, string):
+        if string is None:
+            return MISSING
+        row = self.rows.get(string)
+        if row is None:
+            row = len(self.rows)
+            self.rows[string] = row
+        return row
+
+    def save(self, path, name):
+        encoded = [s.encode("utf-8") for s in self.rows] # dictionaries keep insertion order, i.e. row order
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        np.save(os.path.join(path, name + ".string_offsets.npy"), offsets)
+        np.save(os.path.join(path, name + ".strings.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+
+class _StringTableReader:
+    """
+    Strings of a saved StringTable, decoded from the memory-mapped blob when a row is read
+    (the most recently read ones are kept decoded)
+    """
+
+    def __init__(self, blob, offsets, cache_size=65536):
+        self.blob = blob
+        self.offsets = offsets
+        self._decode_cached = lru_cache(maxsize=cache_size)(self._decode)
+
+    def _decode(self, row):
+        return self.blob[self.offsets[row]:self.offsets[row+1]].tobytes().decode("utf-8")
+
+    def __getitem__(self, row):
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        return self._decode_cached(row)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class _ListColumn:
+    # values of every tweet one after the other, offsets[i]:offsets[i+1] are the values of tweet i
+
+    def __init__(self):
+        self.values = array('i')
+        self.offsets = array('q', [0])
+
+    def append(self, rows):
+        self.values.extend(rows)
+        self.offsets.append(len(self.values))
+
+    def save(self, path, name):
+        np.save(os.path.join(path, name + ".offsets.npy"), np.frombuffer(self.offsets, dtype=np.int64))
+        np.save(os.path.join(path, name + ".values.npy"), np.frombuffer(self.values, dtype=np.int32))
+
+
+def _timestamp(created_at):
+    # crawlers store datetimes (naive UTC), raw tweets have Twitter's date string
+    if created_at is None:
+        return MISSING
+    if isinstance(created_at, str):
+        created_at = datetime.strptime(created_at, '%a %b %d %H:%M:%S +0000 %Y')
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return int(created_at.timestamp())
+
+
+def _flags(tweet):
+    flags = 0
+    if "retweeted_status" in tweet:
+        flags |= HAS_RETWEETED_STATUS
+    if tweet.get("retweeted_status"):
+        flags |= RETWEET
+    if tweet.get("quoted_status"):
+        flags |= QUOTED
+    if tweet.get("is_quote_status") is True:
+        flags |= QUOTE_STATUS
+    elif tweet.get("is_quote_status") is False:
+        flags |= NOT_QUOTE_STATUS
+    if tweet.get("in_reply_to_status_id") is not None:
+        flags |= REPLY
+    return flags
+
+
+def export_snapshot(collection, path, query={}, verbose=True):
+    """
+    Writes a columnar snapshot of a collection, reading it once
+    :collection -> MongoDB collection reference
+    :path -> directory to write the snapshot to (created if needed)
+    :query -> filter of the tweets to export
+    return number of tweets exported
+    """
+    os.makedirs(path, exist_ok=True)
+    columns = {name: array(np.dtype(dtype).char) for name, dtype in COLUMNS.items()}
+    lists = {name: _ListColumn() for name in LISTS}
+    tables = {name: StringTable() for name in TABLES}
+    users, hashtags = tables["users"], tables["hashtags"]
+
+    count = 0
+    for tweet in collection.find(query):
+        text = parse_tweet(tweet)
+        tokens = feature_cache.tokens(tweet).split(" ")
+        retweeted = tweet.get("retweeted_status")
+        entities = tweet["extended_tweet"] if tweet.get("truncated") else tweet # same paths as tally_entities()
+        body = get_body(tweet)
+
+        row = {
+            "id": tweet.get("id", MISSING),
+            "created_at": _timestamp(tweet.get("created_at")),
+            "sentiment": tweet.get("sentiment", NO_SENTIMENT),
+            "flags": _flags(tweet),
+            "user": users.intern(tweet["user"]["screen_name"]),
+            "rt_user": users.intern(retweeted["user"]["screen_name"]) if retweeted else MISSING,
+            "rt_id": retweeted.get("id", MISSING) if retweeted else MISSING,
+            "rt_count": retweeted["retweet_count"] if retweeted else 0,
+            "quoted_user": users.intern(tweet["quoted_status"]["user"]["screen_name"]) if tweet.get("quoted_status") else MISSING,
+            "reply_user": users.intern(tweet.get("in_reply_to_screen_name")),
+            "text": tables["texts"].intern(text), # retweets share the text of their original
+            "chars": len(text),
+        }
+        for name, value in row.items():
+            columns[name].append(value)
+
+        lists["mentions"].append(users.intern(u["screen_name"]) for u in entities["entities"].get("user_mentions") or [])
+        lists["body_mentions"].append(users.intern(u["screen_name"]) for u in body["entities"].get("user_mentions") or [])
+        lists["hashtags"].append(hashtags.intern(h["text"]) for h in get_body(entities)["entities"].get("hashtags") or [])
+        lists["body_hashtags"].append(hashtags.intern(h["text"]) for h in body["entities"].get("hashtags") or [])
+        lists["tokens"].append(tables["tokens"].intern(t) for t in tokens)
+
+        count += 1
+        if verbose and count % 100000 == 0:
+            print("Exported {} tweets".format(count))
+
+    for name, values in columns.items():
+        np.save(os.path.join(path, name + ".npy"), np.frombuffer(values, dtype=COLUMNS[name]))
+    for name, values in lists.items():
+        values.save(path, name)
+    for name, table in tables.items():
+        table.save(path, name)
+    with open(os.path.join(path, "snapshot.json"), "w") as file:
+        json.dump({"version": SNAPSHOT_VERSION, "tweets": count,
+                   "tables": {name: len(table.rows) for name, table in tables.items()}}, file)
+
+    if verbose:
+        print("Exported {} tweets to {}".format(count, path))
+    return count
+
+
+class TweetSnapshot:
+    """
+    TweetSnapshot reads a snapshot written by export_snapshot(), memory-mapped so only the pages used are loaded.
+    Its find() gives back tweets with the fields the analysis functions read, so it can replace a MongoDB collection:
+    every tweet is rebuilt from columns instead of being parsed from the database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "snapshot.json")) as file:
+            self.meta = json.load(file)
+        if self.meta["version"] != SNAPSHOT_VERSION:
+            raise ValueError("Snapshot {} has version {}, expected {}".format(path, self.meta["version"], SNAPSHOT_VERSION))
+        self.columns = {name: self._load(name + ".npy") for name in COLUMNS}
+        self.lists = {name: (self._load(name + ".offsets.npy"), self._load(name + ".values.npy")) for name in LISTS}
+        self._tables = {}
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode='r')
+
+    def __len__(self):
+        return self.meta["tweets"]
+
+    def table(self, name):
+        """
+        Strings of a table, indexed by row: each string is decoded when it is read
+        (the texts table can be larger than memory)
+        """
+        if name not in self._tables:
+            self._tables[name] = _StringTableReader(self._load(name + ".strings.npy"), self._load(name + ".string_offsets.npy"))
+        return self._tables[name]
+
+    def rows(self, condition={"$exists": True}):
+        """
+        Rows of the tweets matching a sentiment condition, as used in collection.find({"sentiment": condition})
+        :condition -> sentiment value or {"$exists": True/False}
+        """
+        sentiment = self.columns["sentiment"]
+        if isinstance(condition, dict):
+            if set(condition) != {"$exists"}:
+                raise ValueError("Unsupported sentiment condition for a snapshot: {}".format(condition))
+            mask = (sentiment != NO_SENTIMENT) == bool(condition["$exists"])
+        else:
+            mask = sentiment == condition
+        return np.flatnonzero(mask)
+
+    def find(self, query={}, projection=None):
+        """
+        Tweets matching query, rebuilt from the snapshot (projection is ignored, every field analysed is given)
+        :query -> {} or {"sentiment": condition}
+        """
+        if set(query) - {"sentiment"}:
+            raise ValueError("Unsupported query for a snapshot: {}".format(query))
+        rows = self.rows(query["sentiment"]) if "sentiment" in query else range(len(self))
+        return (self.tweet(i) for i in rows)
+
+    def _list(self, name, i):
+        offsets, values = self.lists[name]
+        table = self.table(LISTS[name])
+        return [table[v] for v in values[offsets[i]:offsets[i+1]]]
+
+    def tweet(self, i):
+        """
+        Tweet at row i with the fields read by helpers, tweet_statistics and tweet_networks.
+        Entities are already resolved, so the tweet is marked truncated with its entities in extended_tweet
+        and its body (the retweeted status, if any) is never truncated.
+        """
+        c = self.columns
+        users = self.table("users")
+        flags = int(c["flags"][i])
+        text = self.table("texts")[c["text"][i]]
+        entities = {"user_mentions": [{"screen_name": u} for u in self._list("mentions", i)],
+                    "hashtags": [{"text": h} for h in self._list("hashtags", i)]}
+
+        tweet = {"_id": int(i), "user": {"screen_name": users[c["user"][i]]},
+                 "truncated": True, "extended_tweet": {"full_text": text, "entities": entities},
+                 "in_reply_to_status_id": 1 if flags & REPLY else None}
+        if c["id"][i] != MISSING:
+            tweet["id"] = int(c["id"][i])
+        if c["sentiment"][i] != NO_SENTIMENT:
+            tweet["sentiment"] = int(c["sentiment"][i])
+        if c["created_at"][i] != MISSING:
+            tweet["created_at"] = datetime.fromtimestamp(int(c["created_at"][i]), timezone.utc).replace(tzinfo=None)
+        if flags & QUOTE_STATUS:
+            tweet["is_quote_status"] = True
+        elif flags & NOT_QUOTE_STATUS:
+            tweet["is_quote_status"] = False
+        if flags & QUOTED:
+            tweet["quoted_status"] = {"user": {"screen_name": users[c["quoted_user"][i]]}}
+        if c["reply_user"][i] != MISSING:
+            tweet["in_reply_to_screen_name"] = users[c["reply_user"][i]]
+
+        body = {"user_mentions": [{"screen_name": u} for u in self._list("body_mentions", i)],
+                "hashtags": [{"text": h} for h in self._list("body_hashtags", i)]}
+        if flags & RETWEET:
+            tweet["retweeted_status"] = {"user": {"screen_name": users[c["rt_user"][i]]},
+                                         "retweet_count": int(c["rt_count"][i]),
+                                         "truncated": False, "text": text, "entities": body}
+            if c["rt_id"][i] != MISSING:
+                tweet["retweeted_status"]["id"] = int(c["rt_id"][i])
+        elif flags & HAS_RETWEETED_STATUS:
+            tweet["retweeted_status"] = None
+
+        feature_cache.put(tweet, " ".join(self._list("tokens", i))) # tokens come with the snapshot
+        return tweet
+
+    def number_by_sentiment(self):
+        """
+        Same output as tweet_statistics.number_by_sentiment(), counted on the flag column
+        """
+        sentiment = np.asarray(self.columns["sentiment"])
+        flags = np.asarray(self.columns["flags"])
+        scored = sentiment != NO_SENTIMENT
+        numbers = {"all": (0, 0, 0, 0)}
+        for value in np.unique(sentiment[scored]):
+            f = flags[sentiment == value]
+            counts = (len(f), int(np.count_nonzero(f & HAS_RETWEETED_STATUS)), int(np.count_nonzero(f & QUOTE_STATUS)),
+                      int(np.count_nonzero(((f & REPLY) != 0) & ((f & NOT_QUOTE_STATUS) != 0))))
+            numbers[int(value)] = counts
+            numbers["all"] = tuple(a + b for a, b in zip(numbers["all"], counts))
+        return numbers
+
+    def char_count(self, condition={"$exists": True}):
+        """
+        Same output as tweet_statistics.get_char_count(), summed on the chars column
+        """
+        rows = self.rows(condition)
+        return int(np.asarray(self.columns["chars"])[rows].sum())//len(rows)
@@ -1,57 +1,232 @@
 from nltk.probability import FreqDist
 
-from helpers import tokenize, parse_tweet, get_body
+from helpers import parse_tweet, get_body, feature_cache, TEXT_PROJECTION
+from tweet_snapshot import TweetSnapshot
 
-def extract_top_entities(collection, condition={"$exists": True}):
+def tally_entities(tweet, mentions_count, retweets_count, hashtags_count, fdist, tokens=None):
+    """
+    Tallies up mentions, retweets, hashtags and concepts for a single tweet
+    :tweet -> JSON Tweet
+    :mentions_count, retweets_count, hashtags_count -> dictionaries updated in place
+    :fdist -> FreqDist of concepts updated in place
+    :tokens -> tokens of the tweet if already computed, tokenized here otherwise
+    """
+    if tokens is None:
+        tokens = feature_cache.tokens(tweet).split(" ")
+    fdist.update(tokens)
+    tweeter = tweet["user"]
+
+    # RETWEETS
+    if tweet.get("retweeted_status"):
+        rt_user = tweet["retweeted_status"]["user"]["screen_name"]
+        if not retweets_count.get(rt_user):
+            retweets_count[rt_user] = tweet["retweeted_status"]["retweet_count"] # get how many times the tweet has already been retweeted
+        else:
+            retweets_count[rt_user] += 1 # we have already seen this retweet: tally up another RT for this specific RT
+
+    if tweet.get("truncated"): # if tweet is truncated we need to look through the extended tweet for entities
+        tweet = tweet["extended_tweet"]
+
+    # USER MENTIONS
+    if tweet["entities"].get("user_mentions"):
+        for user in tweet["entities"]["user_mentions"] + [tweeter]:
+            user = user["screen_name"]
+            if not mentions_count.get(user):
+                mentions_count[user] = 1
+            else:
+                mentions_count[user] += 1
+
+    # HASHTAGS
+    tweet = get_body(tweet)
+    if tweet["entities"].get("hashtags"):
+        for h in tweet["entities"]["hashtags"]:
+            hl = h["text"].lower()
+            if not hashtags_count.get(hl):
+                hashtags_count[hl] = 1
+            else:
+                hashtags_count[hl] += 1
+
+def extract_top_entities(collection, condition={"$exists": True}, backend="python", n=10):
     """
     Extracts number of mentions, retweets, hashtags for a collection
     As well as top 50 words
     :collection -> MongoDB collection obtained with find() or JSON Tweets
+    :backend -> "python" (every tweet is counted here) or "mongo" (counted by MongoDB, see top_entities_aggregate())
+    :n -> number of mentions, retweets, hashtags returned by the "mongo" backend
     """
+    if backend == "mongo":
+        return top_entities_aggregate(collection, condition, n)
+
     mentions_count = {}
     retweets_count = {}
     hashtags_count = {}
-    corpus = []
+    fdist = FreqDist()
 
     for tweet in collection.find({"sentiment": condition}):
+        tally_entities(tweet, mentions_count, retweets_count, hashtags_count, fdist)
+
+    top_50 = fdist.most_common(50)
+
+    return mentions_count, retweets_count, hashtags_count, top_50
+
+def _truthy(field):
+    # Python truthiness of an optional field inside an aggregation expression
+    return {"$and": [{"$ifNull": [field, False]}, {"$ne": [field, {}]}, {"$ne": [field, []]}]}
+
+# entities tally_entities() reads: mentions of the (extended) tweet, hashtags of its body
+_MENTIONS = {"$cond": [_truthy("$truncated"), "$extended_tweet.entities.user_mentions", "$entities.user_mentions"]}
+_HASHTAGS = {"$cond": [_truthy("$truncated"), "$extended_tweet.entities.hashtags",
+             {"$cond": [_truthy("$retweeted_status"),
+                        {"$cond": [_truthy("$retweeted_status.truncated"),
+                                   "$retweeted_status.extended_tweet.entities.hashtags",
+                                   "$retweeted_status.entities.hashtags"]},
+                        "$entities.hashtags"]}]}
+
+# ties are ordered by first use, as in the dictionaries of tally_entities() (insertion order):
+# the tweets are sorted by _id and each entity keeps the _id and position of its first use
+_FIRST_USE = {"$sort": {"count": -1, "first": 1, "position": 1}}
+_ASCII = {"$regex": "^[\\x00-\\x7f]*$"}
+
+def _grouped(pipeline, key):
+    # pipeline gives one document per entity use: "value" (unwound with its "position") of tweets sorted by _id
+    return pipeline + [{"$group": {"_id": key, "count": {"$sum": 1},
+                                   "first": {"$first": "$_id"}, "position": {"$first": "$position"}}}]
+
+def _ranked(rows, n):
+    # rows as returned by _grouped() -> n top counts, highest first, ties by first use
+    rows = sorted(rows, key=lambda row: (-row["count"], row["first"], row["position"]))[:n]
+    return {row["_id"]: row["count"] for row in rows}
 
-        corpus += tokenize(parse_tweet(tweet)).split(" ")
-        tweeter = tweet["user"]
+def _merge_folded(rows):
+    # rows lowercased with str.lower() (as tally_entities()): counts added, first use kept
+    folded = {}
+    for row in rows:
+        key = row["_id"].lower()
+        if key not in folded:
+            folded[key] = dict(row, _id=key)
+        else:
+            merged = folded[key]
+            merged["count"] += row["count"]
+            if (row["first"], row["position"]) < (merged["first"], merged["position"]):
+                merged["first"], merged["position"] = row["first"], row["position"]
+    return list(folded.values())
 
-        # RETWEETS
-        if tweet.get("retweeted_status"):
+def _entity_uses(match, values):
+    return [match, {"$sort": {"_id": 1}}, {"$project": {"value": values}},
+            {"$unwind": {"path": "$value", "includeArrayIndex": "position"}}]
+
+def top_entities_aggregate(collection, condition={"$exists": True}, n=10):
+    """
+    Same tallies as extract_top_entities() counted by MongoDB: only the top n rows
+    (and the text fields for the top 50 words) are sent over the wire
+    Ties are ordered by first use and the first retweet of a user is the one with the lowest _id
+    (insertion order, as in a collection scan)
+    Hashtags are lowercased with $toLower, which only lowercases ASCII: the (few) hashtags with other
+    characters are sent back and lowercased here
+    :collection -> MongoDB collection reference
+    return top n mentions, top n retweets, top n hashtags (dictionaries, highest first), top 50 words
+    """
+    match = {"$match": {"sentiment": condition}}
+
+    # USER MENTIONS: every mention, plus the tweeter once, for tweets with mentions
+    mentions = _ranked(collection.aggregate(_grouped(_entity_uses(match, {
+        "$cond": [{"$gt": [{"$size": {"$ifNull": [_MENTIONS, []]}}, 0]},
+                  {"$concatArrays": [{"$map": {"input": _MENTIONS, "in": "$$this.screen_name"}}, ["$user.screen_name"]]},
+                  []]}), "$value") + [_FIRST_USE, {"$limit": n}], allowDiskUse=True), n)
+
+    # HASHTAGS: top ASCII hashtags, every other hashtag lowercased here
+    grouped = _grouped(_entity_uses(match, {"$ifNull": [_HASHTAGS, []]}), {"$toLower": "$value.text"})
+    facets = collection.aggregate(grouped + [{"$facet": {
+        "ascii": [{"$match": {"_id": _ASCII}}, _FIRST_USE, {"$limit": n}],
+        "other": [{"$match": {"_id": {"$not": _ASCII}}}],
+    }}], allowDiskUse=True)
+    facets = next(facets, {"ascii": [], "other": []})
+    folded = _merge_folded(facets["other"])
+    # a hashtag can lowercase to ASCII (e.g. the Kelvin sign): the count of that ASCII hashtag is needed too
+    top = {row["_id"] for row in facets["ascii"]}
+    missing = [row["_id"] for row in folded if row["_id"].isascii() and row["_id"] not in top]
+    rows = facets["ascii"] + facets["other"]
+    if missing:
+        rows += list(collection.aggregate(grouped + [{"$match": {"_id": {"$in": missing}}}], allowDiskUse=True))
+    hashtags = _ranked(_merge_folded(rows), n)
+
+    # RETWEETS: retweet_count of the first retweet seen, then one more per retweet
+    per_user = [
+        {"$match": {"sentiment": condition, "retweeted_status": {"$exists": True}}},
+        {"$match": {"$expr": _truthy("$retweeted_status")}},
+        {"$sort": {"_id": 1}}, # $first is only defined on sorted input
+        {"$group": {"_id": "$retweeted_status.user.screen_name", "first": {"$first": "$_id"},
+                    "first_count": {"$first": "$retweeted_status.retweet_count"}, "seen": {"$sum": 1}}},
+    ]
+    facets = collection.aggregate(per_user + [{"$facet": {
+        "top": [{"$match": {"first_count": {"$ne": 0}}},
+                {"$project": {"count": {"$add": ["$first_count", "$seen", -1]}, "first": 1, "position": {"$literal": 0}}},
+                _FIRST_USE, {"$limit": n}],
+        # a first count of 0 is replaced by the next retweet_count: replay these (rare) users in Python
+        "zero": [{"$match": {"first_count": 0}}, {"$project": {"_id": 1, "first": 1}}],
+    }}], allowDiskUse=True)
+    facets = next(facets, {"top": [], "zero": []})
+    rows = facets["top"]
+    zero = [row["_id"] for row in facets["zero"]]
+    if zero:
+        replayed = {}
+        for tweet in collection.find({"sentiment": condition, "retweeted_status.user.screen_name": {"$in": zero}},
+                                     ["retweeted_status.user.screen_name", "retweeted_status.retweet_count"], sort=[("_id", 1)]):
             rt_user = tweet["retweeted_status"]["user"]["screen_name"]
-            if not retweets_count.get(rt_user):
-                retweets_count[rt_user] = tweet["retweeted_status"]["retweet_count"] # get how many times the tweet has already been retweeted
+            if not replayed.get(rt_user):
+                replayed[rt_user] = tweet["retweeted_status"]["retweet_count"]
             else:
-                retweets_count[rt_user] += 1 # we have already seen this retweet: tally up another RT for this specific RT
-
-        if tweet.get("truncated"): # if tweet is truncated we need to look through the extended tweet for entities
-            tweet = tweet["extended_tweet"]
-
-        # USER MENTIONS
-        if tweet["entities"].get("user_mentions"):
-            for user in tweet["entities"]["user_mentions"] + [tweeter]:
-                user = user["screen_name"]
-                if not mentions_count.get(user):
-                    mentions_count[user] = 1
-                else:
-                    mentions_count[user] += 1
-
-        # HASHTAGS
-        tweet = get_body(tweet)
-        if tweet["entities"].get("hashtags"):
-            for h in tweet["entities"]["hashtags"]:
-                hl = h["text"].lower()
-                if not hashtags_count.get(hl):
-                    hashtags_count[hl] = 1
-                else:
-                    hashtags_count[hl] += 1
-
-    fdist = FreqDist(corpus)
-    top_50 = fdist.most_common(50)
+                replayed[rt_user] += 1
+        rows += [{"_id": row["_id"], "count": replayed[row["_id"]], "first": row["first"], "position": 0} for row in facets["zero"]]
+    retweets = _ranked(rows, n)
 
-    return mentions_count, retweets_count, hashtags_count, top_50
+    # CONCEPTS: tokens still need Python, but only the text fields are read
+    fdist = FreqDist()
+    for tweet in collection.find({"sentiment": condition}, TEXT_PROJECTION):
+        fdist.update(feature_cache.tokens(tweet).split(" "))
+
+    return mentions, retweets, hashtags, fdist.most_common(50)
+
+# number of tweets, retweets, quotes, replies of each group in one pass
+# (same conditions as the count_documents queries these replace)
+_NUMBER_OF_GROUP = {
+    "total": {"$sum": 1},
+    "retweets": {"$sum": {"$cond": [{"$ne": [{"$type": "$retweeted_status"}, "missing"]}, 1, 0]}},
+    "quotes": {"$sum": {"$cond": [{"$eq": ["$is_quote_status", True]}, 1, 0]}},
+    "replies": {"$sum": {"$cond": [{"$and": [{"$ne": [{"$ifNull": ["$in_reply_to_status_id", None]}, None]},
+                                             {"$eq": ["$is_quote_status", False]}]}, 1, 0]}},
+}
+
+def tally_numbers(tweet, numbers):
+    """
+    Tallies up a single tweet in the numbers of tweets, retweets, quotes, replies
+    (same conditions as _NUMBER_OF_GROUP)
+    :tweet -> JSON Tweet with a sentiment
+    :numbers -> dictionary of sentiment value (and "all") -> (total, retweets, quotes, replies), updated in place
+    """
+    counts = (1,
+              int("retweeted_status" in tweet),
+              int(tweet.get("is_quote_status") is True),
+              int(tweet.get("in_reply_to_status_id") is not None and tweet.get("is_quote_status") is False))
+    for key in ("all", tweet["sentiment"]):
+        numbers[key] = tuple(a + b for a, b in zip(numbers.get(key, (0, 0, 0, 0)), counts))
+
+def number_by_sentiment(tweets):
+    """
+    Gets number of tweets, retweets, quotes, replies for every sentiment value with a single aggregation
+    :tweets -> MongoDB collection reference or TweetSnapshot
+    return dictionary of sentiment value (and "all" for every tweet with a sentiment) -> (total, retweets, quotes, replies)
+    """
+    if isinstance(tweets, TweetSnapshot):
+        return tweets.number_by_sentiment()
+
+    group = dict(_NUMBER_OF_GROUP, _id="$sentiment")
+    numbers = {"all": (0, 0, 0, 0)}
+    for row in tweets.aggregate([{"$match": {"sentiment": {"$exists": True}}}, {"$group": group}]):
+        counts = (row["total"], row["retweets"], row["quotes"], row["replies"])
+        numbers[row["_id"]] = counts
+        numbers["all"] = tuple(a + b for a, b in zip(numbers["all"], counts))
+    return numbers
 
 def number_of(tweets, condition={"$exists": True}):
     """
@@ -60,17 +235,22 @@ def number_of(tweets, condition={"$exists": True}):
     :condition -> sentiment condition (-1, 0, 1) obtained with text_analysis.sentiment_analysis()
     """
 
-    total = tweets.count_documents({"sentiment": condition})
-    rt = tweets.count_documents({"retweeted_status": {"$exists": True}, "sentiment": condition})
-    quotes = tweets.count_documents({"is_quote_status": True, "sentiment": condition})
-    replies = tweets.count_documents({"in_reply_to_status_id":{"$ne":None}, "is_quote_status": False, "sentiment": condition})
-    return total, rt, quotes, replies
+    if isinstance(tweets, TweetSnapshot):
+        return tweets.number_by_sentiment().get("all" if isinstance(condition, dict) else condition, (0, 0, 0, 0))
+
+    group = dict(_NUMBER_OF_GROUP, _id=None)
+    for row in tweets.aggregate([{"$match": {"sentiment": condition}}, {"$group": group}]):
+        return row["total"], row["retweets"], row["quotes"], row["replies"]
+    return 0, 0, 0, 0
 
 def get_char_count(collection, condition={"$exists": True}):
     """
     Gets average character count by Tweet in
-    :collection -> MongoDB collection obtained with find() or list of JSON documents
+    :collection -> MongoDB collection obtained with find() or list of JSON documents, or TweetSnapshot
     """
+    if isinstance(collection, TweetSnapshot):
+        return collection.char_count(condition)
+
     total_chars = 0
     count = 0
 